@@ -1,61 +1,19 @@
 """
 AI-агент Айра для диалогов с игроком
 """
-from openai import OpenAI
-from typing import Dict, Any, List, Optional
+import time
+from typing import Dict, Any, Iterator, List, Optional
 import config
+import context_builder
 import ethical_filter
+import fallback_engine
 import game_engine
+import llm_client
+import response_cache
 
 
-class AgentAira:
-    """Класс AI-агента Айра"""
-    
-    def __init__(self, player: game_engine.Player):
-        self.player = player
-        self.filter = ethical_filter.EthicalFilter()
-        
-        # Настраиваем OpenAI клиент
-        # Поддержка альтернативных API провайдеров (OpenRouter и др.)
-        self.client = None
-        
-        try:
-            # Проверяем, используется ли OpenRouter или другой альтернативный провайдер
-            if hasattr(config, 'OPENAI_BASE_URL') and config.OPENAI_BASE_URL:
-                # Для OpenRouter и других альтернативных провайдеров
-                # Используем base_url при создании клиента
-                import httpx
-                
-                # Создаем кастомный HTTP клиент для обхода проблем с proxies
-                http_client = httpx.Client(
-                    base_url=config.OPENAI_BASE_URL,
-                    headers={
-                        "Authorization": f"Bearer {config.OPENAI_API_KEY}",
-                        "HTTP-Referer": "https://github.com/innerquest-game",
-                        "X-Title": "InnerQuest Game"
-                    },
-                    timeout=30.0
-                )
-                
-                self.client = OpenAI(
-                    api_key=config.OPENAI_API_KEY,
-                    base_url=config.OPENAI_BASE_URL,
-                    http_client=http_client
-                )
-            else:
-                # Стандартный OpenAI API
-                self.client = OpenAI(api_key=config.OPENAI_API_KEY)
-        except Exception as e:
-            # Если ошибка при инициализации, пробуем простой вариант
-            try:
-                self.client = OpenAI(api_key=config.OPENAI_API_KEY)
-            except Exception as e2:
-                # Если ничего не работает, клиент будет None и будем использовать fallback
-                self.client = None
-                print(f"Warning: OpenAI client initialization failed: {e2}")
-        
-        # Системный промпт для Айры
-        self.system_prompt = """Ты — Айра, мудрый и сочувствующий AI-наставник в игре InnerQuest: Город Сфер. 
+# Системный промпт для Айры
+SYSTEM_PROMPT = """Ты — Айра, мудрый и сочувствующий AI-наставник в игре InnerQuest: Город Сфер. 
 
 Твоя роль:
 - Поддерживать игрока в трудные моменты
@@ -75,17 +33,52 @@ class AgentAira:
 ВАЖНО: Если игрок выражает суицидальные мысли или кризисные состояния, немедленно прекрати игровую роль и направь к профессиональной помощи.
 
 Контекст игры: Игрок работает над улучшением своей жизни через 5 кварталов города (Оазис-Здоровье, Форум-Отношения, Цитадель-Работа, Арсенал-Финансы, Сад-Личное развитие)."""
+
+# Кеш ответов модели, общий для процесса
+llm_cache = response_cache.ResponseCache(
+    ttl=getattr(config, 'LLM_CACHE_TTL_SECONDS', 600),
+    max_bytes=getattr(config, 'LLM_CACHE_MAX_BYTES', 8 * 1024 * 1024)
+)
+
+# Этический фильтр общий для всех запросов (индекс фраз строится один раз)
+_filter = ethical_filter.EthicalFilter()
+
+# Ответы без LLM (файл намерений перечитывается при изменении)
+_fallback = fallback_engine.FallbackEngine()
+
+
+class AgentAira:
+    """
+    Класс AI-агента Айра
+
+    Лёгкая обёртка на один запрос: фильтр и исполнитель запросов к LLM
+    (пул соединений, лимиты, предохранитель — llm_client) общие для процесса,
+    создаётся только привязка к игроку.
+    """
+    
+    def __init__(self, player: game_engine.Player):
+        self.player = player
+        self.filter = _filter
+        self.llm = llm_client.get_executor()
+        self.system_prompt = SYSTEM_PROMPT
     
     def generate_response(
         self, 
         user_message: str, 
         district: str = None,
         emotion: str = None,
-        session_context: Dict[str, Any] = None
-    ) -> Dict[str, Any]:
+        session_context: Dict[str, Any] = None,
+        stream: bool = False,
+        cache_bucket: tuple = None
+    ) -> Any:
         """
         Генерирует ответ Айры на сообщение игрока
         
+        При stream=True возвращает генератор событий (см. _stream_response).
+        cache_bucket — грубый ключ кеша для шаблонных запросов (приветствий): при
+        включённом LLM_CACHE_GREETING_BUCKETS ответ переиспользуется для всех
+        запросов с тем же ключом независимо от контекста игрока.
+        
         Returns:
             {
                 'response': str,
@@ -93,44 +86,35 @@ class AgentAira:
                 'helplines': list (если кризис)
             }
         """
-        # Проверяем этический фильтр
-        is_crisis, crisis_response = self.filter.check_message(user_message)
-        
-        if is_crisis:
-            return {
-                'response': crisis_response,
-                'is_crisis': True,
-                'helplines': self.filter.get_helplines_json(),
-                'block_game': True
-            }
+        if stream:
+            return self._stream_response(user_message, district, emotion, session_context, cache_bucket)
         
-        # Формируем контекст для промпта
-        context = self._build_context(district, emotion, session_context)
+        # Проверяем этический фильтр
+        crisis = self._check_crisis(user_message)
+        if crisis:
+            return crisis
         
-        # Формируем сообщения для API
-        messages = [
-            {'role': 'system', 'content': self.system_prompt},
-            {'role': 'user', 'content': context + f"\n\nИгрок говорит: {user_message}"}
-        ]
+        messages = self._build_messages(user_message, district, emotion, session_context)
+        cache_key = self._cache_key(messages, cache_bucket)
         
         try:
-            # Проверяем наличие клиента
-            if self.client is None:
-                raise Exception("OpenAI client not initialized")
-            
-            # Вызываем OpenAI API
-            response = self.client.chat.completions.create(
-                model=config.OPENAI_MODEL,
-                messages=messages,
-                temperature=0.7,
-                max_tokens=500
-            )
-            
-            ai_response = response.choices[0].message.content.strip()
-            
-            # Сохраняем в память агента
-            memory_text = f"Сессия в {district}: {emotion}. Игрок: {user_message[:100]}... Айра: {ai_response[:100]}..."
-            self.player.storage.add_agent_memory(memory_text)
+            ai_response = llm_cache.get(cache_key) if cache_key else None
+            if ai_response is None:
+                # Вызываем API (с дедлайном; при разомкнутом предохранителе — сразу ошибка)
+                started = time.monotonic()
+                ai_response = self.llm.chat(
+                    messages,
+                    model=config.OPENAI_MODEL,
+                    temperature=0.7,
+                    max_tokens=500
+                ).strip()
+                # Ответ с описанием способов не показываем, не кешируем и не запоминаем
+                unsafe = self._check_output(ai_response)
+                if unsafe:
+                    return self._unsafe_output_result(unsafe)
+                if cache_key and ai_response:
+                    llm_cache.put(cache_key, ai_response, time.monotonic() - started)
+            self._remember(user_message, ai_response, district, emotion)
             
             return {
                 'response': ai_response,
@@ -140,66 +124,185 @@ class AgentAira:
         
         except Exception as e:
             # Fallback ответ при ошибке API
-            return {
-                'response': f"Извини, у меня сейчас технические трудности. Но я слышу тебя. {self._generate_fallback_response(user_message)}",
-                'is_crisis': False,
-                'block_game': False,
-                'error': str(e)
-            }
+            return self._error_result(user_message, e, district, emotion)
     
-    def _build_context(
-        self, 
-        district: str = None, 
+    def _stream_response(
+        self,
+        user_message: str,
+        district: str = None,
         emotion: str = None,
-        session_context: Dict[str, Any] = None
-    ) -> str:
-        """Строит контекст для промпта на основе истории игрока"""
-        context_parts = []
-        
-        # Информация о текущей сессии
-        if district:
-            district_info = game_engine.City.get_district_info(district)
-            if district_info:
-                context_parts.append(f"Текущий квартал: {district_info['name']} ({district_info['description']})")
-        
-        if emotion:
-            context_parts.append(f"Эмоция игрока: {emotion}")
+        session_context: Dict[str, Any] = None,
+        cache_bucket: tuple = None
+    ) -> Iterator[Dict[str, Any]]:
+        """
+        Потоковая генерация ответа
+
+        Выдаёт события {'type': 'token', 'text': str} по мере прихода токенов и
+        в конце {'type': 'done', ...} с полным результатом (как у generate_response).
+        Полный текст сохраняется в память агента после окончания потока.
         
-        # История предыдущих сессий
-        history = self.player.get_session_history(limit=5)
-        if history:
-            context_parts.append("\nНедавние сессии:")
-            for session in history[-3:]:  # Последние 3 сессии
-                session_district = session.get('district', 'неизвестно')
-                session_emotion = session.get('emotion', 'неизвестно')
-                context_parts.append(f"- {session_district}: {session_emotion}")
+        Токены проходят через потоковый сканер фильтра: последнее недописанное
+        слово придерживается до проверки, а при срабатывании поток обрывается
+        и вместо ответа приходит безопасная замена (_unsafe_output_result).
+        """
+        crisis = self._check_crisis(user_message)
+        if crisis:
+            yield {'type': 'done', **crisis}
+            return
         
-        # Память агента
-        memory = self.player.get_agent_memory(limit=5)
-        if memory:
-            context_parts.append("\nВажные моменты из прошлого:")
-            for mem in memory[-3:]:  # Последние 3 записи
-                mem_text = mem.get('text', '')[:150]
-                context_parts.append(f"- {mem_text}...")
+        messages = self._build_messages(user_message, district, emotion, session_context)
+        cache_key = self._cache_key(messages, cache_bucket)
+        cached = llm_cache.get(cache_key) if cache_key else None
+        if cached is not None:
+            self._remember(user_message, cached, district, emotion)
+            yield {'type': 'token', 'text': cached}
+            yield {'type': 'done', 'response': cached, 'is_crisis': False, 'block_game': False}
+            return
         
-        # Текущий прогресс
-        points = self.player.get_stability_points()
-        context_parts.append(f"\nТекущие очки устойчивости: {points}")
+        parts: List[str] = []
+        complete = False
+        started = time.monotonic()
+        scanner = self.filter.stream_scanner() if getattr(config, 'FILTER_LLM_OUTPUT', True) else None
         
-        return "\n".join(context_parts)
-    
-    def _generate_fallback_response(self, user_message: str) -> str:
-        """Генерирует базовый ответ без API"""
-        message_lower = user_message.lower()
+        # Если клиент отключится, закрытие генератора отменит запрос к API
+        stream = self.llm.stream_chat(
+            messages,
+            model=config.OPENAI_MODEL,
+            temperature=0.7,
+            max_tokens=500
+        )
+        try:
+            for text in stream:
+                if scanner:
+                    text = scanner.feed(text)
+                    if scanner.match:
+                        break
+                if text:
+                    parts.append(text)
+                    yield {'type': 'token', 'text': text}
+            else:
+                complete = True
         
-        if any(word in message_lower for word in ['устал', 'усталость', 'выгорел']):
-            return "Понимаю, что ты чувствуешь усталость. Это нормально. Давай найдем маленькую опору — что-то, что принесло тебе сегодня хотя бы каплю комфорта?"
+        except Exception as e:
+            if not parts:
+                yield {'type': 'done', **self._error_result(user_message, e, district, emotion)}
+                return
+            # Поток оборвался на середине — сохраняем то, что успели получить
+            print(f"Ошибка потока ответа: {e}")
         
-        if any(word in message_lower for word in ['тревога', 'беспокойство', 'страх']):
-            return "Тревога — это сигнал. Давай сделаем паузу и заземлимся. Можешь назвать одно действие, которое помогает тебе чувствовать себя в безопасности?"
+        finally:
+            # При срабатывании фильтра — отменяем запрос к API
+            stream.close()
         
-        if any(word in message_lower for word in ['апатия', 'ничего не хочу', 'безразличие']):
-            return "Апатия говорит о том, что ресурсы на исходе. Не нужно больших действий — просто маленький шаг. Что это может быть?"
+        if scanner:
+            tail = scanner.finish()
+            if scanner.match:
+                yield {'type': 'done', **self._unsafe_output_result(scanner.match)}
+                return
+            if tail:
+                parts.append(tail)
+                yield {'type': 'token', 'text': tail}
         
-        return "Я здесь, чтобы поддержать тебя. Расскажи, что происходит?"
+        ai_response = ''.join(parts).strip()
+        if complete and cache_key and ai_response:
+            llm_cache.put(cache_key, ai_response, time.monotonic() - started)
+        self._remember(user_message, ai_response, district, emotion)
+        yield {
+            'type': 'done',
+            'response': ai_response,
+            'is_crisis': False,
+            'block_game': False
+        }
+    
+    def _check_crisis(self, user_message: str) -> Optional[Dict[str, Any]]:
+        """Результат для кризисного сообщения (None, если кризиса нет)"""
+        match = self.filter.find_crisis(user_message)
+        if not match:
+            return None
+        return self._crisis_result(match)
+    
+    def _check_output(self, ai_response: str) -> Optional[Dict[str, Any]]:
+        """Срабатывание фильтра на ответе модели (None, если ответ можно показать)"""
+        if not getattr(config, 'FILTER_LLM_OUTPUT', True):
+            return None
+        return self.filter.check_output(ai_response)
+    
+    def _crisis_result(self, match: Dict[str, Any]) -> Dict[str, Any]:
+        """Кризисный ответ с горячими линиями вместо ответа Айры"""
+        return {
+            'response': self.filter.get_crisis_response(),
+            'is_crisis': True,
+            'crisis_rule': match['rule'],
+            'helplines': self.filter.get_helplines_json(),
+            'block_game': True
+        }
+    
+    def _unsafe_output_result(self, match: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Замена ответа модели, остановленного фильтром
 
+        Сработал ответ модели, а не сообщение игрока, поэтому кризисом это не
+        считается: без горячих линий на весь экран и без блокировки игры.
+        """
+        return {
+            'response': self.filter.get_output_replacement(),
+            'is_crisis': False,
+            'output_filtered': match['rule'],
+            'block_game': False
+        }
+    
+    def _build_messages(
+        self,
+        user_message: str,
+        district: str = None,
+        emotion: str = None,
+        session_context: Dict[str, Any] = None
+    ) -> List[Dict[str, str]]:
+        """Сообщения для API: системный промпт и контекст игрока"""
+        context = self._build_context(district, emotion, session_context)
+        return [
+            {'role': 'system', 'content': self.system_prompt},
+            {'role': 'user', 'content': context + f"\n\nИгрок говорит: {user_message}"}
+        ]
+    
+    def _cache_key(self, messages: List[Dict[str, str]], cache_bucket: tuple = None) -> Optional[str]:
+        """Ключ кеша ответа (None — кеш выключен)"""
+        if not getattr(config, 'LLM_CACHE_ENABLED', True):
+            return None
+        if cache_bucket and getattr(config, 'LLM_CACHE_GREETING_BUCKETS', False):
+            return response_cache.make_key(config.OPENAI_MODEL, self.system_prompt, 'bucket', *cache_bucket)
+        return response_cache.make_key(config.OPENAI_MODEL, *(message['content'] for message in messages))
+    
+    def _remember(self, user_message: str, ai_response: str, district: str = None, emotion: str = None):
+        """Сохраняет реплику в память агента"""
+        memory_text = f"Сессия в {district}: {emotion}. Игрок: {user_message[:100]}... Айра: {ai_response[:100]}..."
+        self.player.storage.add_agent_memory(memory_text)
+    
+    def _error_result(
+        self,
+        user_message: str,
+        error: Exception,
+        district: str = None,
+        emotion: str = None
+    ) -> Dict[str, Any]:
+        """Fallback ответ при ошибке API"""
+        fallback = self._generate_fallback_response(user_message, district, emotion)
+        return {
+            'response': f"Извини, у меня сейчас технические трудности. Но я слышу тебя. {fallback}",
+            'is_crisis': False,
+            'block_game': False,
+            'error': str(error)
+        }
+    
+    def _build_context(
+        self, 
+        district: str = None, 
+        emotion: str = None,
+        session_context: Dict[str, Any] = None
+    ) -> str:
+        """Строит контекст для промпта на основе истории игрока (с бюджетом токенов и кешем)"""
+        return context_builder.build_context(self.player, district, emotion)
+    
+    def _generate_fallback_response(self, user_message: str, district: str = None, emotion: str = None) -> str:
+        """Генерирует базовый ответ без API (по намерениям из scenarios/fallback_intents.json)"""
+        return _fallback.respond(user_message, district, emotion)
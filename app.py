@@ -1,7 +1,9 @@
 """
 Flask приложение для игры InnerQuest: Город Сфер
 """
-from flask import Flask, render_template, request, jsonify
+import json
+import re
+from flask import Flask, render_template, request, jsonify, g, abort, Response, stream_with_context
 from flask_cors import CORS
 import game_engine
 import agent
@@ -10,6 +12,9 @@ import scenarios
 import cards
 import bosses
 import binary_trees
+import events
+import llm_client
+import storage
 
 app = Flask(__name__)
 CORS(app)
@@ -20,22 +25,84 @@ cards_manager = cards.CardsManager()
 bosses_manager = bosses.BossesManager()
 trees_manager = binary_trees.BinaryTreesManager()
 
-# Глобальный объект игрока (в продакшене лучше использовать сессии)
-current_player = None
+
+# Реестр игроков процесса: горячие игроки живут в памяти между запросами
+players = game_engine.PlayerRegistry(capacity=config.PLAYER_CACHE_SIZE)
+
+PLAYER_ID_PATTERN = re.compile(r'^[A-Za-z0-9_-]{1,64}$')
+
+
+def resolve_player_id() -> str:
+    """Определяет игрока по заголовку или cookie (иначе — игрок по умолчанию)"""
+    player_id = (
+        request.headers.get(config.PLAYER_ID_HEADER) or
+        request.cookies.get(config.PLAYER_ID_COOKIE) or
+        config.DEFAULT_PLAYER_ID
+    )
+    if not PLAYER_ID_PATTERN.match(player_id):
+        abort(400, description='Некорректный идентификатор игрока')
+    return player_id
 
 
 def get_player():
-    """Получает или создает объект игрока"""
-    global current_player
-    if current_player is None:
-        current_player = game_engine.Player("default")
-    return current_player
+    """Получает объект игрока текущего запроса"""
+    player = g.get('player')
+    if player is None:
+        player = g.player = players.acquire(resolve_player_id())
+    return player
+
+
+@app.after_request
+def remember_player_id(response):
+    """Закрепляет идентификатор игрока в cookie"""
+    player = g.get('player')
+    if player is not None and request.cookies.get(config.PLAYER_ID_COOKIE) != player.player_id:
+        response.set_cookie(
+            config.PLAYER_ID_COOKIE,
+            player.player_id,
+            max_age=365 * 24 * 3600,
+            httponly=True,
+            samesite='Lax'
+        )
+    return response
+
+
+@app.teardown_request
+def release_player(exc):
+    """Дописывает отложенное сохранение игрока и освобождает его в реестре"""
+    player = g.pop('player', None)
+    if player is None:
+        return
+    try:
+        if config.SAVE_FLUSH_ON_REQUEST_END:
+            with player.lock:
+                player.storage.flush()
+    finally:
+        players.release(player)
+
+
+def intensity_band(intensity) -> str:
+    """Диапазон интенсивности эмоции для группировки приветствий в кеше"""
+    try:
+        value = int(intensity)
+    except (TypeError, ValueError):
+        return 'unknown'
+    if value <= 3:
+        return 'low'
+    if value <= 6:
+        return 'medium'
+    return 'high'
 
 
 def build_districts_overview(player: game_engine.Player) -> dict:
     """Формирует данные по кварталам с визуалом"""
+    return districts_overview(player.data.get('districts', {}))
+
+
+def districts_overview(districts_data: dict) -> dict:
+    """Кварталы с визуалом по данным кварталов игрока"""
     districts = {}
-    for key, district_data in player.data.get('districts', {}).items():
+    for key, district_data in districts_data.items():
         districts[key] = {
             'name': district_data.get('name'),
             'level': district_data.get('level', 0),
@@ -66,6 +133,45 @@ def build_progress_payload(player: game_engine.Player, include_districts: bool =
     return payload
 
 
+# Поля прогресса, изменения которых отправляются клиенту как есть
+DELTA_FIELDS = (
+    'stability_points', 'effort', 'acts_completed', 'owned_cards',
+    'completed_levels', 'district_sessions', 'actions_history'
+)
+
+
+def progress_events(player_data: dict, before: dict) -> list:
+    """
+    События для клиента по итогам транзакции игрока (наблюдатель game_engine)
+    
+    progress_delta — изменившиеся поля прогресса (в формате /api/progress),
+    district_unlocked — открытые кварталы, cards_available — карты, ставшие
+    доступными или недоступными.
+    """
+    after = game_engine.progress_fields(player_data)
+    result = []
+    delta = {field: after[field] for field in DELTA_FIELDS if after[field] != before[field]}
+    if after['last_session_time'] != before['last_session_time']:
+        delta['last_session'] = after['last_session_time']
+    if after['districts'] != before['districts']:
+        delta['districts'] = districts_overview(after['districts'])
+        for key, district in after['districts'].items():
+            if district.get('unlocked') and not before['districts'].get(key, {}).get('unlocked'):
+                result.append(('district_unlocked', {'district': key, 'name': district.get('name')}))
+    if delta:
+        result.insert(0, ('progress_delta', delta))
+    
+    added, removed = cards_manager.available_changes(player_data)
+    if added or removed:
+        result.append(('cards_available', {'added': added, 'removed': removed}))
+    return result
+
+
+# Боссы и изменения прогресса проверяются в конце каждой транзакции игрока
+game_engine.observers.append(bosses_manager.on_player_change)
+game_engine.observers.append(progress_events)
+
+
 @app.route('/')
 def index():
     """Главная страница игры"""
@@ -140,7 +246,8 @@ def start_session():
         f"Начал сессию в {district_info['name']} с эмоцией {emotion} ({intensity}/10)",
         district=district_key,
         emotion=emotion,
-        session_context=greeting_context
+        session_context=greeting_context,
+        cache_bucket=('greeting', district_key, emotion, intensity_band(intensity))
     )
     
     return jsonify({
@@ -187,6 +294,66 @@ def agent_chat():
     })
 
 
+@app.route('/api/llm/status', methods=['GET'])
+def llm_status():
+    """Состояние слоя LLM: предохранитель, занятые слоты, счётчики, кеш ответов"""
+    return jsonify({
+        'success': True,
+        'llm': llm_client.get_executor().stats(),
+        'cache': agent.llm_cache.stats()
+    })
+
+
+def sse_event(event: str, data: dict, event_id: str = None) -> str:
+    """Форматирует событие Server-Sent Events"""
+    prefix = f"id: {event_id}\n" if event_id is not None else ''
+    return f"{prefix}event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+@app.route('/api/agent/chat/stream', methods=['POST'])
+def agent_chat_stream():
+    """Общение с агентом Айра с потоковой передачей ответа (SSE)"""
+    player = get_player()
+    aira = agent.AgentAira(player)
+    
+    data = request.get_json()
+    message = data.get('message', '')
+    
+    if not message:
+        return jsonify({
+            'success': False,
+            'error': 'Сообщение не может быть пустым'
+        }), 400
+    
+    stream_events = aira.generate_response(
+        message,
+        district=data.get('district'),
+        emotion=data.get('emotion'),
+        session_context=data.get('session_context', {}),
+        stream=True
+    )
+    
+    def generate():
+        for event in stream_events:
+            if event['type'] == 'token':
+                yield sse_event('token', {'text': event['text']})
+            else:
+                yield sse_event('done', {
+                    'success': True,
+                    'response': event['response'],
+                    'is_crisis': event.get('is_crisis', False),
+                    'block_game': event.get('block_game', False),
+                    'helplines': event.get('helplines', [])
+                })
+    
+    # stream_with_context держит контекст запроса (и игрока в реестре) до конца потока
+    return Response(
+        stream_with_context(generate()),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+
 @app.route('/api/minigame/complete', methods=['POST'])
 def complete_minigame():
     """Завершение мини-игры"""
@@ -244,7 +411,8 @@ def end_session():
 def save_game():
     """Сохранение игры"""
     player = get_player()
-    success = player.storage.save_player(player.data)
+    with player.lock:
+        success = player.storage.save_player(player.data) and player.storage.flush()
     
     return jsonify({
         'success': success,
@@ -292,22 +460,52 @@ def add_ritual():
 
 @app.route('/api/tree/start', methods=['GET'])
 def start_tree():
-    """Начинает бинарное дерево вопросов"""
+    """
+    Начинает бинарное дерево вопросов
+    
+    С ?prefetch=K в ответе есть nodes — узлы на K переходов вперёд от корня
+    (не глубже TREE_PREFETCH_MAX_DEPTH): клиент проходит их сам и сообщает
+    путь одним запросом в /api/tree/traverse/batch.
+    """
     tree_id = request.args.get('tree_id')
     district = request.args.get('district')
     
     root = trees_manager.get_root_question(tree_id)
     
     if root:
-        return jsonify({
+        payload = {
             'success': True,
             'root': root,
             'tree_id': tree_id
-        })
+        }
+        prefetch = request.args.get('prefetch', type=int)
+        if prefetch:
+            depth = min(max(prefetch, 0), getattr(config, 'TREE_PREFETCH_MAX_DEPTH', 6))
+            payload['nodes'] = trees_manager.subtree(tree_id, 'root', depth)
+        return jsonify(payload)
     
     return jsonify({'success': False, 'error': 'Дерево не найдено'}), 404
 
 
+def tree_step_payload(next_node: dict) -> dict:
+    """Ответ API по результату перехода: задание, конец дерева или следующий узел"""
+    if next_node.get('type') == 'task_trigger':
+        return {
+            'success': True,
+            'task_triggered': True,
+            'task': next_node
+        }
+    elif next_node.get('type') == 'end' or next_node.get('final'):
+        return {
+            'success': True,
+            'completed': True
+        }
+    return {
+        'success': True,
+        'next_node': next_node
+    }
+
+
 @app.route('/api/tree/traverse', methods=['POST'])
 def traverse_tree():
     """Обходит дерево на основе ответа"""
@@ -329,22 +527,7 @@ def traverse_tree():
         next_node = trees_manager.traverse(tree_id, node_id, answer)
         
         if next_node:
-            if next_node.get('type') == 'task_trigger':
-                return jsonify({
-                    'success': True,
-                    'task_triggered': True,
-                    'task': next_node
-                })
-            elif next_node.get('type') == 'end' or next_node.get('final'):
-                return jsonify({
-                    'success': True,
-                    'completed': True
-                })
-            else:
-                return jsonify({
-                    'success': True,
-                    'next_node': next_node
-                })
+            return jsonify(tree_step_payload(next_node))
         
         return jsonify({'success': False, 'error': 'Узел не найден или неверный ответ'}), 404
     except Exception as e:
@@ -352,6 +535,38 @@ def traverse_tree():
         return jsonify({'success': False, 'error': f'Внутренняя ошибка: {str(e)}'}), 500
 
 
+@app.route('/api/tree/traverse/batch', methods=['POST'])
+def traverse_tree_batch():
+    """
+    Обходит дерево по нескольким ответам за один запрос
+    
+    Тело: {'tree_id': ..., 'steps': [{'node_id': ..., 'answer': ...}, ...]}.
+    Ответ — как у /api/tree/traverse для последнего шага плюс path (id пройденных
+    узлов). При ошибке в середине пути — 404 с path до ошибочного шага.
+    """
+    data = request.get_json(silent=True)
+    if not data:
+        return jsonify({'success': False, 'error': 'Отсутствуют данные'}), 400
+    
+    tree_id = data.get('tree_id')
+    steps = data.get('steps')
+    
+    if not tree_id:
+        return jsonify({'success': False, 'error': 'Не указан tree_id'}), 400
+    
+    if not isinstance(steps, list) or not steps:
+        return jsonify({'success': False, 'error': 'Не указаны шаги'}), 400
+    
+    if len(steps) > getattr(config, 'TREE_BATCH_MAX_STEPS', 50):
+        return jsonify({'success': False, 'error': 'Слишком много шагов'}), 400
+    
+    walk = trees_manager.traverse_path(tree_id, steps)
+    if not walk['success']:
+        return jsonify(walk), 404
+    
+    return jsonify({**tree_step_payload(walk['result']), 'path': walk['path']})
+
+
 @app.route('/api/task/complete', methods=['POST'])
 def complete_task():
     """Завершает задание"""
@@ -361,37 +576,40 @@ def complete_task():
     task_data = data.get('task')
     result = data.get('result')
     
-    player.data.setdefault('actions_history', {})
-    player.data.setdefault('completed_levels', [])
-    
-    # Фиксируем выполнение задачи/микрошагов для разблокировок карт
-    task_key = (
-        (task_data or {}).get('action_key') or
-        (task_data or {}).get('task_type') or
-        (task_data or {}).get('type') or
-        'task_completed'
-    )
-    player.data['actions_history'][task_key] = player.data['actions_history'].get(task_key, 0) + 1
-
-    if (task_data or {}).get('type') == 'microstep' or (task_data or {}).get('task_type') == 'microstep':
-        player.data['actions_history']['microstep'] = player.data['actions_history'].get('microstep', 0) + 1
-
-    level_id = (task_data or {}).get('level_id')
-    if level_id and level_id not in player.data['completed_levels']:
-        player.data['completed_levels'].append(level_id)
+    with player.transaction():
+        player.data.setdefault('actions_history', {})
+        player.data.setdefault('completed_levels', [])
 
-    if (task_data or {}).get('act'):
-        player.data['acts_completed'] = max(
-            player.data.get('acts_completed', 0),
-            task_data.get('act')
+        # Фиксируем выполнение задачи/микрошагов для разблокировок карт
+        task_key = (
+            (task_data or {}).get('action_key') or
+            (task_data or {}).get('task_type') or
+            (task_data or {}).get('type') or
+            'task_completed'
         )
-    
-    # Начисляем Effort за выполнение
-    effort_earned = 1  # Базовый Effort за микрошаг
-    player.data['effort'] = player.data.get('effort', 0) + effort_earned
-    
-    # Сохраняем
-    player.storage.save_player(player.data)
+        player.data['actions_history'][task_key] = player.data['actions_history'].get(task_key, 0) + 1
+
+        if (task_data or {}).get('type') == 'microstep' or (task_data or {}).get('task_type') == 'microstep':
+            player.data['actions_history']['microstep'] = player.data['actions_history'].get('microstep', 0) + 1
+            # Микрошаги по категориям — для карт с условием microstep и category
+            category = (task_data or {}).get('category')
+            if category:
+                category_key = f"microstep:{category}"
+                player.data['actions_history'][category_key] = player.data['actions_history'].get(category_key, 0) + 1
+
+        level_id = (task_data or {}).get('level_id')
+        if level_id and level_id not in player.data['completed_levels']:
+            player.data['completed_levels'].append(level_id)
+
+        if (task_data or {}).get('act'):
+            player.data['acts_completed'] = max(
+                player.data.get('acts_completed', 0),
+                task_data.get('act')
+            )
+
+        # Начисляем Effort за выполнение
+        effort_earned = 1  # Базовый Effort за микрошаг
+        player.data['effort'] = player.data.get('effort', 0) + effort_earned
     
     return jsonify({
         'success': True,
@@ -443,10 +661,10 @@ def unlock_card():
     data = request.get_json()
     card_id = data.get('card_id')
     
-    result = cards_manager.unlock_card(card_id, player.data)
-    
-    if result.get('success'):
-        player.storage.save_player(player.data)
+    with player.transaction() as tx:
+        result = cards_manager.unlock_card(card_id, player.data)
+        if not result.get('success'):
+            tx.cancel()
     
     return jsonify(result)
 
@@ -458,10 +676,12 @@ def equip_card():
     data = request.get_json()
     card_id = data.get('card_id')
     
-    result = cards_manager.equip_card(card_id, player.data)
+    with player.transaction() as tx:
+        result = cards_manager.equip_card(card_id, player.data)
+        if not result.get('success'):
+            tx.cancel()
     
     if result.get('success'):
-        player.storage.save_player(player.data)
         card = cards_manager.get_card(card_id)
         result['card_name'] = card.get('name') if card else ''
     
@@ -475,26 +695,97 @@ def activate_card():
     data = request.get_json()
     card_id = data.get('card_id')
     
-    result = cards_manager.activate_card(card_id, player.data)
-    
-    if result.get('success'):
-        player.storage.save_player(player.data)
+    with player.transaction() as tx:
+        result = cards_manager.activate_card(card_id, player.data)
+        if not result.get('success'):
+            tx.cancel()
     
     return jsonify(result)
 
 
+def progress_snapshot(player_id: str, event_id: str) -> str:
+    """Событие progress с полным прогрессом игрока (вне контекста запроса)"""
+    player = players.acquire(player_id)
+    try:
+        # Сериализуем под блокировкой: в ответе ссылки на живые данные игрока
+        with player.lock:
+            return sse_event('progress', build_progress_payload(player, include_districts=True), event_id)
+    finally:
+        players.release(player)
+
+
+@app.route('/api/events', methods=['GET'])
+def player_events():
+    """
+    Поток событий игрока (SSE): боссы, открытые кварталы, карты, изменения прогресса
+    
+    Новое подключение начинается с события progress (полный снимок). При
+    переподключении браузер присылает Last-Event-ID, и поток дочитывает
+    пропущенные события; если они уже потеряны (перезапуск процесса, журнал
+    переполнен) или их больше EVENTS_CONNECTION_BUFFER, вместо них снова
+    отправляется снимок. В паузах — heartbeat-комментарий.
+    Игрок в реестре не удерживается между событиями.
+    """
+    player_id = resolve_player_id()
+    resume_id = events.hub.parse_id(
+        request.headers.get('Last-Event-ID') or request.args.get('last_event_id')
+    )
+    heartbeat = getattr(config, 'EVENTS_HEARTBEAT_SECONDS', 15.0)
+    buffer_size = getattr(config, 'EVENTS_CONNECTION_BUFFER', 50)
+    
+    def snapshot():
+        # id берётся до снимка: событие, пришедшее во время сборки, будет отправлено ещё раз
+        last_id = events.hub.last_id()
+        return last_id, progress_snapshot(player_id, events.hub.format_id(last_id))
+    
+    def generate():
+        yield f"retry: {getattr(config, 'EVENTS_RETRY_MS', 3000)}\n\n"
+        if resume_id is None:
+            last_id, message = snapshot()
+            yield message
+        else:
+            last_id = resume_id
+        while True:
+            batch = events.hub.wait(player_id, last_id, timeout=heartbeat)
+            if batch is None or len(batch) > buffer_size:
+                # Клиент отстал: пропущенное не дочитать — отправляем снимок
+                last_id, message = snapshot()
+                yield message
+                continue
+            for event in batch:
+                last_id = event['id']
+                yield sse_event(event['type'], event['data'], events.hub.format_id(event['id']))
+            if not batch:
+                # Без записи в сокет отключение клиента не заметить
+                yield ": heartbeat\n\n"
+    
+    return Response(
+        generate(),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+
 @app.route('/api/boss/check', methods=['GET'])
 def check_boss():
-    """Проверяет появление босса"""
+    """
+    Боссы, появившиеся после прошлого подтверждения
+    
+    Только чтение: боссы появляются в конце транзакций игрока (и сразу приходят
+    клиенту через /api/events), здесь триггеры не проверяются. Показанных
+    боссов клиент подтверждает через POST /api/boss/check.
+    """
     player = get_player()
     
-    boss = bosses_manager.check_boss_spawn(player.data)
+    with player.lock:
+        new_bosses = bosses_manager.new_bosses(player.data)
     
-    if boss:
+    if new_bosses:
         return jsonify({
             'success': True,
             'boss_spawned': True,
-            'boss': boss
+            'boss': new_bosses[-1],
+            'bosses': new_bosses
         })
     
     return jsonify({
@@ -503,6 +794,22 @@ def check_boss():
     })
 
 
+@app.route('/api/boss/check', methods=['POST'])
+def acknowledge_bosses():
+    """Подтверждает, что клиент показал появившихся боссов (boss_ids; без них — всех)"""
+    player = get_player()
+    data = request.get_json(silent=True) or {}
+    boss_ids = data.get('boss_ids')
+    if boss_ids is not None and not isinstance(boss_ids, list):
+        return jsonify({'success': False, 'error': 'boss_ids должен быть списком'}), 400
+    
+    with player.transaction() as tx:
+        if not bosses_manager.acknowledge_bosses(tx.data, boss_ids):
+            tx.cancel()
+    
+    return jsonify({'success': True})
+
+
 @app.route('/api/boss/defeat', methods=['POST'])
 def defeat_boss():
     """Побеждает босса"""
@@ -510,10 +817,10 @@ def defeat_boss():
     data = request.get_json()
     boss_id = data.get('boss_id')
     
-    result = bosses_manager.defeat_boss(boss_id, player.data)
-    
-    if result.get('success'):
-        player.storage.save_player(player.data)
+    with player.transaction() as tx:
+        result = bosses_manager.defeat_boss(boss_id, player.data)
+        if not result.get('success'):
+            tx.cancel()
     
     return jsonify(result)
 
@@ -566,8 +873,12 @@ def guru_ask():
 
 
 if __name__ == '__main__':
-    app.run(
-        host=config.FLASK_HOST,
-        port=config.FLASK_PORT,
-        debug=config.FLASK_DEBUG
-    )
+    try:
+        app.run(
+            host=config.FLASK_HOST,
+            port=config.FLASK_PORT,
+            debug=config.FLASK_DEBUG
+        )
+    finally:
+        players.flush_all()
+        storage.flush()
@@ -0,0 +1,155 @@
+"""
+Бенчмарк доступности карт: инкрементальный get_available_cards против полного обхода базы
+
+Полный обход замеряется двумя способами: прежний разбор JSON-условия
+на каждой проверке и пакетная проверка скомпилированных условий
+(conditions.evaluate_all).
+
+Запуск: python benchmarks/bench_cards.py [--cards N ...] [--steps N]
+База карт синтетическая (условия всех типов, в том числе вложенные combined).
+Игрок проходит --steps шагов (действия, сессии, очки, уровни, открытие и расход
+карт), после каждого шага запрашивается список доступных карт; результат
+сверяется с полным обходом.
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import cards
+import conditions
+import storage
+
+
+ACTIONS = [f"action_{i}" for i in range(40)]
+DISTRICTS = ['oasis', 'forum', 'citadel', 'arsenal', 'garden']
+LEVELS = [f"{district}_{i}" for district in DISTRICTS for i in range(1, 11)]
+
+
+def random_condition(rng: random.Random, depth: int = 0) -> dict:
+    kind = rng.choice(['action', 'sessions_in_district', 'complete_level', 'stability_points',
+                       'contract_completion', 'combined' if depth < 2 else 'action'])
+    if kind == 'action':
+        return {'type': 'action', 'action': rng.choice(ACTIONS), 'count': rng.randint(1, 30)}
+    if kind == 'sessions_in_district':
+        return {'type': 'sessions_in_district', 'district': rng.choice(DISTRICTS), 'count': rng.randint(1, 20)}
+    if kind == 'complete_level':
+        return {'type': 'complete_level', 'level': rng.choice(LEVELS)}
+    if kind == 'stability_points':
+        return {'type': 'stability_points', 'amount': rng.randint(10, 1000)}
+    if kind == 'contract_completion':
+        return {'type': 'contract_completion', 'contract': f"contract_{rng.randint(0, 50)}"}
+    return {'type': 'combined', 'conditions': [random_condition(rng, depth + 1) for _ in range(rng.randint(2, 3))]}
+
+
+def build_database(count: int, path: str):
+    rng = random.Random(count)
+    data = {'cards': [
+        {'card_id': f"card_{i}", 'type': 'skill', 'effort_cost': 1, 'unlock_condition': random_condition(rng)}
+        for i in range(count)
+    ]}
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(data, f)
+
+
+def mutate(player_data: dict, rng: random.Random):
+    """Один игровой шаг"""
+    roll = rng.random()
+    if roll < 0.5:
+        action = rng.choice(ACTIONS)
+        player_data['actions_history'][action] = player_data['actions_history'].get(action, 0) + 1
+    elif roll < 0.7:
+        district = rng.choice(DISTRICTS)
+        player_data['district_sessions'][district] = player_data['district_sessions'].get(district, 0) + 1
+    elif roll < 0.9:
+        player_data['stability_points'] += rng.randint(1, 15)
+    elif roll < 0.97:
+        player_data['completed_levels'].append(rng.choice(LEVELS))
+    else:
+        player_data.setdefault('completed_contracts', []).append(f"contract_{rng.randint(0, 50)}")
+
+
+def interpret(condition: dict, player_data: dict) -> bool:
+    """Прежний способ: разбор условия на каждой проверке"""
+    if not condition:
+        return True
+    kind = condition.get('type')
+    if kind == 'action':
+        return player_data.get('actions_history', {}).get(condition.get('action'), 0) >= condition.get('count', 1)
+    if kind == 'sessions_in_district':
+        return player_data.get('district_sessions', {}).get(condition.get('district'), 0) >= condition.get('count')
+    if kind == 'complete_level':
+        return condition.get('level') in player_data.get('completed_levels', [])
+    if kind == 'stability_points':
+        return player_data.get('stability_points', 0) >= condition.get('amount')
+    if kind == 'combined':
+        return all(interpret(inner, player_data) for inner in condition.get('conditions', []))
+    if kind == 'contract_completion':
+        return condition.get('contract') in player_data.get('completed_contracts', [])
+    return False
+
+
+def interpreted_scan(manager: cards.CardsManager, player_data: dict) -> list:
+    """Обход всей базы с разбором условий"""
+    owned = player_data.get('owned_cards', [])
+    return [
+        card for card_id, card in manager.cards_db.items()
+        if card_id not in owned and interpret(card.get('unlock_condition'), player_data)
+    ]
+
+
+def compiled_scan(manager: cards.CardsManager, player_data: dict) -> list:
+    """Обход всей базы пакетной проверкой скомпилированных условий"""
+    owned = player_data.get('owned_cards', [])
+    eligible = conditions.evaluate_all(manager._conditions.items(), player_data)
+    return [manager.cards_db[card_id] for card_id in eligible if card_id not in owned]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Бенчмарк доступности карт')
+    parser.add_argument('--cards', type=int, nargs='+', default=[100, 1000, 5000])
+    parser.add_argument('--steps', type=int, default=300)
+    args = parser.parse_args()
+
+    print(f"{'карт':>6}{'разбор, мкс':>14}{'компиляция, мкс':>18}{'инкрементально, мкс':>22}")
+    for count in args.cards:
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'cards.json')
+            build_database(count, path)
+            manager = cards.CardsManager(path)
+
+        player_data = storage._default_player_data('bench')
+        rng = random.Random(1)
+        interpreted_time = compiled_time = incremental_time = 0.0
+        for _ in range(args.steps):
+            mutate(player_data, rng)
+            started = time.perf_counter()
+            expected = interpreted_scan(manager, player_data)
+            interpreted_time += time.perf_counter() - started
+            started = time.perf_counter()
+            compiled = compiled_scan(manager, player_data)
+            compiled_time += time.perf_counter() - started
+            assert compiled == expected, "скомпилированные условия расходятся с разбором"
+            started = time.perf_counter()
+            actual = manager.get_available_cards(player_data)
+            incremental_time += time.perf_counter() - started
+            assert actual == expected, "инкрементальный результат расходится с полным обходом"
+            # Игрок иногда открывает доступную карту или расходует открытую
+            if actual and rng.random() < 0.1:
+                player_data['owned_cards'].append(rng.choice(actual)['card_id'])
+            elif player_data['owned_cards'] and rng.random() < 0.05:
+                player_data['owned_cards'].remove(rng.choice(player_data['owned_cards']))
+
+        print(
+            f"{count:>6}{interpreted_time / args.steps * 1e6:>14.1f}"
+            f"{compiled_time / args.steps * 1e6:>18.1f}{incremental_time / args.steps * 1e6:>22.1f}"
+        )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,107 @@
+"""
+Бенчмарк кризисного фильтра: проверок в секунду и время одной проверки
+
+Запуск: python benchmarks/bench_ethical_filter.py [--messages N] [--rules N]
+Корпус — синтетические русские сообщения разной длины (часть с кризисными фразами).
+Часть кризисных фраз в корпусе — в других формах, с пунктуацией и латиницей.
+Список правил расширяется синтетическими фразами до --rules, чтобы видеть,
+как растёт время проверки с числом правил. Для сравнения замеряется прежний
+способ — по регулярному выражению на фразу, по очереди.
+"""
+import argparse
+import os
+import random
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import ethical_filter
+
+
+WORDS = (
+    'сегодня работа опять давит и я не успеваю закончить отчёт начальник ждёт '
+    'вечером хочу погулять в парке но сил нет совсем устал от шума города '
+    'друзья зовут встретиться а мне тревожно выходить из дома спал плохо '
+    'думаю о деньгах кредит висит надо что то менять потихоньку начну с малого '
+    'в саду расцвели яблони пробую дышать медленно помогает немного'
+).split()
+
+VERBS = ['хочу', 'не могу', 'устал', 'боюсь', 'не вижу', 'надоело', 'нет сил', 'готов']
+OBJECTS = ['жить так', 'терпеть', 'просыпаться', 'выходить', 'притворяться', 'бороться',
+           'разговаривать', 'работать', 'ждать', 'надеяться', 'стараться', 'дышать']
+MODIFIERS = ['', 'больше', 'совсем', 'вообще', 'уже', 'никогда']
+TAILS = ['', 'дальше', 'одна', 'один', 'сама', 'сам', 'ради них', 'как раньше']
+
+
+def build_rules(count: int) -> tuple:
+    """Реальные правила плюс синтетические фразы до нужного числа"""
+    rules = list(ethical_filter.EthicalFilter.CRISIS_KEYWORDS)
+    rng = random.Random(7)
+    seen = set(rules)
+    while len(rules) < count:
+        words = [rng.choice(MODIFIERS), rng.choice(VERBS), rng.choice(OBJECTS), rng.choice(TAILS)]
+        phrase = ' '.join(word for word in words if word)
+        if phrase not in seen:
+            seen.add(phrase)
+            rules.append(phrase)
+    return tuple(rules)
+
+
+def build_corpus(count: int) -> list:
+    """Сообщения 5–120 слов; около 2% содержат кризисную фразу (половина — в другой форме)"""
+    rng = random.Random(42)
+    crisis = [
+        'не хочу жить', 'больше не выдержу', 'всё кончено', 'не вижу смысла',
+        'не хочется, жить', 'БОЛЬШЕ не выдержу!', 'все кончено', 'ne vizhu smysla'
+    ]
+    corpus = []
+    for _ in range(count):
+        words = [rng.choice(WORDS) for _ in range(rng.randint(5, 120))]
+        if rng.random() < 0.02:
+            words.insert(rng.randrange(len(words)), rng.choice(crisis))
+        corpus.append(' '.join(words).capitalize() + '.')
+    return corpus
+
+
+def bench(name: str, check, corpus: list):
+    started = time.perf_counter()
+    hits = sum(1 for message in corpus if check(message))
+    elapsed = time.perf_counter() - started
+    print(f"{name:<32}{len(corpus) / elapsed:>14.0f}{elapsed / len(corpus) * 1e6:>14.1f}{hits:>8}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Бенчмарк кризисного фильтра')
+    parser.add_argument('--messages', type=int, default=5000)
+    parser.add_argument('--rules', type=int, nargs='+', default=[16, 100, 300, 600])
+    args = parser.parse_args()
+
+    corpus = build_corpus(args.messages)
+    average = sum(len(message) for message in corpus) / len(corpus)
+    print(f"Сообщений: {len(corpus)}, средняя длина {average:.0f} символов")
+    print(f"{'способ':<32}{'проверок/с':>14}{'мкс/проверку':>14}{'кризис':>8}")
+
+    for count in args.rules:
+        rules = build_rules(count)
+
+        class Filter(ethical_filter.EthicalFilter):
+            CRISIS_KEYWORDS = list(rules)
+
+        combined = Filter()
+        sequential = [
+            re.compile(r'\s+'.join(re.escape(word.rstrip('*')) for word in phrase.split()), re.IGNORECASE)
+            for phrase in rules
+        ]
+
+        def check_sequential(message: str) -> bool:
+            lowered = message.lower()
+            return any(pattern.search(lowered) for pattern in sequential)
+
+        bench(f"по очереди, {len(rules)} правил", check_sequential, corpus)
+        bench(f"индекс основ, {len(rules)} правил", combined.find_crisis, corpus)
+
+
+if __name__ == '__main__':
+    main()
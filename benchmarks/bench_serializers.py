@@ -0,0 +1,92 @@
+"""
+Бенчмарк форматов сохранения: время записи/чтения и размер файла
+
+Запуск: python benchmarks/bench_serializers.py [--iterations N]
+Сохранение синтетическое, с заполненными до лимита историей сессий и памятью агента.
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import config
+import serializers
+import storage
+
+
+def build_save() -> dict:
+    """Синтетическое сохранение «долгого» игрока"""
+    data = storage._default_player_data('bench')
+    start = datetime(2025, 1, 1)
+    districts = list(data['districts'])
+    emotions = ['Тревога', 'Выгорание', 'Страх', 'Апатия', 'Раздражение']
+
+    for i in range(storage.JOURNALED_FIELDS['session_history']):
+        ts = (start + timedelta(hours=i)).isoformat()
+        data['session_history'].append({
+            'completed': True,
+            'district': districts[i % len(districts)],
+            'emotion': emotions[i % len(emotions)],
+            'intensity': i % 10 + 1,
+            'level_id': f"{districts[i % len(districts)]}_{i % 5 + 1}",
+            'started_at': ts,
+            'completed_at': ts,
+            'points_earned': 15,
+            'timestamp': ts,
+        })
+    for i in range(storage.JOURNALED_FIELDS['agent_memory']):
+        data['agent_memory'].append({
+            'text': (f"Сессия в {districts[i % len(districts)]}: {emotions[i % len(emotions)]}. "
+                     f"Игрок: Начал сессию с эмоцией ({i % 10 + 1}/10)... Айра: " + "Я рядом, давай разберём это вместе. " * 6),
+            'timestamp': (start + timedelta(hours=i)).isoformat(),
+        })
+    data['owned_cards'] = [f"card_{i}" for i in range(40)]
+    data['actions_history'] = {f"action_{i}": i for i in range(60)}
+    data['completed_levels'] = [f"{d}_{n}" for d in districts for n in range(1, 6)]
+    data['rituals'] = [{'name': f"Ритуал {i}", 'district': districts[i % 5]} for i in range(10)]
+    return data
+
+
+def bench(fmt: str, data: dict, directory: str, iterations: int) -> dict:
+    path = os.path.join(directory, f"bench_{fmt}.json")
+
+    started = time.perf_counter()
+    for _ in range(iterations):
+        storage._atomic_write(path, serializers.dumps(data, fmt))
+    save_ms = (time.perf_counter() - started) / iterations * 1000
+
+    started = time.perf_counter()
+    for _ in range(iterations):
+        with open(path, 'rb') as f:
+            serializers.loads(f.read())
+    load_ms = (time.perf_counter() - started) / iterations * 1000
+
+    return {'save_ms': save_ms, 'load_ms': load_ms, 'bytes': os.path.getsize(path)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Сравнение форматов сохранения')
+    parser.add_argument('--iterations', type=int, default=200)
+    args = parser.parse_args()
+
+    data = build_save()
+    encoders = [('stdlib json', False)]
+    if serializers.orjson is not None:
+        encoders.append(('orjson', True))
+    formats = [fmt for fmt in serializers.FORMATS if fmt != 'lz4' or serializers.lz4_frame is not None]
+
+    print(f"{'кодировщик':<12} {'формат':<8} {'запись, мс':>11} {'чтение, мс':>11} {'байт':>9}")
+    with tempfile.TemporaryDirectory() as directory:
+        for name, fast in encoders:
+            config.SAVE_FAST_JSON = fast
+            for fmt in formats:
+                result = bench(fmt, data, directory, args.iterations)
+                print(f"{name:<12} {fmt:<8} {result['save_ms']:>11.3f} {result['load_ms']:>11.3f} {result['bytes']:>9}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,88 @@
+"""
+Бенчмарк обхода деревьев вопросов: скомпилированная таблица узлов против прежнего обхода
+
+Запуск: python benchmarks/bench_trees.py [--options N ...] [--answers N]
+Дерево синтетическое: корень — шкала с диапазонами, дальше узлы выбора
+с N вариантами. Прежний способ (перебор вариантов, разбор "min-max" на каждом
+ответе) воспроизведён здесь для сравнения; результаты обоих сверяются.
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import binary_trees
+
+
+def build_tree(options: int) -> dict:
+    """Шкала 1–100 из 20 диапазонов, за ней узлы выбора с options вариантами"""
+    nodes = {}
+    branches = {}
+    for index in range(20):
+        node_id = f"choice_{index}"
+        branches[f"{index * 5 + 1}-{index * 5 + 5}"] = node_id
+        nodes[node_id] = {
+            'node_id': node_id, 'text': f"Вопрос {index}", 'type': 'choice',
+            'options': [{'text': f"Вариант {index}.{option}", 'next': 'task'} for option in range(options)]
+        }
+    nodes['task'] = {'node_id': 'task', 'text': 'Задание', 'type': 'task_trigger', 'task_type': 'timer'}
+    root = {'node_id': 'root', 'text': 'Оцени от 1 до 100', 'type': 'scale', 'min': 1, 'max': 100, 'branches': branches}
+    return {'trees': {'bench': {'tree_id': 'bench', 'root': root, 'nodes': nodes}}}
+
+
+def legacy_traverse(manager: binary_trees.BinaryTreesManager, tree_id: str, node_id: str, answer):
+    """Прежний обход (только шкала и выбор)"""
+    tree = manager.get_tree(tree_id)
+    node = tree['root'] if node_id == 'root' else tree['nodes'].get(node_id)
+    if node['type'] == 'choice':
+        for option in node.get('options', []):
+            if option['text'] == answer or option.get('id') == answer:
+                return manager.get_node(tree_id, option['next'])
+    elif node['type'] == 'scale':
+        value = int(answer)
+        for range_key, next_id in node.get('branches', {}).items():
+            low, high = map(int, range_key.split('-'))
+            if low <= value <= high:
+                return manager.get_node(tree_id, next_id)
+    return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Бенчмарк обхода деревьев вопросов')
+    parser.add_argument('--options', type=int, nargs='+', default=[3, 10, 50])
+    parser.add_argument('--answers', type=int, default=20000)
+    args = parser.parse_args()
+
+    print(f"{'вариантов':>10}{'прежний, мкс':>16}{'таблица, мкс':>16}")
+    for options in args.options:
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'trees.json')
+            with open(path, 'w', encoding='utf-8') as f:
+                json.dump(build_tree(options), f)
+            manager = binary_trees.BinaryTreesManager(path)
+
+        rng = random.Random(options)
+        steps = []
+        for _ in range(args.answers // 2):
+            value = rng.randint(1, 100)
+            steps.append(('root', str(value)))
+            steps.append((f"choice_{(value - 1) // 5}", f"Вариант {(value - 1) // 5}.{rng.randrange(options)}"))
+
+        started = time.perf_counter()
+        expected = [legacy_traverse(manager, 'bench', node_id, answer) for node_id, answer in steps]
+        legacy_time = time.perf_counter() - started
+        started = time.perf_counter()
+        actual = [manager.traverse('bench', node_id, answer) for node_id, answer in steps]
+        compiled_time = time.perf_counter() - started
+        assert actual == expected, "таблица узлов расходится с прежним обходом"
+
+        print(f"{options:>10}{legacy_time / len(steps) * 1e6:>16.2f}{compiled_time / len(steps) * 1e6:>16.2f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,196 @@
+"""
+Локальный OpenAI-совместимый сервер-заглушка для нагрузочных тестов
+
+Отвечает на POST /v1/chat/completions (обычный ответ и поток SSE) и GET /v1/models.
+Задержки, ошибки и ответы 429 настраиваются, поэтому можно воспроизвести и медленный,
+и сбоящий провайдер, не тратя запросы OpenRouter.
+
+Запуск:
+    python benchmarks/fake_llm_server.py --port 8911 --latency 0.8 --jitter 0.5 --error-rate 0.02
+    OPENAI_BASE_URL=http://127.0.0.1:8911/v1 python app.py
+"""
+import argparse
+import json
+import random
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+REPLY = (
+    "Я слышу тебя. Давай сделаем паузу и заземлимся: назови три вещи, которые ты видишь "
+    "вокруг, и одно маленькое действие, которое можно сделать в ближайшие десять минут. "
+    "В этом квартале города даже небольшой шаг зажигает свет в окнах."
+)
+
+
+class Settings:
+    """Параметры поведения сервера"""
+
+    def __init__(self, args: argparse.Namespace):
+        self.latency = args.latency
+        self.jitter = args.jitter
+        self.distribution = args.distribution
+        self.token_delay = args.token_delay
+        self.error_rate = args.error_rate
+        self.rate_limit = args.rate_limit
+        self.reply = args.reply or REPLY
+        self._window_start = time.monotonic()
+        self._window_count = 0
+        self._lock = threading.Lock()
+
+    def sample_latency(self) -> float:
+        """Время до первого токена согласно выбранному распределению"""
+        if self.distribution == 'lognormal' and self.latency > 0:
+            # Медиана = latency, jitter — сигма логнормального распределения
+            return random.lognormvariate(0, self.jitter) * self.latency
+        if self.distribution == 'exponential' and self.latency > 0:
+            return random.expovariate(1 / self.latency)
+        return max(0.0, self.latency + random.uniform(-self.jitter, self.jitter))
+
+    def rate_limited(self) -> bool:
+        """Превышен ли лимит запросов в секунду"""
+        if not self.rate_limit:
+            return False
+        with self._lock:
+            now = time.monotonic()
+            if now - self._window_start >= 1.0:
+                self._window_start = now
+                self._window_count = 0
+            self._window_count += 1
+            return self._window_count > self.rate_limit
+
+
+class Handler(BaseHTTPRequestHandler):
+    settings: Settings = None
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def _json(self, status: int, payload: dict, headers: dict = None):
+        body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path.rstrip('/').endswith('/models'):
+            self._json(200, {'object': 'list', 'data': [{'id': 'fake-model', 'object': 'model'}]})
+        else:
+            self._json(404, {'error': {'message': 'not found'}})
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        try:
+            request = json.loads(self.rfile.read(length) or b'{}')
+        except ValueError:
+            self._json(400, {'error': {'message': 'invalid json', 'type': 'invalid_request_error'}})
+            return
+
+        if not self.path.rstrip('/').endswith('/chat/completions'):
+            self._json(404, {'error': {'message': 'not found'}})
+            return
+
+        settings = self.settings
+        if settings.rate_limited():
+            self._json(429, {'error': {'message': 'Rate limit exceeded', 'type': 'rate_limit_error'}},
+                       headers={'Retry-After': '1'})
+            return
+        if random.random() < settings.error_rate:
+            self._json(500, {'error': {'message': 'Injected upstream error', 'type': 'server_error'}})
+            return
+
+        time.sleep(settings.sample_latency())
+        model = request.get('model', 'fake-model')
+        if request.get('stream'):
+            self._stream(model)
+        else:
+            self._complete(model)
+
+    def _complete(self, model: str):
+        words = self.settings.reply.split(' ')
+        time.sleep(self.settings.token_delay * len(words))
+        self._json(200, {
+            'id': f"chatcmpl-{uuid.uuid4().hex}",
+            'object': 'chat.completion',
+            'created': int(time.time()),
+            'model': model,
+            'choices': [{
+                'index': 0,
+                'message': {'role': 'assistant', 'content': self.settings.reply},
+                'finish_reason': 'stop'
+            }],
+            'usage': {'prompt_tokens': 0, 'completion_tokens': len(words), 'total_tokens': len(words)}
+        })
+
+    def _stream(self, model: str):
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Cache-Control', 'no-cache')
+        self.send_header('Connection', 'close')
+        self.end_headers()
+        completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+
+        def chunk(delta: dict, finish_reason=None):
+            payload = {
+                'id': completion_id,
+                'object': 'chat.completion.chunk',
+                'created': int(time.time()),
+                'model': model,
+                'choices': [{'index': 0, 'delta': delta, 'finish_reason': finish_reason}]
+            }
+            self.wfile.write(f"data: {json.dumps(payload, ensure_ascii=False)}\n\n".encode('utf-8'))
+            self.wfile.flush()
+
+        try:
+            chunk({'role': 'assistant', 'content': ''})
+            words = self.settings.reply.split(' ')
+            for index, word in enumerate(words):
+                chunk({'content': word if index == 0 else ' ' + word})
+                time.sleep(self.settings.token_delay)
+            chunk({}, 'stop')
+            self.wfile.write(b"data: [DONE]\n\n")
+            self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+        self.close_connection = True
+
+
+def serve(args: argparse.Namespace) -> ThreadingHTTPServer:
+    """Создаёт сервер (запуск — serve_forever)"""
+    handler = type('ConfiguredHandler', (Handler,), {'settings': Settings(args)})
+    server = ThreadingHTTPServer((args.host, args.port), handler)
+    server.daemon_threads = True
+    return server
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description='OpenAI-совместимая заглушка LLM')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8911)
+    parser.add_argument('--latency', type=float, default=0.5, help='Задержка до первого токена, с')
+    parser.add_argument('--jitter', type=float, default=0.2,
+                        help='Разброс задержки (для lognormal — сигма)')
+    parser.add_argument('--distribution', choices=['uniform', 'lognormal', 'exponential'], default='uniform')
+    parser.add_argument('--token-delay', type=float, default=0.02, help='Пауза между токенами, с')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='Доля ответов 500')
+    parser.add_argument('--rate-limit', type=int, default=0, help='Запросов в секунду до ответов 429 (0 — без лимита)')
+    parser.add_argument('--reply', default=None, help='Текст ответа')
+    return parser
+
+
+if __name__ == '__main__':
+    args = build_parser().parse_args()
+    server = serve(args)
+    print(f"Fake LLM: http://{args.host}:{args.port}/v1 (latency={args.latency}s, "
+          f"errors={args.error_rate:.0%}, rate_limit={args.rate_limit or '—'})")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,229 @@
+"""
+Нагрузочный тест эндпоинтов игры: проигрывает типичные сессии игроков
+
+Каждый сценарий — одна сессия: старт сессии, обход бинарного дерева квартала,
+реплика в чате с Айрой, выполнение задания, завершение сессии. Сценарии
+запускаются с заданной частотой (открытая модель нагрузки: новые сессии
+стартуют по расписанию, не дожидаясь завершения предыдущих), игроки берутся
+из пула X-Player-Id. В конце — число запросов, ошибки, p50/p95/p99 и
+пропускная способность по каждому эндпоинту.
+
+Запуск (LLM лучше заменить заглушкой, см. fake_llm_server.py):
+    python benchmarks/fake_llm_server.py --latency 0.8 --distribution lognormal --jitter 0.4 &
+    OPENAI_BASE_URL=http://127.0.0.1:8911/v1 python app.py &
+    python benchmarks/load_test.py --base-url http://127.0.0.1:5001 --rps 5 --duration 60
+"""
+import argparse
+import json
+import math
+import os
+import random
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Any, List, Optional
+import httpx
+
+
+SCENARIOS_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'scenarios', 'binary_trees.json')
+
+# Кварталы, открытые новому игроку (форум разблокируется позже)
+DISTRICTS = ['citadel', 'oasis', 'arsenal', 'garden']
+EMOTIONS = ['Тревога', 'Выгорание', 'Страх', 'Апатия', 'Раздражение']
+MESSAGES = [
+    'Не могу собраться, всё валится из рук',
+    'Кажется, я опять взял на себя слишком много',
+    'Сегодня чуть лучше, но тревога не уходит',
+    'Что мне сделать прямо сейчас?',
+    'Устал от постоянной гонки'
+]
+MAX_TREE_STEPS = 10
+
+
+class Recorder:
+    """Латентности и ошибки по эндпоинтам"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        self.errors: Dict[str, int] = defaultdict(int)
+        self.flows = 0
+        self.failed_flows = 0
+
+    def record(self, endpoint: str, seconds: float, ok: bool):
+        with self._lock:
+            self.latencies[endpoint].append(seconds)
+            if not ok:
+                self.errors[endpoint] += 1
+
+    def flow_done(self, ok: bool):
+        with self._lock:
+            self.flows += 1
+            if not ok:
+                self.failed_flows += 1
+
+
+def percentile(values: List[float], pct: float) -> float:
+    """Перцентиль (ближайший ранг) по отсортированному списку"""
+    if not values:
+        return 0.0
+    rank = math.ceil(pct / 100 * len(values))
+    return values[max(0, min(len(values), rank) - 1)]
+
+
+class SessionFlow:
+    """Одна игровая сессия игрока"""
+
+    def __init__(self, client: httpx.Client, recorder: Recorder, trees: Dict[str, str], player_id: str, stream: bool):
+        self.client = client
+        self.recorder = recorder
+        self.trees = trees
+        self.headers = {'X-Player-Id': player_id}
+        self.stream = stream
+
+    def call(self, endpoint: str, method: str, path: str, **kwargs) -> Optional[Dict[str, Any]]:
+        """Запрос с замером; None при ошибке"""
+        started = time.perf_counter()
+        ok = False
+        payload = None
+        try:
+            if endpoint.endswith('/stream'):
+                # Для потока меряем время до последнего события
+                with self.client.stream(method, path, headers=self.headers, **kwargs) as response:
+                    events = [line for line in response.iter_lines() if line.startswith('event:')]
+                    ok = response.status_code == 200 and 'event: done' in events
+                    payload = {'success': ok}
+            else:
+                response = self.client.request(method, path, headers=self.headers, **kwargs)
+                ok = response.status_code < 400
+                payload = response.json()
+        except (httpx.HTTPError, ValueError) as e:
+            print(f"Ошибка запроса {endpoint}: {e}")
+        finally:
+            self.recorder.record(endpoint, time.perf_counter() - started, ok)
+        return payload if ok else None
+
+    def run(self) -> bool:
+        district = random.choice(DISTRICTS)
+        emotion = random.choice(EMOTIONS)
+        session = self.call('POST /api/session/start', 'POST', '/api/session/start', json={
+            'district': district, 'emotion': emotion, 'intensity': random.randint(1, 10)
+        })
+        if not session:
+            return False
+
+        task = self.walk_tree(self.trees.get(district)) or {'type': 'microstep', 'task_type': 'microstep'}
+
+        chat_endpoint = '/api/agent/chat/stream' if self.stream else '/api/agent/chat'
+        if not self.call(f'POST {chat_endpoint}', 'POST', chat_endpoint, json={
+            'message': random.choice(MESSAGES), 'district': district, 'emotion': emotion
+        }):
+            return False
+
+        if not self.call('POST /api/task/complete', 'POST', '/api/task/complete', json={'task': task}):
+            return False
+
+        return self.call('POST /api/session/end', 'POST', '/api/session/end', json={
+            'session': session.get('session', {'district': district, 'emotion': emotion}),
+            'points': 15
+        }) is not None
+
+    def walk_tree(self, tree_id: Optional[str]) -> Optional[Dict[str, Any]]:
+        """Проходит дерево случайными ответами до задания или конца"""
+        if not tree_id:
+            return None
+        start = self.call('GET /api/tree/start', 'GET', '/api/tree/start', params={'tree_id': tree_id})
+        node = start.get('root') if start else None
+        for _ in range(MAX_TREE_STEPS):
+            if not node or node.get('type') not in ('choice', 'scale'):
+                return None
+            if node['type'] == 'choice':
+                option = random.choice(node.get('options') or [{}])
+                answer = option.get('id') or option.get('text')
+            else:
+                answer = random.randint(node.get('min', 1), node.get('max', 10))
+            result = self.call('POST /api/tree/traverse', 'POST', '/api/tree/traverse', json={
+                'tree_id': tree_id, 'node_id': node.get('node_id', 'root'), 'answer': answer
+            })
+            if not result or result.get('completed'):
+                return None
+            if result.get('task_triggered'):
+                return result['task']
+            node = result.get('next_node')
+        return None
+
+
+def load_trees() -> Dict[str, str]:
+    """Первое дерево каждого квартала"""
+    with open(SCENARIOS_PATH, 'r', encoding='utf-8') as f:
+        trees = json.load(f).get('trees', {})
+    mapping = {}
+    for tree_id, tree in trees.items():
+        mapping.setdefault(tree.get('district'), tree_id)
+    return mapping
+
+
+def report(recorder: Recorder, elapsed: float):
+    """Таблица по эндпоинтам"""
+    print(f"\nСценариев: {recorder.flows} (с ошибками: {recorder.failed_flows}) за {elapsed:.1f} с")
+    print(f"{'эндпоинт':<34}{'запросов':>9}{'ошибок':>8}{'p50, мс':>10}{'p95, мс':>10}{'p99, мс':>10}{'req/s':>8}")
+    for endpoint in sorted(recorder.latencies):
+        values = sorted(recorder.latencies[endpoint])
+        print(
+            f"{endpoint:<34}{len(values):>9}{recorder.errors[endpoint]:>8}"
+            f"{percentile(values, 50) * 1000:>10.1f}{percentile(values, 95) * 1000:>10.1f}"
+            f"{percentile(values, 99) * 1000:>10.1f}{len(values) / elapsed:>8.1f}"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Нагрузочный тест игровых сессий')
+    parser.add_argument('--base-url', default='http://127.0.0.1:5001')
+    parser.add_argument('--rps', type=float, default=2.0, help='Новых сессий в секунду')
+    parser.add_argument('--duration', type=float, default=30.0, help='Длительность подачи нагрузки, с')
+    parser.add_argument('--players', type=int, default=50, help='Размер пула игроков')
+    parser.add_argument('--workers', type=int, default=64, help='Максимум одновременных сессий')
+    parser.add_argument('--stream', action='store_true', help='Чат через /api/agent/chat/stream')
+    parser.add_argument('--timeout', type=float, default=60.0)
+    args = parser.parse_args()
+
+    trees = load_trees()
+    recorder = Recorder()
+    client = httpx.Client(
+        base_url=args.base_url,
+        timeout=args.timeout,
+        limits=httpx.Limits(max_connections=args.workers, max_keepalive_connections=args.workers)
+    )
+
+    def flow(index: int):
+        player_id = f"load-{index % args.players}"
+        try:
+            ok = SessionFlow(client, recorder, trees, player_id, args.stream).run()
+        except Exception as e:
+            print(f"Ошибка сценария {player_id}: {e}")
+            ok = False
+        recorder.flow_done(ok)
+
+    print(f"Нагрузка: {args.rps} сессий/с в течение {args.duration} с на {args.base_url}")
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.workers) as pool:
+        index = 0
+        while True:
+            # Открытая модель: следующий старт по расписанию, а не по завершении предыдущего
+            scheduled = started + index / args.rps
+            if scheduled - started >= args.duration:
+                break
+            delay = scheduled - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            pool.submit(flow, index)
+            index += 1
+    elapsed = time.perf_counter() - started
+    client.close()
+
+    report(recorder, elapsed)
+
+
+if __name__ == '__main__':
+    main()
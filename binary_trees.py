@@ -1,9 +1,50 @@
 """
 Обработка бинарных деревьев вопросов
+
+Деревья компилируются при загрузке в таблицу узлов: для каждого узла заранее
+найдены результаты всех переходов. Варианты ответа — словарь по тексту и id,
+диапазоны шкалы ("1-3", "4-6", ...) — отсортированные границы для bisect.
+Ссылки на несуществующие узлы, некорректные и пересекающиеся диапазоны,
+неизвестные типы узлов выводятся при загрузке; переход по такой ссылке,
+как и раньше, даёт «узел не найден». Обход по ответу — пара поисков в словаре.
+
+Чтобы клиент не ходил на сервер за каждым ответом, есть предзагрузка поддерева
+на K шагов вперёд (subtree) и проверка целого пути ответов за один запрос
+(traverse_path).
 """
+import bisect
 import json
 import os
-from typing import Dict, Any, Optional
+from typing import Dict, Any, List, Optional, Tuple
+
+
+# Результаты переходов, не ведущие в узел (те же словари, что отдавал обход раньше)
+END_RESULT = {'type': 'end', 'final': True}
+TASK_RESULT = {'type': 'task_trigger', 'final': True}
+
+NODE_TYPES = ('choice', 'scale', 'task_trigger', 'reflection', 'open_or_choice')
+
+
+class CompiledNode:
+    """Узел дерева с заранее вычисленными переходами (не изменяется после загрузки)"""
+
+    __slots__ = ('node', 'type', 'options', 'default', 'starts', 'ends', 'targets', 'result', 'children')
+
+    def __init__(self, node: Dict[str, Any]):
+        self.node = node
+        self.type = node.get('type')
+        # Ответ (текст или id варианта) -> результат перехода; None — узла нет
+        self.options: Dict[Any, Optional[Dict[str, Any]]] = {}
+        # Переход по умолчанию (next у шкалы и открытого вопроса, leads_to у рефлексии)
+        self.default: Optional[Dict[str, Any]] = None
+        # Диапазоны шкалы: начала по возрастанию, концы и результаты в том же порядке
+        self.starts: List[int] = []
+        self.ends: List[int] = []
+        self.targets: List[Optional[Dict[str, Any]]] = []
+        # Готовый ответ узла-задания
+        self.result: Optional[Dict[str, Any]] = None
+        # id узлов, в которые можно перейти из этого (для предзагрузки поддерева)
+        self.children: Tuple[str, ...] = ()
 
 
 class BinaryTreesManager:
@@ -12,14 +53,108 @@ class BinaryTreesManager:
     def __init__(self, trees_path: str = "scenarios/binary_trees.json"):
         self.trees_path = trees_path
         self.trees = {}
+        # tree_id -> node_id ('root' для корня) -> CompiledNode
+        self._compiled: Dict[str, Dict[str, CompiledNode]] = {}
         self.load_trees()
     
     def load_trees(self):
-        """Загружает деревья вопросов"""
+        """Загружает и компилирует деревья вопросов"""
         if os.path.exists(self.trees_path):
             with open(self.trees_path, 'r', encoding='utf-8') as f:
                 data = json.load(f)
                 self.trees = data.get('trees', {})
+        self._compiled = {}
+        for tree_id, tree in self.trees.items():
+            errors: List[str] = []
+            self._compiled[tree_id] = self._compile_tree(tree, errors)
+            if errors:
+                print(f"Ошибки в дереве {tree_id}: {'; '.join(errors)}")
+    
+    def _compile_tree(self, tree: Dict[str, Any], errors: List[str]) -> Dict[str, CompiledNode]:
+        """Таблица узлов дерева; проблемы складываются в errors"""
+        raw_nodes = dict(tree.get('nodes', {}))
+        if tree.get('root'):
+            raw_nodes['root'] = tree['root']
+        table = {node_id: CompiledNode(node) for node_id, node in raw_nodes.items()}
+        
+        def target(source: str, next_id: Any) -> Optional[Dict[str, Any]]:
+            """Узел, в который ведёт ссылка (None и сообщение, если узла нет)"""
+            if next_id in raw_nodes:
+                if next_id not in table[source].children:
+                    table[source].children += (next_id,)
+                return raw_nodes[next_id]
+            errors.append(f"{source} -> {next_id!r}: узла нет")
+            return None
+        
+        for node_id, compiled in table.items():
+            node = compiled.node
+            if compiled.type not in NODE_TYPES:
+                errors.append(f"узел {node_id}: неизвестный тип {compiled.type!r}")
+            
+            elif compiled.type in ('choice', 'open_or_choice'):
+                field = 'options' if compiled.type == 'choice' else 'fallback_options'
+                for option in node.get(field, []):
+                    next_id = option.get('next')
+                    if next_id:
+                        result = target(node_id, next_id)
+                    else:
+                        # Вариант без next: выбор завершает дерево, fallback — не находит узел
+                        result = END_RESULT if compiled.type == 'choice' else None
+                    # При совпадении текста или id у нескольких вариантов побеждает первый
+                    for key in (option.get('text'), option.get('id')):
+                        if key is not None:
+                            compiled.options.setdefault(key, result)
+                if compiled.type == 'open_or_choice':
+                    compiled.default = target(node_id, node['next']) if node.get('next') else END_RESULT
+            
+            elif compiled.type == 'scale':
+                ranges = []
+                for range_key, next_id in node.get('branches', {}).items():
+                    bounds = self._parse_range(range_key)
+                    if bounds is None:
+                        errors.append(f"узел {node_id}: некорректный диапазон {range_key!r}")
+                        continue
+                    ranges.append((bounds, target(node_id, next_id)))
+                ranges.sort(key=lambda item: item[0])
+                for (low, high), result in ranges:
+                    if compiled.ends and low <= compiled.ends[-1]:
+                        # Раньше побеждал диапазон, записанный первым; теперь пересечение — ошибка данных
+                        errors.append(f"узел {node_id}: диапазон {low}-{high} пересекается с соседним")
+                        continue
+                    compiled.starts.append(low)
+                    compiled.ends.append(high)
+                    compiled.targets.append(result)
+                if node.get('next'):
+                    compiled.default = target(node_id, node['next'])
+            
+            elif compiled.type == 'reflection':
+                leads_to = node.get('leads_to')
+                if leads_to == 'task':
+                    compiled.default = TASK_RESULT
+                elif leads_to:
+                    compiled.default = target(node_id, leads_to)
+            
+            elif compiled.type == 'task_trigger':
+                compiled.result = {
+                    'type': 'task_trigger',
+                    'task_type': node.get('task_type'),
+                    'task_text': node.get('task_text'),
+                    'duration': node.get('duration'),
+                    'guidance': node.get('guidance')
+                }
+        return table
+    
+    @staticmethod
+    def _parse_range(range_key: str) -> Optional[Tuple[int, int]]:
+        """Границы диапазона "min-max" (None, если строка некорректна)"""
+        low, separator, high = str(range_key).partition('-')
+        try:
+            bounds = int(low), int(high)
+        except ValueError:
+            return None
+        if not separator or bounds[0] > bounds[1]:
+            return None
+        return bounds
     
     def get_tree(self, tree_id: str) -> Optional[Dict[str, Any]]:
         """Получает дерево по ID"""
@@ -34,94 +169,101 @@ class BinaryTreesManager:
     
     def traverse(self, tree_id: str, node_id: str, answer: Any) -> Optional[Dict[str, Any]]:
         """Обходит дерево на основе ответа"""
-        tree = self.get_tree(tree_id)
-        if not tree:
-            return None
-        
-        # Получаем текущий узел
-        if node_id == 'root':
-            current_node = tree.get('root')
-        else:
-            nodes = tree.get('nodes', {})
-            current_node = nodes.get(node_id)
-        
-        if not current_node:
+        compiled = self._compiled.get(tree_id, {}).get(node_id)
+        if compiled is None:
             return None
         
-        node_type = current_node.get('type')
+        node_type = compiled.type
         
-        # Определяем следующий узел на основе ответа
         if node_type == 'choice':
-            options = current_node.get('options', [])
-            for option in options:
-                if option['text'] == answer or option.get('id') == answer:
-                    next_node_id = option.get('next')
-                    if next_node_id:
-                        return self.get_node(tree_id, next_node_id)
-                    else:
-                        # Конец дерева
-                        return {'type': 'end', 'final': True}
+            try:
+                return compiled.options.get(answer)
+            except TypeError:
+                # Нехешируемый ответ (список, объект) не совпадает ни с одним вариантом
+                return None
         
-        elif node_type == 'scale':
-            # Для шкал проверяем диапазоны
-            branches = current_node.get('branches', {})
-            answer_value = int(answer)
-            
-            for range_key, next_node_id in branches.items():
-                if '-' in range_key:
-                    min_val, max_val = map(int, range_key.split('-'))
-                    if min_val <= answer_value <= max_val:
-                        return self.get_node(tree_id, next_node_id)
-            
+        if node_type == 'scale':
+            try:
+                answer_value = int(answer)
+            except (TypeError, ValueError):
+                return None
+            index = bisect.bisect_right(compiled.starts, answer_value) - 1
+            if index >= 0 and answer_value <= compiled.ends[index]:
+                return compiled.targets[index]
             # Если не попали ни в один диапазон
-            next_node_id = current_node.get('next')
-            if next_node_id:
-                return self.get_node(tree_id, next_node_id)
+            return compiled.default
         
-        elif node_type == 'task_trigger':
-            # Узел запускает задание
-            return {
-                'type': 'task_trigger',
-                'task_type': current_node.get('task_type'),
-                'task_text': current_node.get('task_text'),
-                'duration': current_node.get('duration'),
-                'guidance': current_node.get('guidance')
-            }
+        if node_type == 'task_trigger':
+            return compiled.result
         
-        elif node_type == 'reflection':
-            # Узел для рефлексии
-            next_node_id = current_node.get('leads_to')
-            if next_node_id == 'task':
-                return {'type': 'task_trigger', 'final': True}
-            elif next_node_id:
-                return self.get_node(tree_id, next_node_id)
+        if node_type == 'reflection':
+            return compiled.default
         
-        elif node_type == 'open_or_choice':
-            # Для открытых вопросов с fallback опциями
-            # Если ответ - это текст (не из fallback), переходим к следующему узлу
-            if isinstance(answer, str) and answer.strip():
-                # Проверяем, не является ли ответ одной из fallback опций
-                fallback_options = current_node.get('fallback_options', [])
-                is_fallback = False
-                for option in fallback_options:
-                    if option.get('text') == answer or option.get('id') == answer:
-                        is_fallback = True
-                        next_node_id = option.get('next')
-                        if next_node_id:
-                            return self.get_node(tree_id, next_node_id)
-                        break
-                
-                # Если это не fallback опция, используем основной next
-                if not is_fallback:
-                    next_node_id = current_node.get('next')
-                    if next_node_id:
-                        return self.get_node(tree_id, next_node_id)
-                    # Если нет next, завершаем дерево
-                    return {'type': 'end', 'final': True}
+        if node_type == 'open_or_choice':
+            # Открытый ответ ведёт в next, вариант из fallback_options — в свой узел
+            if not isinstance(answer, str) or not answer.strip():
+                return None
+            if answer in compiled.options:
+                return compiled.options[answer]
+            return compiled.default
         
         # Если тип узла не обработан, возвращаем None (404)
         return None
     
+    def subtree(self, tree_id: str, node_id: str = 'root', depth: int = 0) -> Dict[str, Dict[str, Any]]:
+        """Узлы, достижимые из node_id не более чем за depth переходов (включая сам узел)"""
+        table = self._compiled.get(tree_id, {})
+        if node_id not in table:
+            return {}
+        nodes = {node_id: table[node_id].node}
+        frontier = [node_id]
+        for _ in range(depth):
+            next_frontier = []
+            for current in frontier:
+                for child in table[current].children:
+                    if child not in nodes:
+                        nodes[child] = table[child].node
+                        next_frontier.append(child)
+            if not next_frontier:
+                break
+            frontier = next_frontier
+        return nodes
+    
+    @staticmethod
+    def is_terminal(result: Dict[str, Any]) -> bool:
+        """Результат перехода завершает дерево (задание или конец)"""
+        return result.get('type') in ('task_trigger', 'end') or bool(result.get('final'))
+    
+    def traverse_path(self, tree_id: str, steps: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """
+        Проходит несколько ответов подряд
+        
+        steps — [{'node_id': ..., 'answer': ...}, ...]; node_id можно не указывать,
+        тогда берётся узел, в который привёл предыдущий ответ (для первого шага — root).
+        Указанный node_id должен с ним совпадать: путь проверяется целиком.
+        
+        Returns:
+            {'success': bool, 'result': результат последнего шага (как у traverse),
+             'path': id пройденных узлов, 'error': str (при неудаче)}
+        """
+        node_id = 'root'
+        result = None
+        path: List[str] = []
+        for index, step in enumerate(steps, start=1):
+            if not isinstance(step, dict):
+                return {'success': False, 'path': path, 'error': f'Шаг {index}: ожидается объект'}
+            if result is not None and self.is_terminal(result):
+                return {'success': False, 'path': path, 'error': f'Шаг {index}: дерево уже завершено'}
+            step_node = step.get('node_id') or node_id
+            if index > 1 and step_node != node_id:
+                return {'success': False, 'path': path, 'error': f'Шаг {index}: ожидался узел {node_id}'}
+            result = self.traverse(tree_id, step_node, step.get('answer'))
+            if result is None:
+                return {'success': False, 'path': path, 'error': f'Шаг {index}: узел не найден или неверный ответ'}
+            path.append(step_node)
+            node_id = result.get('node_id')
+        return {'success': True, 'result': result, 'path': path}
+    
     def get_node(self, tree_id: str, node_id: str) -> Optional[Dict[str, Any]]:
         """Получает узел дерева"""
         tree = self.get_tree(tree_id)
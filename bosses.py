@@ -1,9 +1,22 @@
 """
 Механики боссов
+
+Условия победы (defeat_conditions) компилируются при загрузке (conditions.py).
+Босс, у которого хотя бы одно условие победы неизвестного типа, не загружается
+(как карта с ошибочным условием открытия): отброшенное условие сделало бы
+босса легче, чем задумано.
+
+Условия появления (trigger) тоже компилируются и подписываются на поля
+игрока, которые читают (sessions_without_rest, perfectionism_blocks, уровни
+кварталов, acts_completed и т.д.). on_player_change вызывается в конце каждой
+транзакции игрока и перепроверяет только триггеры изменившихся полей;
+прошлые значения полей хранятся в сохранении (boss_watch). Босс, чей триггер
+сработал, появляется сразу, а клиент получает событие boss_spawned.
 """
 import json
 import os
-from typing import Dict, Any, Optional, List
+from typing import Dict, Any, Optional, List, Tuple
+import conditions
 
 
 class BossesManager:
@@ -12,6 +25,11 @@ class BossesManager:
     def __init__(self, bosses_path: str = "scenarios/bosses.json"):
         self.bosses_path = bosses_path
         self.bosses = {}
+        # boss_id -> скомпилированные условия победы (достаточно одного)
+        self._defeat_conditions: Dict[str, conditions.Condition] = {}
+        # boss_id -> условие появления; поле игрока -> боссы, чьи триггеры его читают
+        self._triggers: Dict[str, conditions.Condition] = {}
+        self._subscriptions: Dict[str, List[str]] = {}
         self.load_bosses()
     
     def load_bosses(self):
@@ -19,60 +37,86 @@ class BossesManager:
         if os.path.exists(self.bosses_path):
             with open(self.bosses_path, 'r', encoding='utf-8') as f:
                 data = json.load(f)
-                self.bosses = {boss['boss_id']: boss for boss in data.get('bosses', [])}
+                bosses = data.get('bosses', [])
+        else:
+            bosses = []
+        self.bosses = {}
+        self._defeat_conditions = {}
+        for boss in bosses:
+            try:
+                defeat = conditions.any_of([
+                    conditions.compile_condition(spec, conditions.BOSS_CONDITIONS)
+                    for spec in boss.get('defeat_conditions', [])
+                ])
+            except ValueError as e:
+                print(f"Ошибка условий победы над боссом {boss.get('boss_id')}: {e}")
+                continue
+            self.bosses[boss['boss_id']] = boss
+            self._defeat_conditions[boss['boss_id']] = defeat
+        self._triggers = {}
+        self._subscriptions = {}
+        for boss_id, boss in self.bosses.items():
+            try:
+                trigger = conditions.compile_condition(boss.get('trigger'), conditions.BOSS_TRIGGERS)
+            except ValueError as e:
+                print(f"Ошибка условия появления босса {boss_id}: {e}")
+                continue
+            if not trigger.dependencies:
+                # Триггер без полей игрока никогда не перепроверялся бы
+                print(f"Ошибка условия появления босса {boss_id}: нет условия")
+                continue
+            self._triggers[boss_id] = trigger
+            for field in dict.fromkeys(key[0] for _, key, _ in trigger.dependencies):
+                self._subscriptions.setdefault(field, []).append(boss_id)
     
     def check_boss_spawn(self, player_data: Dict[str, Any]) -> Optional[Dict[str, Any]]:
-        """Проверяет, должен ли появиться босс"""
+        """Проверяет, должен ли появиться босс (полная проверка всех триггеров)"""
         active_bosses = player_data.get('active_bosses', [])
-        
-        for boss_id, boss in self.bosses.items():
-            # Пропускаем уже активных боссов
-            if boss_id in active_bosses:
-                continue
-            
-            trigger = boss.get('trigger', {})
-            trigger_type = trigger.get('type')
-            
-            # Проверяем условие появления
-            if trigger_type == 'pattern':
-                condition = trigger.get('condition')
-                threshold = trigger.get('threshold', 3)
-                
-                if condition == 'sessions_without_rest':
-                    count = player_data.get('sessions_without_rest', 0)
-                    if count >= threshold:
-                        return boss
-                
-                elif condition == 'tasks_not_done_perfectionism':
-                    count = player_data.get('perfectionism_blocks', 0)
-                    if count >= threshold:
-                        return boss
-                
-                elif condition == 'sessions_without_numbers':
-                    count = player_data.get('sessions_without_concrete_numbers', 0)
-                    if count >= threshold:
-                        return boss
-                
-                elif condition == 'comparison_thoughts':
-                    count = player_data.get('comparison_thoughts_count', 0)
-                    if count >= threshold:
-                        return boss
-            
-            elif trigger_type == 'milestone':
-                condition = trigger.get('condition')
-                
-                if condition == 'all_districts_level_3_plus':
-                    districts = player_data.get('districts', {})
-                    all_high_level = all(
-                        dist.get('level', 0) >= 3 
-                        for dist in districts.values()
-                    )
-                    acts_done = trigger.get('acts_completed', 0)
-                    if all_high_level and player_data.get('acts_completed', 0) >= acts_done:
-                        return boss
-        
+        for boss_id, trigger in self._triggers.items():
+            if boss_id not in active_bosses and trigger(player_data):
+                return self.bosses[boss_id]
         return None
     
+    def _watched_value(self, player_data: Dict[str, Any], field: str) -> Any:
+        """Значение поля, на которое подписаны триггеры (для кварталов — их уровни)"""
+        if field == 'districts':
+            return {key: district.get('level', 0) for key, district in (player_data.get('districts') or {}).items()}
+        return player_data.get(field)
+    
+    def on_player_change(
+        self,
+        player_data: Dict[str, Any],
+        before: Dict[str, Any] = None
+    ) -> List[Tuple[str, Dict[str, Any]]]:
+        """
+        Перепроверяет триггеры полей, изменившихся с прошлого вызова, и вызывает боссов
+        
+        Вызывается внутри транзакции игрока (наблюдатель game_engine; before
+        не нужен — прошлые значения хранятся в boss_watch). Возвращает
+        события boss_spawned для клиента. Триггер, который остался выполненным
+        после победы над боссом, сработает снова только при новом изменении поля.
+        """
+        watch = player_data.get('boss_watch') or {}
+        candidates: Dict[str, None] = {}
+        changed = {}
+        for field, boss_ids in self._subscriptions.items():
+            value = self._watched_value(player_data, field)
+            if watch.get(field) != value:
+                changed[field] = value
+                candidates.update(dict.fromkeys(boss_ids))
+        if not changed:
+            return []
+        player_data['boss_watch'] = {**watch, **changed}
+        
+        spawned = []
+        for boss_id in candidates:
+            if boss_id in player_data.get('active_bosses', []):
+                continue
+            if self._triggers[boss_id](player_data):
+                result = self.spawn_boss(boss_id, player_data)
+                spawned.append(('boss_spawned', {'boss': result['boss'], 'message': result['message']}))
+        return spawned
+    
     def spawn_boss(self, boss_id: str, player_data: Dict[str, Any]) -> Dict[str, Any]:
         """Активирует босса"""
         boss = self.bosses.get(boss_id)
@@ -83,6 +127,8 @@ class BossesManager:
             player_data['active_bosses'] = []
         
         player_data['active_bosses'].append(boss_id)
+        # Появление, которое клиент ещё не подтвердил в /api/boss/check (см. new_bosses)
+        player_data.setdefault('unchecked_bosses', []).append(boss_id)
         
         # Применяем эффекты босса
         self.apply_boss_effects(boss, player_data)
@@ -93,6 +139,31 @@ class BossesManager:
             'message': boss.get('dialogue', {}).get('appearance', '')
         }
     
+    def new_bosses(self, player_data: Dict[str, Any]) -> List[Dict[str, Any]]:
+        """Боссы, о появлении которых клиент ещё не подтвердил, что узнал (и ещё активные)"""
+        active = player_data.get('active_bosses', [])
+        return [
+            self.bosses[boss_id] for boss_id in dict.fromkeys(player_data.get('unchecked_bosses') or [])
+            if boss_id in active and boss_id in self.bosses
+        ]
+    
+    def acknowledge_bosses(self, player_data: Dict[str, Any], boss_ids: Optional[List[str]] = None) -> bool:
+        """
+        Убирает боссов из очереди непрочитанных появлений
+        
+        boss_ids — боссы, которых клиент показал (None — все). Возвращает True,
+        если очередь изменилась.
+        """
+        unchecked = player_data.get('unchecked_bosses') or []
+        remaining = [] if boss_ids is None else [boss_id for boss_id in unchecked if boss_id not in boss_ids]
+        if len(remaining) == len(unchecked):
+            return False
+        if remaining:
+            player_data['unchecked_bosses'] = remaining
+        else:
+            player_data.pop('unchecked_bosses', None)
+        return True
+    
     def apply_boss_effects(self, boss: Dict[str, Any], player_data: Dict[str, Any]):
         """Применяет эффекты босса"""
         effects = boss.get('effects', {})
@@ -117,37 +188,22 @@ class BossesManager:
             player_data['blocked_options'].extend(effects['blocks'])
     
     def check_defeat_conditions(self, boss_id: str, player_data: Dict[str, Any]) -> bool:
-        """Проверяет условия победы над боссом"""
-        boss = self.bosses.get(boss_id)
-        if not boss:
+        """Проверяет условия победы над боссом (достаточно одного выполненного)"""
+        condition = self._defeat_conditions.get(boss_id)
+        if condition is None:
             return False
-        
-        defeat_conditions = boss.get('defeat_conditions', [])
-        
-        # Проверяем каждое условие (достаточно одного выполненного)
-        for condition in defeat_conditions:
-            cond_type = condition.get('type')
-            
-            if cond_type == 'series':
-                action = condition.get('action')
-                required_count = condition.get('count')
-                actual_count = player_data.get(f'{action}_series', 0)
-                if actual_count >= required_count:
-                    return True
-            
-            elif cond_type == 'card':
-                card_id = condition.get('card_id')
-                # Проверяем использование карты
-                if player_data.get('last_card_used') == card_id:
-                    return True
-            
-            elif cond_type == 'full_session':
-                # Полная сессия в определённом квартале
-                district = condition.get('district')
-                if player_data.get('last_session_district') == district:
-                    return True
-        
-        return False
+        return condition(player_data)
+    
+    def get_defeatable_bosses(self, player_data: Dict[str, Any]) -> List[str]:
+        """Активные боссы, условия победы над которыми выполнены (одна проверка на всех)"""
+        return conditions.evaluate_all(
+            (
+                (boss_id, self._defeat_conditions[boss_id])
+                for boss_id in player_data.get('active_bosses', [])
+                if boss_id in self._defeat_conditions
+            ),
+            player_data
+        )
     
     def defeat_boss(self, boss_id: str, player_data: Dict[str, Any]) -> Dict[str, Any]:
         """Побеждает босса"""
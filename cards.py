@@ -1,18 +1,48 @@
 """
 Система карточек: открытие, экипировка, активация
+
+Условия открытия компилируются при загрузке базы (conditions.py); карта
+с неизвестным типом условия не загружается.
+
+Доступность карт считается инкрементально. При загрузке базы строится обратный
+индекс: поле данных игрока (счётчик actions_history.<действие>,
+district_sessions.<квартал>, stability_points, acts_completed, элемент
+completed_levels или completed_contracts) → карты, чьи условия от него
+зависят; для счётчиков пороги отсортированы. Для каждого игрока запоминаются
+значения этих полей и набор карт с выполненными условиями; при следующем
+запросе перепроверяются только карты, чей порог оказался между старым и новым
+значением поля (или чей элемент списка появился/исчез).
 """
+import bisect
 import json
 import os
-from typing import Dict, Any, Optional, List
+import threading
+from collections import OrderedDict
+from typing import Dict, Any, Optional, List, Set, Tuple
 from datetime import datetime
+import conditions
+
+
+# Счётчики в данных игрока, на которые ссылаются условия
+COUNTER_FIELDS = ('actions_history', 'district_sessions')
+# Числа в данных игрока, с которыми сравниваются пороги
+SCALAR_FIELDS = ('stability_points', 'acts_completed')
+# Списки в данных игрока, на элементы которых ссылаются условия
+MEMBER_FIELDS = ('completed_levels', 'completed_contracts')
 
 
 class CardsManager:
     """Менеджер системы карточек"""
     
-    def __init__(self, cards_db_path: str = "scenarios/cards_database.json"):
+    def __init__(self, cards_db_path: str = "scenarios/cards_database.json", cache_size: int = 1024):
         self.cards_db_path = cards_db_path
         self.cards_db = {}
+        # card_id -> скомпилированное условие открытия (conditions.Condition)
+        self._conditions: Dict[str, conditions.Condition] = {}
+        self.cache_size = cache_size
+        self._lock = threading.Lock()
+        # player_id -> {'snapshot': значения полей, 'eligible': карты с выполненными условиями}
+        self._player_states: 'OrderedDict[str, Dict[str, Any]]' = OrderedDict()
         self.load_cards_database()
     
     def load_cards_database(self):
@@ -20,8 +50,89 @@ class CardsManager:
         if os.path.exists(self.cards_db_path):
             with open(self.cards_db_path, 'r', encoding='utf-8') as f:
                 data = json.load(f)
-                self.cards_db = {card['card_id']: card for card in data.get('cards', [])}
                 self.rarity_costs = data.get('rarity_costs', {})
+            self.cards_db = {}
+            self._conditions = {}
+            for card in data.get('cards', []):
+                # Карта с ошибкой в условии открытия не загружается
+                try:
+                    self._conditions[card['card_id']] = conditions.compile_condition(
+                        card.get('unlock_condition'), conditions.CARD_CONDITIONS
+                    )
+                except ValueError as e:
+                    print(f"Ошибка условия открытия карты {card.get('card_id')}: {e}")
+                    continue
+                self.cards_db[card['card_id']] = card
+        self._build_condition_index()
+    
+    # --- Обратный индекс условий ---
+    
+    def _build_condition_index(self):
+        """Индекс поле → карты и набор карт, не зависящих от данных игрока"""
+        self._card_order = {card_id: position for position, card_id in enumerate(self.cards_db)}
+        self._cards_by_position = list(self.cards_db.values())
+        thresholds: Dict[Tuple[str, str], List[Tuple[Any, str]]] = {}
+        self._members: Dict[Tuple[str, str], Set[str]] = {}
+        self._dependent_cards: List[str] = []
+        self._static_eligible: Set[str] = set()
+        self._volatile_cards: Set[str] = set()
+        
+        for card_id, condition in self._conditions.items():
+            if not condition.dependencies:
+                if condition({}):
+                    self._static_eligible.add(card_id)
+                continue
+            self._dependent_cards.append(card_id)
+            for kind, key, value in condition.dependencies:
+                if kind == 'threshold':
+                    thresholds.setdefault(key, []).append((value, card_id))
+                elif kind == 'member':
+                    self._members.setdefault(key, set()).add(card_id)
+                else:
+                    # Условие на равенство не индексируется — проверяем при каждом запросе
+                    self._volatile_cards.add(card_id)
+        
+        # key -> (пороги по возрастанию, карты в том же порядке)
+        self._thresholds: Dict[Tuple[str, str], Tuple[List[Any], List[str]]] = {}
+        for key, entries in thresholds.items():
+            entries.sort()
+            self._thresholds[key] = ([value for value, _ in entries], [card_id for _, card_id in entries])
+        
+        with self._lock:
+            self._player_states.clear()
+    
+    def _snapshot(self, player_data: Dict[str, Any]) -> Dict[str, Any]:
+        """Значения полей, от которых зависят условия"""
+        snapshot = {field: dict(player_data.get(field) or {}) for field in COUNTER_FIELDS}
+        snapshot.update({field: frozenset(player_data.get(field) or ()) for field in MEMBER_FIELDS})
+        snapshot.update({field: player_data.get(field) or 0 for field in SCALAR_FIELDS})
+        return snapshot
+    
+    def _crossed(self, key: Tuple[str, str], before: Any, after: Any) -> List[str]:
+        """Карты, чей порог по полю key лежит между старым и новым значением"""
+        index = self._thresholds.get(key)
+        if index is None or before == after:
+            return []
+        low, high = min(before, after), max(before, after)
+        values, card_ids = index
+        # Условие «значение >= порога» меняется, только если low < порог <= high
+        return card_ids[bisect.bisect_right(values, low):bisect.bisect_right(values, high)]
+    
+    def _affected_cards(self, before: Dict[str, Any], after: Dict[str, Any]) -> Set[str]:
+        """Карты, условия которых могли измениться между двумя снимками"""
+        affected: Set[str] = set(self._volatile_cards)
+        for field in COUNTER_FIELDS:
+            old, new = before[field], after[field]
+            if old == new:
+                continue
+            for name in old.keys() | new.keys():
+                affected.update(self._crossed((field, name), old.get(name, 0), new.get(name, 0)))
+        for field in SCALAR_FIELDS:
+            affected.update(self._crossed((field, ''), before[field], after[field]))
+        for field in MEMBER_FIELDS:
+            for item in before[field] ^ after[field]:
+                affected.update(self._members.get((field, item), ()))
+        return affected
     
     def get_card(self, card_id: str) -> Optional[Dict[str, Any]]:
         """Получает карту по ID"""
@@ -29,58 +140,10 @@ class CardsManager:
     
     def check_unlock_conditions(self, card_id: str, player_data: Dict[str, Any]) -> bool:
         """Проверяет условия открытия карты"""
-        card = self.get_card(card_id)
-        if not card:
+        condition = self._conditions.get(card_id)
+        if condition is None:
             return False
-
-        unlock = card.get('unlock_condition', {})
-        return self._check_condition(unlock, player_data)
-
-    def _check_condition(self, condition: Dict[str, Any], player_data: Dict[str, Any]) -> bool:
-        """Проверяет конкретное условие (рекурсивно для combined)."""
-        if not condition:
-            return True
-
-        unlock_type = condition.get('type')
-
-        if unlock_type == 'action':
-            # Проверяем количество действий
-            actions = player_data.get('actions_history', {})
-            action_name = condition.get('action')
-            required_count = condition.get('count', 1)
-            return actions.get(action_name, 0) >= required_count
-
-        if unlock_type == 'sessions_in_district':
-            # Проверяем количество сессий в квартале
-            district = condition.get('district')
-            required = condition.get('count')
-            sessions = player_data.get('district_sessions', {})
-            return sessions.get(district, 0) >= required
-
-        if unlock_type == 'complete_level':
-            # Проверяем завершение уровня
-            level_id = condition.get('level')
-            completed = player_data.get('completed_levels', [])
-            return level_id in completed
-
-        if unlock_type == 'stability_points':
-            # Проверяем очки устойчивости
-            required = condition.get('amount')
-            return player_data.get('stability_points', 0) >= required
-
-        if unlock_type == 'combined':
-            # Комбинированные условия проверяются последовательно
-            conditions = condition.get('conditions', [])
-            return all(self._check_condition(cond, player_data) for cond in conditions)
-
-        if unlock_type == 'contract_completion':
-            # Завершение контракта
-            contract_id = condition.get('contract')
-            completed = player_data.get('completed_contracts', [])
-            return contract_id in completed
-
-        # Неизвестные типы условий не считаем выполненными, чтобы не открывать карту ошибочно
-        return False
+        return condition(player_data)
     
     def calculate_effort_cost(self, card_id: str, upgrade_level: int = 0) -> int:
         """Вычисляет стоимость карты в Effort"""
@@ -97,16 +160,86 @@ class CardsManager:
         return base_cost
     
     def get_available_cards(self, player_data: Dict[str, Any]) -> List[Dict[str, Any]]:
-        """Получает список доступных для открытия карт"""
-        available = []
-        owned_cards = player_data.get('owned_cards', [])
+        """
+        Получает список доступных для открытия карт
+        
+        Для игрока с player_id перепроверяются только карты, затронутые
+        изменившимися с прошлого вызова полями (см. описание модуля).
+        """
+        with self._lock:
+            return list(self._refresh(player_data)['available'])
+    
+    def available_changes(self, player_data: Dict[str, Any]) -> Tuple[List[Dict[str, Any]], List[str]]:
+        """
+        Карты, ставшие доступными, и id карт, переставших быть доступными,
+        с прошлого вызова для этого игрока (для событий клиенту)
         
-        for card_id, card in self.cards_db.items():
-            if card_id not in owned_cards:
-                if self.check_unlock_conditions(card_id, player_data):
-                    available.append(card)
+        Первый вызов для игрока только запоминает текущий список.
+        """
+        if not player_data.get('player_id'):
+            return [], []
+        with self._lock:
+            state = self._refresh(player_data)
+            current = set(state['positions'])
+            announced = state['announced']
+            state['announced'] = current
+        added = [self._cards_by_position[position] for position in sorted(current - announced)]
+        removed = [self._cards_by_position[position]['card_id'] for position in sorted(announced - current)]
+        return added, removed
+    
+    def _refresh(self, player_data: Dict[str, Any]) -> Dict[str, Any]:
+        """Обновлённое состояние доступности игрока (под self._lock)"""
+        player_id = player_data.get('player_id')
+        snapshot = self._snapshot(player_data)
+        owned_cards = frozenset(player_data.get('owned_cards', []))
         
-        return available
+        state = self._player_states.get(player_id) if player_id else None
+        if state is None:
+            eligible = self._static_eligible.union(conditions.evaluate_all(
+                ((card_id, self._conditions[card_id]) for card_id in self._dependent_cards),
+                player_data
+            ))
+            positions = sorted(self._card_order[card_id] for card_id in eligible - owned_cards)
+            state = {
+                'eligible': eligible,
+                # Доступные карты в порядке базы: позиции и сами карты
+                'positions': positions,
+                'available': [self._cards_by_position[position] for position in positions],
+                # Позиции, о которых уже сообщено через available_changes
+                'announced': set(positions)
+            }
+        else:
+            eligible = state['eligible']
+            changed = {card_id for card_id in state['owned'] ^ owned_cards if card_id in self._card_order}
+            for card_id in self._affected_cards(state['snapshot'], snapshot):
+                if self.check_unlock_conditions(card_id, player_data) != (card_id in eligible):
+                    eligible.symmetric_difference_update((card_id,))
+                    changed.add(card_id)
+            for card_id in changed:
+                self._set_available(state, card_id, card_id in eligible and card_id not in owned_cards)
+        state['snapshot'] = snapshot
+        state['owned'] = owned_cards
+        
+        if player_id:
+            self._player_states[player_id] = state
+            self._player_states.move_to_end(player_id)
+            while len(self._player_states) > self.cache_size:
+                self._player_states.popitem(last=False)
+        
+        return state
+    
+    def _set_available(self, state: Dict[str, Any], card_id: str, available: bool):
+        """Добавляет карту в упорядоченный список доступных или убирает из него"""
+        position = self._card_order[card_id]
+        positions = state['positions']
+        index = bisect.bisect_left(positions, position)
+        present = index < len(positions) and positions[index] == position
+        if available and not present:
+            positions.insert(index, position)
+            state['available'].insert(index, self.cards_db[card_id])
+        elif present and not available:
+            del positions[index]
+            del state['available'][index]
     
     def unlock_card(self, card_id: str, player_data: Dict[str, Any]) -> Dict[str, Any]:
         """Открывает карту за Effort"""
@@ -0,0 +1,251 @@
+"""
+Компилятор условий из JSON (unlock_condition карт, trigger и defeat_conditions боссов)
+
+Условие разбирается один раз при загрузке базы и превращается в замыкание
+check(data) -> bool, которое сравнивает поле данных игрока с порогом без
+разбора словаря и ветвления по строке type. Неизвестный тип или отсутствующий
+параметр — ValueError при загрузке, а не молчаливое «не выполнено» на каждом
+запросе.
+
+У скомпилированного условия есть и список зависимостей — полей игрока,
+которые оно читает, — по нему CardsManager строит обратный индекс, а триггеры
+боссов подписываются на изменения полей.
+
+Для проверки многих условий на одном игроке есть evaluate_all: данные игрока
+подготавливаются один раз (списки превращаются в множества), дальше каждое
+условие — один вызов замыкания.
+"""
+from typing import Dict, Any, Callable, Iterable, List, Optional, Tuple
+
+
+# Списки в данных игрока, по которым проверяется вхождение элемента
+MEMBER_FIELDS = ('completed_levels', 'completed_contracts', 'owned_cards')
+
+# Зависимость: ('threshold', (поле, ключ), порог) — значение >= порога,
+# ('member', (поле, элемент), None) — элемент есть в списке,
+# ('value', (поле, ''), значение) — поле равно значению
+Dependency = Tuple[str, Tuple[str, str], Any]
+Check = Callable[[Dict[str, Any]], bool]
+
+
+class Condition:
+    """Скомпилированное условие: проверка и поля игрока, от которых она зависит"""
+
+    __slots__ = ('check', 'dependencies')
+
+    def __init__(self, check: Check, dependencies: Tuple[Dependency, ...] = ()):
+        self.check = check
+        self.dependencies = dependencies
+
+    def __call__(self, data: Dict[str, Any]) -> bool:
+        return self.check(data)
+
+
+def _always(data: Dict[str, Any]) -> bool:
+    return True
+
+
+def _never(data: Dict[str, Any]) -> bool:
+    return False
+
+
+ALWAYS = Condition(_always)
+
+
+# --- Строительные блоки ---
+
+def counter_at_least(field: str, key: str, threshold: int) -> Condition:
+    """Счётчик field[key] не меньше порога (actions_history, district_sessions)"""
+    def check(data: Dict[str, Any]) -> bool:
+        return (data.get(field) or {}).get(key, 0) >= threshold
+    return Condition(check, (('threshold', (field, key), threshold),))
+
+
+def scalar_at_least(field: str, threshold: int) -> Condition:
+    """Число в поле не меньше порога (stability_points, acts_completed)"""
+    def check(data: Dict[str, Any]) -> bool:
+        return (data.get(field) or 0) >= threshold
+    return Condition(check, (('threshold', (field, ''), threshold),))
+
+
+def contains(field: str, item: str) -> Condition:
+    """Элемент есть в списке (в подготовленных данных — во множестве)"""
+    def check(data: Dict[str, Any]) -> bool:
+        return item in (data.get(field) or ())
+    return Condition(check, (('member', (field, item), None),))
+
+
+def equals(field: str, value: Any) -> Condition:
+    """Поле равно значению (последняя карта, последний квартал)"""
+    def check(data: Dict[str, Any]) -> bool:
+        return data.get(field) == value
+    return Condition(check, (('value', (field, ''), value),))
+
+
+def all_of(parts: List[Condition]) -> Condition:
+    """Все условия выполнены (combined)"""
+    if not parts:
+        return ALWAYS
+    if len(parts) == 1:
+        return parts[0]
+    checks = tuple(part.check for part in parts)
+
+    def check(data: Dict[str, Any]) -> bool:
+        for part in checks:
+            if not part(data):
+                return False
+        return True
+    return Condition(check, tuple(dependency for part in parts for dependency in part.dependencies))
+
+
+def any_of(parts: List[Condition]) -> Condition:
+    """Хотя бы одно условие выполнено (defeat_conditions босса)"""
+    if not parts:
+        return Condition(_never)
+    if len(parts) == 1:
+        return parts[0]
+    checks = tuple(part.check for part in parts)
+
+    def check(data: Dict[str, Any]) -> bool:
+        for part in checks:
+            if part(data):
+                return True
+        return False
+    return Condition(check, tuple(dependency for part in parts for dependency in part.dependencies))
+
+
+def _require(spec: Dict[str, Any], name: str) -> Any:
+    """Обязательный параметр условия"""
+    value = spec.get(name)
+    if value is None:
+        raise ValueError(f"условие {spec.get('type')}: нет параметра {name}")
+    return value
+
+
+def _number(spec: Dict[str, Any], name: str, default: Optional[int] = None) -> int:
+    """Числовой порог условия"""
+    value = spec.get(name, default)
+    if isinstance(value, bool) or not isinstance(value, (int, float)):
+        raise ValueError(f"условие {spec.get('type')}: {name} должен быть числом")
+    return value
+
+
+# --- Типы условий ---
+
+Builder = Callable[[Dict[str, Any]], Condition]
+
+# Условия открытия карт (unlock_condition); combined обрабатывает compile_condition
+CARD_CONDITIONS: Dict[str, Builder] = {
+    'action': lambda spec: counter_at_least(
+        'actions_history', _require(spec, 'action'), _number(spec, 'count', 1)),
+    'sessions_in_district': lambda spec: counter_at_least(
+        'district_sessions', _require(spec, 'district'), _number(spec, 'count', 1)),
+    # Микрошаги категории считаются в actions_history как microstep:<категория>
+    'microstep': lambda spec: counter_at_least(
+        'actions_history',
+        f"microstep:{spec['category']}" if spec.get('category') else 'microstep',
+        _number(spec, 'count', 1)),
+    'complete_level': lambda spec: contains('completed_levels', _require(spec, 'level')),
+    'contract_completion': lambda spec: contains('completed_contracts', _require(spec, 'contract')),
+    'stability_points': lambda spec: scalar_at_least('stability_points', _number(spec, 'amount')),
+    'act_completion': lambda spec: scalar_at_least('acts_completed', _number(spec, 'act')),
+}
+
+# Условия победы над боссом (defeat_conditions, достаточно одного)
+BOSS_CONDITIONS: Dict[str, Builder] = {
+    'series': lambda spec: scalar_at_least(f"{_require(spec, 'action')}_series", _number(spec, 'count', 1)),
+    'card': lambda spec: equals('last_card_used', _require(spec, 'card_id')),
+    'card_activation': lambda spec: equals('last_card_used', _require(spec, 'card_id')),
+    'card_legendary': lambda spec: contains('owned_cards', _require(spec, 'card')),
+    'full_session': lambda spec: equals('last_session_district', _require(spec, 'district')),
+    'contract_completion': CARD_CONDITIONS['contract_completion'],
+}
+
+# Типы условий победы из scenarios/bosses.json, прогресс по которым игра пока не
+# отслеживает: такое условие известно, но никогда не выполнено (как и в прежней
+# проверке). Любой другой неизвестный тип — ошибка, и босс не загружается
+UNTRACKED_BOSS_CONDITIONS = (
+    'skill_usage', 'focus_maintained', 'companion_dialogue', 'concrete_numbers', 'full_inventory',
+    'skill_activation', 'companion_session', 'reflection_complete', 'endurance', 'philosophical_acceptance',
+)
+BOSS_CONDITIONS.update(dict.fromkeys(UNTRACKED_BOSS_CONDITIONS, lambda spec: Condition(_never)))
+
+
+# Счётчики игрока для паттернов появления босса (trigger.type == 'pattern')
+PATTERN_COUNTERS = {
+    'sessions_without_rest': 'sessions_without_rest',
+    'tasks_not_done_perfectionism': 'perfectionism_blocks',
+    'sessions_without_numbers': 'sessions_without_concrete_numbers',
+    'comparison_thoughts': 'comparison_thoughts_count',
+}
+
+
+def all_districts_level(level: int, acts: int) -> Condition:
+    """Все кварталы не ниже уровня level и пройдено не меньше acts актов"""
+    def check(data: Dict[str, Any]) -> bool:
+        if (data.get('acts_completed') or 0) < acts:
+            return False
+        return all(district.get('level', 0) >= level for district in (data.get('districts') or {}).values())
+    return Condition(check, (
+        ('threshold', ('districts', 'level'), level),
+        ('threshold', ('acts_completed', ''), acts),
+    ))
+
+
+def _pattern_trigger(spec: Dict[str, Any]) -> Condition:
+    field = PATTERN_COUNTERS.get(_require(spec, 'condition'))
+    if field is None:
+        raise ValueError(f"неизвестный паттерн {spec['condition']!r}")
+    return scalar_at_least(field, _number(spec, 'threshold', 3))
+
+
+def _milestone_trigger(spec: Dict[str, Any]) -> Condition:
+    if _require(spec, 'condition') != 'all_districts_level_3_plus':
+        raise ValueError(f"неизвестная веха {spec['condition']!r}")
+    return all_districts_level(3, _number(spec, 'acts_completed', 0))
+
+
+# Условия появления босса (trigger)
+BOSS_TRIGGERS: Dict[str, Builder] = {
+    'pattern': _pattern_trigger,
+    # Мысли по шаблону считаются в <pattern>_thoughts_count
+    'thought_pattern': lambda spec: scalar_at_least(
+        f"{_require(spec, 'pattern')}_thoughts_count", _number(spec, 'threshold', 3)),
+    'milestone': _milestone_trigger,
+}
+
+
+def compile_condition(spec: Optional[Dict[str, Any]], builders: Dict[str, Builder]) -> Condition:
+    """
+    Компилирует условие (рекурсивно для combined)
+
+    Пустое условие всегда выполнено. Неизвестный тип — ValueError.
+    """
+    if not spec:
+        return ALWAYS
+    if not isinstance(spec, dict):
+        raise ValueError(f"условие должно быть объектом, получено {spec!r}")
+    condition_type = spec.get('type')
+    if condition_type == 'combined':
+        return all_of([compile_condition(inner, builders) for inner in spec.get('conditions', [])])
+    builder = builders.get(condition_type)
+    if builder is None:
+        raise ValueError(f"неизвестный тип условия {condition_type!r}")
+    return builder(spec)
+
+
+def prepare(player_data: Dict[str, Any]) -> Dict[str, Any]:
+    """Данные игрока для пакетной проверки: списки для вхождения — множества"""
+    prepared = dict(player_data)
+    for field in MEMBER_FIELDS:
+        prepared[field] = frozenset(player_data.get(field) or ())
+    return prepared
+
+
+def evaluate_all(
+    compiled: Iterable[Tuple[str, Condition]],
+    player_data: Dict[str, Any]
+) -> List[str]:
+    """id выполненных условий (в порядке compiled) за один проход по данным игрока"""
+    data = prepare(player_data)
+    return [condition_id for condition_id, condition in compiled if condition.check(data)]
@@ -21,19 +21,106 @@ OPENAI_MODEL = "openai/gpt-oss-20b:free"  # Рекомендуется для р
 
 # Base URL для альтернативных API провайдеров (например, OpenRouter)
 # Если используется стандартный OpenAI API, оставьте None
-OPENAI_BASE_URL = "https://openrouter.ai/api/v1"  # Для OpenRouter
+# Переменная окружения OPENAI_BASE_URL переопределяет значение
+# (например, локальная заглушка benchmarks/fake_llm_server.py для нагрузочных тестов)
+OPENAI_BASE_URL = os.environ.get("OPENAI_BASE_URL", "https://openrouter.ai/api/v1")  # Для OpenRouter
 # OPENAI_BASE_URL = None  # Для стандартного OpenAI API
 
+# Пул соединений с LLM API (один клиент на процесс, см. llm_client.py)
+LLM_TIMEOUT = 30.0  # Таймаут запроса, секунды
+LLM_CONNECT_TIMEOUT = 5.0  # Таймаут установки соединения, секунды
+LLM_MAX_CONNECTIONS = 20  # Одновременных соединений к API
+LLM_MAX_KEEPALIVE_CONNECTIONS = 10  # Соединений, держащихся открытыми между запросами
+LLM_KEEPALIVE_EXPIRY = 60.0  # Сколько простаивающее соединение остаётся открытым, секунды
+LLM_HTTP2 = True  # HTTP/2, если установлен пакет h2 (pip install httpx[http2])
+LLM_MAX_RETRIES = 1  # Повторов внутри клиента OpenAI (укладываются в дедлайн)
+
+# Защита сервера от медленного LLM API
+LLM_MAX_CONCURRENCY = 8  # Одновременных запросов к модели
+LLM_QUEUE_TIMEOUT = 2.0  # Ожидание свободного слота, секунды (дальше — fallback-ответ)
+LLM_DEADLINE_SECONDS = 20.0  # Дедлайн одного запроса, включая поток токенов
+LLM_BREAKER_FAILURES = 5  # Ошибок/таймаутов подряд до размыкания предохранителя
+LLM_BREAKER_RESET_SECONDS = 30.0  # Через сколько секунд пробовать API снова
+
+# Контекст игрока в промпте Айры (context_builder.py)
+CONTEXT_TOKEN_BUDGET = 400  # Бюджет токенов на контекст
+CONTEXT_CHARS_PER_TOKEN = 3.0  # Оценка длины токена в символах (для русского текста)
+CONTEXT_RECENT_MEMORIES = 3  # Последних реплик из памяти агента; более старые — в сводку
+CONTEXT_RECENT_SESSIONS = 3  # Последних сессий
+CONTEXT_SNIPPET_CHARS = 150  # Максимальная длина одной реплики
+
+# Кеш ответов модели (ключ — нормализованные промпт, контекст и сообщение)
+LLM_CACHE_ENABLED = True
+LLM_CACHE_TTL_SECONDS = 600  # Время жизни ответа в кеше
+LLM_CACHE_MAX_BYTES = 8 * 1024 * 1024  # Лимит объёма кеша
+# Приветствия в начале сессии кешируются по кварталу, эмоции и диапазону интенсивности
+# (без учёта истории игрока) — ответ переиспользуется между сессиями и игроками
+LLM_CACHE_GREETING_BUCKETS = False
+
+# Проверка ответов модели фильтром (и готовых, и потоковых) на описания способов:
+# при срабатывании поток обрывается, а ответ заменяется безопасным (игра не блокируется)
+FILTER_LLM_OUTPUT = True
+
+# Ответы без LLM: scenarios/fallback_intents.json перечитывается при изменении,
+# наличие изменений проверяется не чаще раза в FALLBACK_RELOAD_SECONDS секунд
+FALLBACK_RELOAD_SECONDS = 2.0
+
 # Настройки игры
 SESSION_COOLDOWN_HOURS = 0  # Время между сессиями в часах
 POINTS_PER_SESSION = 15  # Базовые очки за сессию
 UNLOCK_THRESHOLD = 50  # Очки для разблокировки новых кварталов
 
+# Деревья вопросов: клиент может загрузить поддерево и пройти его без запросов
+TREE_PREFETCH_MAX_DEPTH = 6  # Наибольшая глубина предзагрузки (?prefetch= в /api/tree/start)
+TREE_BATCH_MAX_STEPS = 50  # Наибольшее число ответов в /api/tree/traverse/batch
+
 # Пути к данным
 DATA_DIR = "data"
 SAVES_DIR = os.path.join(DATA_DIR, "saves")
 DEFAULT_SAVE_FILE = os.path.join(SAVES_DIR, "player.json")
 
+# Бэкенд хранения сохранений: "json" (файл на игрока) или "sqlite" (WAL, построчные обновления)
+# Перенос существующих JSON-сохранений: python sqlite_storage.py
+STORAGE_BACKEND = "json"
+SQLITE_DB_PATH = os.path.join(DATA_DIR, "innerquest.db")
+
+# Отложенная запись JSON-сохранений: несколько save_player подряд схлопываются в одну
+# атомарную запись (временный файл + fsync + rename)
+SAVE_WRITE_BEHIND = True
+SAVE_DEBOUNCE_SECONDS = 0.5  # Пауза без изменений перед записью
+SAVE_MAX_STALENESS_SECONDS = 5.0  # Максимальный возраст несохранённых изменений
+SAVE_FLUSH_ON_REQUEST_END = True  # Дописывать сохранение игрока в конце каждого запроса
+
+# Формат файла сохранения: "pretty" (JSON с отступами), "compact" (JSON без отступов),
+# "zlib" или "lz4" (сжатый JSON). При чтении формат определяется автоматически
+SAVE_FORMAT = "pretty"
+SAVE_FAST_JSON = True  # Использовать orjson, если установлен
+SAVE_ZLIB_LEVEL = 6
+
+# Журнал добавлений в историю сессий и память агента (<player_id>.journal)
+JOURNAL_COMPACT_THRESHOLD = 200  # Записей в журнале до фонового сворачивания в снимок
+JOURNAL_FSYNC = False  # fsync после каждой записи журнала
+
+# Фоновая запись памяти агента: ответ чата не ждёт записи на диск
+MEMORY_WRITE_BEHIND = True
+MEMORY_QUEUE_SIZE = 10000  # Записей в очереди (по всем игрокам)
+# При переполнении очереди: "sync" — записать в потоке запроса, "block" — подождать
+# MEMORY_QUEUE_BLOCK_SECONDS и записать синхронно, "drop" — отбросить запись
+MEMORY_QUEUE_POLICY = "sync"
+MEMORY_QUEUE_BLOCK_SECONDS = 1.0
+
+# Игроки: идентификатор берётся из заголовка или cookie, иначе используется игрок по умолчанию
+DEFAULT_PLAYER_ID = "default"
+PLAYER_ID_HEADER = "X-Player-Id"
+PLAYER_ID_COOKIE = "player_id"
+PLAYER_CACHE_SIZE = 1000  # Игроков в памяти процесса (LRU)
+
+# Поток событий игрока /api/events (SSE): боссы, разблокировки, карты, прогресс
+EVENTS_LOG_SIZE = 100  # Последних событий на игрока для дочитывания по Last-Event-ID
+EVENTS_CONNECTION_BUFFER = 50  # Событий на соединение; при большем отставании — полный снимок
+EVENTS_HEARTBEAT_SECONDS = 15.0  # Пауза без событий, после которой отправляется heartbeat
+EVENTS_RETRY_MS = 3000  # Задержка переподключения клиента (поле retry:)
+
 # Настройки Flask
 FLASK_HOST = "127.0.0.1"
 FLASK_PORT = 5001  # Изменено с 5000, т.к. 5000 часто занят AirPlay на macOS
@@ -0,0 +1,193 @@
+"""
+Контекст игрока для промпта Айры с бюджетом токенов
+
+В промпт идут текущий квартал и эмоция, последние реплики из памяти агента,
+последние сессии и сводка более старой памяти — пока укладываются в бюджет
+CONTEXT_TOKEN_BUDGET (по приоритету именно в таком порядке).
+
+Сводка старой памяти накапливается инкрементально: запись сворачивается в неё
+один раз, когда выходит из окна последних реплик, поэтому сводка помнит и то,
+что уже вытеснено из agent_memory. Готовый контекст кешируется на игрока
+и пересобирается только при изменении его данных.
+"""
+import re
+import threading
+import weakref
+from collections import Counter
+from typing import Dict, Any, List, Optional, Tuple
+import config
+import game_engine
+import storage
+
+
+# "Сессия в citadel: Тревога. Игрок: ... Айра: ..." (формат AgentAira._remember)
+MEMORY_PATTERN = re.compile(r'^Сессия в (?P<district>[^:]+): (?P<emotion>[^.]*)\.')
+GURU_PREFIX = '[ГУРУ]'
+
+
+def estimate_tokens(text: str) -> int:
+    """Оценка числа токенов (без токенизатора: в среднем несколько символов на токен)"""
+    chars_per_token = getattr(config, 'CONTEXT_CHARS_PER_TOKEN', 3.0)
+    return int(len(text) / chars_per_token) + 1
+
+
+class MemorySummary:
+    """Сводка старой памяти агента, пополняемая по одной записи"""
+
+    def __init__(self):
+        self.conversations = 0
+        self.guru_questions = 0
+        self.districts: Counter = Counter()
+        self.emotions: Counter = Counter()
+        # Отметка времени последней свёрнутой записи
+        self.folded_until = ''
+
+    def fold(self, entry: Dict[str, Any]):
+        text = entry.get('text', '')
+        if text.startswith(GURU_PREFIX):
+            self.guru_questions += 1
+        else:
+            self.conversations += 1
+            match = MEMORY_PATTERN.match(text)
+            if match:
+                district = match.group('district').strip()
+                emotion = match.group('emotion').strip()
+                if district and district != 'None':
+                    self.districts[district] += 1
+                if emotion and emotion != 'None':
+                    self.emotions[emotion.lower()] += 1
+        self.folded_until = max(self.folded_until, entry.get('timestamp', ''))
+
+    def render(self) -> Optional[str]:
+        if not self.conversations and not self.guru_questions:
+            return None
+        parts = [f"Ранее было бесед: {self.conversations}"]
+        if self.districts:
+            names = []
+            for key, count in self.districts.most_common(3):
+                info = game_engine.City.get_district_info(key)
+                names.append(f"{info['name'] if info else key} ({count})")
+            parts.append("чаще всего кварталы: " + ", ".join(names))
+        if self.emotions:
+            parts.append("частые эмоции: " + ", ".join(
+                f"{emotion} ({count})" for emotion, count in self.emotions.most_common(3)
+            ))
+        if self.guru_questions:
+            parts.append(f"вопросов в режиме гуру: {self.guru_questions}")
+        return "; ".join(parts)
+
+
+class PlayerContext:
+    """Состояние построителя контекста одного игрока"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.summary = MemorySummary()
+        self.fingerprint: Optional[Tuple] = None
+        self.cached: Dict[Tuple[Optional[str], Optional[str]], str] = {}
+
+
+# Состояние живёт, пока игрок в памяти процесса (реестр игроков)
+_contexts: 'weakref.WeakKeyDictionary[game_engine.Player, PlayerContext]' = weakref.WeakKeyDictionary()
+_contexts_guard = threading.Lock()
+
+
+def _player_context(player: game_engine.Player) -> PlayerContext:
+    with _contexts_guard:
+        state = _contexts.get(player)
+        if state is None:
+            state = _contexts[player] = PlayerContext()
+        return state
+
+
+def _fingerprint(memory: List[Dict[str, Any]], history: List[Dict[str, Any]], points: int) -> Tuple:
+    """Дешёвый отпечаток данных, от которых зависит контекст"""
+    return (
+        len(memory), memory[-1].get('timestamp') if memory else None,
+        len(history), history[-1].get('timestamp') if history else None,
+        points
+    )
+
+
+def build_context(player: game_engine.Player, district: str = None, emotion: str = None) -> str:
+    """Контекст игрока для промпта (из кеша, если данные игрока не менялись)"""
+    recent_memories = getattr(config, 'CONTEXT_RECENT_MEMORIES', 3)
+    memory = player.get_agent_memory(limit=storage.JOURNALED_FIELDS['agent_memory'])
+    history = player.get_session_history(limit=getattr(config, 'CONTEXT_RECENT_SESSIONS', 3))
+    points = player.get_stability_points()
+
+    state = _player_context(player)
+    with state.lock:
+        fingerprint = _fingerprint(memory, history, points)
+        if fingerprint != state.fingerprint:
+            state.fingerprint = fingerprint
+            state.cached.clear()
+            # Сворачиваем в сводку записи, вышедшие из окна последних реплик
+            older = memory[:-recent_memories] if recent_memories else memory
+            for entry in older:
+                if entry.get('timestamp', '') > state.summary.folded_until:
+                    state.summary.fold(entry)
+
+        key = (district, emotion)
+        text = state.cached.get(key)
+        if text is None:
+            recent = memory[-recent_memories:] if recent_memories else []
+            text = state.cached[key] = _assemble(district, emotion, recent, history, points, state.summary.render())
+        return text
+
+
+def _assemble(
+    district: Optional[str],
+    emotion: Optional[str],
+    recent: List[Dict[str, Any]],
+    history: List[Dict[str, Any]],
+    points: int,
+    summary: Optional[str]
+) -> str:
+    """Собирает контекст, добавляя разделы по приоритету, пока хватает бюджета"""
+    budget = getattr(config, 'CONTEXT_TOKEN_BUDGET', 400)
+    snippet_chars = getattr(config, 'CONTEXT_SNIPPET_CHARS', 150)
+
+    header = []
+    if district:
+        district_info = game_engine.City.get_district_info(district)
+        if district_info:
+            header.append(f"Текущий квартал: {district_info['name']} ({district_info['description']})")
+    if emotion:
+        header.append(f"Эмоция игрока: {emotion}")
+    progress = f"\nТекущие очки устойчивости: {points}"
+
+    # Шапка и прогресс обязательны
+    remaining = budget - estimate_tokens("\n".join(header + [progress]))
+
+    def section(title: str, lines: List[str]) -> List[str]:
+        """Заголовок и столько строк (в порядке приоритета), сколько влезает в бюджет"""
+        nonlocal remaining
+        available = remaining - estimate_tokens(title)
+        taken = []
+        for line in lines:
+            cost = estimate_tokens(line)
+            if cost > available:
+                break
+            available -= cost
+            taken.append(line)
+        if not taken:
+            return []
+        remaining = available
+        return [title] + taken
+
+    # Память агента: свежие реплики важнее
+    memory_lines = section("\nВажные моменты из прошлого:", [
+        f"- {entry.get('text', '')[:snippet_chars]}..." for entry in reversed(recent)
+    ])
+    memory_lines[1:] = reversed(memory_lines[1:])
+
+    session_lines = section("\nНедавние сессии:", [
+        f"- {session.get('district', 'неизвестно')}: {session.get('emotion', 'неизвестно')}"
+        for session in reversed(history)
+    ])
+    session_lines[1:] = reversed(session_lines[1:])
+
+    summary_lines = section("\nРаньше:", [summary]) if summary else []
+
+    return "\n".join(header + session_lines + summary_lines + memory_lines + [progress])
@@ -1,33 +1,342 @@
 """
 Этический фильтр для обнаружения кризисных ситуаций
+
+Сообщение нормализуется (регистр, ё→е, пунктуация, латинская транслитерация
+и похожие латинские буквы, лёгкий стемминг) и сверяется с индексом
+последовательностей основ ключевых фраз за один проход по словам. Поэтому
+«Не хочу... жить», «ne hochu zhit» и «БОЛЬШЕ не выдержу» находятся без
+отдельного правила на каждую форму, а стоимость проверки не растёт с числом фраз.
+
+Глагольные окончания (прошедшее время, лицо, инфинитив) остаются в основе
+меткой формы: «не выдержу» не совпадает с «не выдержал экзамен», а «не могу
+больше» — с «не может больше».
 """
 import re
-from typing import Tuple
+from functools import lru_cache
+from typing import Dict, Any, Iterator, List, Optional, Tuple
+
+
+# Слова в тексте, уже приведённом к нижнему регистру
+WORD_PATTERN = re.compile(r'[а-яёa-z]+')
+
+# Транслитерация латиницей: сначала буквосочетания, затем отдельные буквы
+TRANSLIT_DIGRAPHS = {
+    'shch': 'щ', 'sch': 'щ', 'tsya': 'тся', 'tsa': 'тся', 'zh': 'ж', 'kh': 'х', 'ch': 'ч',
+    'sh': 'ш', 'ts': 'ц', 'yu': 'ю', 'ju': 'ю', 'ya': 'я', 'ja': 'я', 'yo': 'е', 'jo': 'е',
+    'ye': 'е', 'je': 'е', 'iy': 'ий', 'ay': 'ай', 'oy': 'ой', 'ey': 'ей', 'uy': 'уй'
+}
+TRANSLIT_DIGRAPH_PATTERN = re.compile('|'.join(sorted(TRANSLIT_DIGRAPHS, key=len, reverse=True)))
+TRANSLIT_LETTERS = str.maketrans({
+    'a': 'а', 'b': 'б', 'v': 'в', 'g': 'г', 'd': 'д', 'e': 'е', 'z': 'з', 'i': 'и',
+    'j': 'й', 'k': 'к', 'l': 'л', 'm': 'м', 'n': 'н', 'o': 'о', 'p': 'п', 'r': 'р',
+    's': 'с', 't': 'т', 'u': 'у', 'f': 'ф', 'h': 'х', 'c': 'ц', 'y': 'ы', 'w': 'в',
+    'x': 'кс', 'q': 'к'
+})
+# Латинские буквы, похожие на кириллические (в словах со смешанным письмом)
+HOMOGLYPHS = str.maketrans({
+    'a': 'а', 'e': 'е', 'o': 'о', 'p': 'р', 'c': 'с', 'x': 'х', 'y': 'у', 'k': 'к', 'm': 'м', 't': 'т'
+})
+
+# Окончания для лёгкого стемминга (по длине, от длинных к коротким)
+REFLEXIVE_ENDINGS = ('ся', 'сь')
+ENDINGS = sorted({
+    # глаголы
+    'ать', 'ять', 'еть', 'ить', 'уть', 'ыть', 'ть', 'ешь', 'ишь', 'ете', 'ите',
+    'ают', 'яют', 'уют', 'ует', 'ала', 'ало', 'али', 'ила', 'ило', 'или', 'ела', 'ело', 'ели',
+    'ат', 'ят', 'ет', 'ит', 'ут', 'ют', 'ем', 'им', 'ал', 'ил',
+    # прилагательные и местоимения
+    'ого', 'его', 'ому', 'ему', 'ыми', 'ими', 'ая', 'яя', 'ое', 'ее', 'ые', 'ие',
+    'ый', 'ий', 'ой', 'ую', 'юю', 'ым', 'ом',
+    # существительные
+    'ами', 'ями', 'ах', 'ях', 'ов', 'ев', 'ей', 'ам', 'ям', 'ью', 'ия', 'ии',
+    'а', 'я', 'о', 'е', 'ы', 'и', 'у', 'ю', 'ь'
+}, key=len, reverse=True)
+MIN_STEM = 3
+
+# Метки глагольных форм: слово фразы совпадает только с той же формой
+# (окончания на -у/-ю не помечаются — ими же заканчиваются формы существительных)
+VERB_FORMS = {
+    **dict.fromkeys(('ать', 'ять', 'еть', 'ить', 'уть', 'ыть', 'ть'), 'inf'),
+    **dict.fromkeys(('ала', 'ало', 'али', 'ила', 'ило', 'или', 'ела', 'ело', 'ели', 'ал', 'ил'), 'past'),
+    **dict.fromkeys(('ешь', 'ишь'), '2sg'),
+    **dict.fromkeys(('ует', 'ет', 'ит'), '3sg'),
+    **dict.fromkeys(('ем', 'им'), '1pl'),
+    **dict.fromkeys(('ете', 'ите'), '2pl'),
+    **dict.fromkeys(('ают', 'яют', 'уют', 'ат', 'ят', 'ут', 'ют'), '3pl'),
+}
+
+
+LATIN_PATTERN = re.compile(r'[a-z]')
+
+
+@lru_cache(maxsize=65536)
+def _fold_script(word: str) -> str:
+    """Латиница → кириллица: транслит для латинских слов, похожие буквы — для смешанных"""
+    if word.isascii():
+        return TRANSLIT_DIGRAPH_PATTERN.sub(lambda m: TRANSLIT_DIGRAPHS[m.group()], word).translate(TRANSLIT_LETTERS)
+    if LATIN_PATTERN.search(word):
+        return word.translate(HOMOGLYPHS)
+    return word
+
+
+@lru_cache(maxsize=65536)
+def stem(word: str) -> str:
+    """
+    Основа нормализованного слова (см. normalize); ь и ъ отбрасываются
+
+    После глагольного окончания к основе добавляется метка формы ('выдерж|past').
+    """
+    for ending in REFLEXIVE_ENDINGS:
+        if word.endswith(ending) and len(word) - len(ending) >= MIN_STEM:
+            word = word[:-len(ending)]
+            break
+    form = ''
+    for ending in ENDINGS:
+        if word.endswith(ending) and len(word) - len(ending) >= MIN_STEM:
+            word = word[:-len(ending)]
+            if ending in VERB_FORMS:
+                form = '|' + VERB_FORMS[ending]
+            break
+    return word.replace('ь', '').replace('ъ', '') + form
+
+
+@lru_cache(maxsize=65536)
+def loose_stem(word: str) -> str:
+    """Основа без метки глагольной формы (сопоставление без учёта времени и лица)"""
+    return stem(word).partition('|')[0]
+
+
+def normalize(text: str) -> List[str]:
+    """
+    Слова текста в нормализованном виде
+
+    Нижний регистр, ё→е, латиница приведена к кириллице, пунктуация между
+    словами отброшена. Границы слов — как у WORD_PATTERN в text.lower().
+    """
+    folded = text.lower().replace('ё', 'е')
+    words = WORD_PATTERN.findall(folded)
+    if LATIN_PATTERN.search(folded):
+        words = list(map(_fold_script, words))
+    return words
+
+
+class _IndexNode:
+    """Узел индекса: переходы по основе следующего слова или по началу слова"""
+
+    __slots__ = ('children', 'prefixes', 'rule', 'stemmer')
+
+    def __init__(self):
+        self.children: Dict[str, '_IndexNode'] = {}
+        # длина префикса -> {префикс: узел}
+        self.prefixes: Dict[int, Dict[str, '_IndexNode']] = {}
+        self.rule: Optional[int] = None
+        # Функция основы для слов текста (задаётся у корня индекса)
+        self.stemmer = stem
+
+
+# Наборов фраз немного (кризис, ответы модели, текущие намерения), но каждая правка
+# файла намерений даёт новый набор — старые индексы вытесняются
+@lru_cache(maxsize=8)
+def compile_rules(keywords: Tuple[str, ...], forms: bool = True) -> _IndexNode:
+    """
+    Строит индекс последовательностей основ (один раз на набор фраз)
+
+    Фраза — слова через пробел. Слово со звёздочкой на конце ('суицид*')
+    совпадает с любым словом, которое с него начинается; остальные слова
+    сравниваются по основе, поэтому формы слова находятся одной фразой.
+    С forms=False метки глагольных форм отбрасываются: «бесит» совпадает
+    и с «бесило» (так сопоставляются намерения fallback_engine).
+    """
+    root = _IndexNode()
+    root.stemmer = stem if forms else loose_stem
+    for index, phrase in enumerate(keywords):
+        node = root
+        for word in phrase.lower().replace('ё', 'е').split():
+            if word.endswith('*'):
+                prefix = _fold_script(word[:-1])
+                node = node.prefixes.setdefault(len(prefix), {}).setdefault(prefix, _IndexNode())
+            else:
+                node = node.children.setdefault(root.stemmer(_fold_script(word)), _IndexNode())
+        if node.rule is None:
+            node.rule = index
+    return root
+
+
+def _next_nodes(node: _IndexNode, word: str, word_stem: str) -> List[_IndexNode]:
+    """Узлы, в которые ведёт слово"""
+    nodes = []
+    child = node.children.get(word_stem)
+    if child is not None:
+        nodes.append(child)
+    for length, prefixes in node.prefixes.items():
+        child = prefixes.get(word[:length])
+        if child is not None:
+            nodes.append(child)
+    return nodes
+
+
+def _match_from(node: _IndexNode, words: List[str], stems: List[str], position: int) -> Optional[Tuple[int, int]]:
+    """Фраза, продолжающаяся со слова position: (номер правила, индекс последнего слова)"""
+    if position >= len(words):
+        return None
+    for child in _next_nodes(node, words[position], stems[position]):
+        if child.rule is not None:
+            return child.rule, position
+        found = _match_from(child, words, stems, position + 1)
+        if found:
+            return found
+    return None
+
+
+def iter_matches(index: _IndexNode, words: List[str]) -> Iterator[Tuple[int, int, int]]:
+    """
+    Фразы индекса в нормализованных словах: (номер правила, первое слово, последнее слово)
+
+    Один проход по словам: слово, с которого не начинается ни одна фраза,
+    отсеивается одним поиском в словаре; дальше проверяются только продолжения.
+    С каждого слова засчитывается не больше одной фразы.
+    """
+    stems = list(map(index.stemmer, words))
+    first = index.children
+    prefixes = list(index.prefixes.items())
+    for position, word_stem in enumerate(stems):
+        if word_stem not in first:
+            word = words[position]
+            for length, group in prefixes:
+                if word[:length] in group:
+                    break
+            else:
+                continue
+        found = _match_from(index, words, stems, position)
+        if found:
+            yield found[0], position, found[1]
+
+
+def match_words(index: _IndexNode, words: List[str]) -> Optional[Tuple[int, int, int]]:
+    """Первая фраза индекса в словах (см. iter_matches)"""
+    return next(iter_matches(index, words), None)
+
+
+# Слово длиннее не может быть частью фразы — дальше его не копим (линейность потока)
+MAX_WORD_CHARS = 64
+WORD_CHARS = frozenset('абвгдеёжзийклмнопрстуфхцчшщъыьэюяabcdefghijklmnopqrstuvwxyz')
+
+
+class CrisisStreamScanner:
+    """
+    Проверка текста, приходящего по частям (поток ответа модели)
+
+    Между частями хранится только недописанное последнее слово и узлы индекса,
+    в которых остановились начатые фразы, поэтому накопленный текст повторно
+    не просматривается и стоимость линейна по длине ответа. feed() возвращает
+    часть текста, которую уже можно отдавать клиенту: недописанное слово
+    придерживается, пока не станет ясно, что оно не завершает фразу.
+    """
+
+    def __init__(self, index: _IndexNode, keywords: List[str]):
+        self.index = index
+        self.keywords = keywords
+        self.match: Optional[Dict[str, Any]] = None
+        self._partial = ''
+        # (узел индекса, слова начатой фразы)
+        self._active: List[Tuple[_IndexNode, Tuple[str, ...]]] = []
+
+    def feed(self, chunk: str) -> str:
+        """Проверяет очередную часть; возвращает проверенный текст ('' после срабатывания)"""
+        if self.match:
+            return ''
+        text = self._partial + chunk
+        lowered = text.lower()
+        boundary = len(lowered)
+        while boundary > 0 and lowered[boundary - 1] in WORD_CHARS:
+            boundary -= 1
+        if len(lowered) - boundary > MAX_WORD_CHARS:
+            boundary = len(lowered)
+        self._partial = text[boundary:]
+        if self._scan(lowered[:boundary]):
+            return ''
+        return text[:boundary]
+
+    def finish(self) -> str:
+        """Конец потока: проверяет придержанное слово и возвращает его ('' после срабатывания)"""
+        if self.match:
+            return ''
+        tail, self._partial = self._partial, ''
+        if self._scan(tail.lower()):
+            return ''
+        return tail
+
+    def _scan(self, lowered: str) -> bool:
+        for word in normalize(lowered):
+            word_stem = self.index.stemmer(word)
+            advanced = []
+            # Раньше начатые фразы первыми — как у match_words, побеждает самая ранняя
+            for node, words in self._active + [(self.index, ())]:
+                for child in _next_nodes(node, word, word_stem):
+                    if child.rule is not None:
+                        self.match = {
+                            'rule': self.keywords[child.rule],
+                            'rule_index': child.rule,
+                            'fragment': ' '.join(words + (word,))
+                        }
+                        self._active = []
+                        return True
+                    advanced.append((child, words + (word,)))
+            self._active = advanced
+        return False
 
 
 class EthicalFilter:
     """Фильтр для обнаружения кризисных сообщений"""
     
-    # Триггерные фразы и паттерны
+    # Кризисные фразы (формат — см. compile_rules)
     CRISIS_KEYWORDS = [
-        r'не\s+хочу\s+жить',
-        r'хочу\s+умереть',
-        r'покончить\s+с\s+собой',
-        r'суицид',
-        r'самоубийств',
-        r'кончить\s+жизнь',
-        r'убить\s+себя',
-        r'больше\s+не\s+выдержу',
-        r'всё\s+бесполезно',
-        r'лучше\s+бы\s+меня\s+не\s+было',
-        r'не\s+вижу\s+смысла',
-        r'всё\s+кончено',
-        r'конец\s+всему',
-        r'не\s+выдержу',
-        r'не\s+могу\s+больше',
-        r'хватит\s+всё',
+        'не хочу жить',
+        'не хочется жить',
+        'хочу умереть',
+        'хочется умереть',
+        'хочу умирать',
+        'лучше умереть',
+        'покончить с собой',
+        'покончу с собой',
+        'покончить с жизнью',
+        'свести счеты с жизнью',
+        'суицид*',
+        'самоубийств*',
+        'кончить жизнь',
+        'убить себя',
+        'убью себя',
+        'больше не выдержу',
+        'всё бесполезно',
+        'лучше бы меня не было',
+        'не вижу смысла',
+        'всё кончено',
+        'конец всему',
+        'не выдержу',
+        'не могу больше',
+        'хватит всё',
+    ]
+    
+    # Для ответов модели — только описания способов и инструкции. Фразы игрока
+    # («не хочу жить», «не могу больше») сюда не входят: сочувственный ответ
+    # часто их повторяет, и это не повод прятать его и блокировать игру
+    OUTPUT_KEYWORDS = [
+        'смертельн* доз*',
+        'передозировк*',
+        'вскрыть вены',
+        'перерезать вены',
+        'спрыгнуть с крыши',
+        'способ покончить',
+        'способ умереть',
+        'способ убить себя',
+        'как покончить с собой',
+        'как убить себя',
     ]
     
+    # Общие индексы для всех экземпляров
+    INDEX = compile_rules(tuple(CRISIS_KEYWORDS))
+    OUTPUT_INDEX = compile_rules(tuple(OUTPUT_KEYWORDS))
+    
     # Горячие линии помощи (Россия)
     HELPLINES = [
         {
@@ -48,8 +357,41 @@ class EthicalFilter:
     ]
     
     def __init__(self):
-        # Компилируем регулярные выражения
-        self.patterns = [re.compile(pattern, re.IGNORECASE) for pattern in self.CRISIS_KEYWORDS]
+        # Подкласс со своим списком получает свой индекс (тоже из кеша)
+        self.index = compile_rules(tuple(self.CRISIS_KEYWORDS))
+        self.output_index = compile_rules(tuple(self.OUTPUT_KEYWORDS))
+    
+    def find_crisis(self, message: str) -> Optional[Dict[str, Any]]:
+        """
+        Ищет кризисные фразы одним проходом по словам сообщения
+        
+        Returns:
+            None или {'rule': фраза правила, 'rule_index': номер, 'fragment': найденный текст}
+        """
+        found = match_words(self.index, normalize(message))
+        if not found:
+            return None
+        index, first, last = found
+        lowered = message.lower()
+        spans = [match.span() for match in WORD_PATTERN.finditer(lowered)]
+        # lower() почти всегда сохраняет длину строки — тогда фрагмент берём из исходного текста
+        source = message if len(lowered) == len(message) else lowered
+        return {
+            'rule': self.CRISIS_KEYWORDS[index],
+            'rule_index': index,
+            'fragment': source[spans[first][0]:spans[last][1]]
+        }
+    
+    def stream_scanner(self) -> CrisisStreamScanner:
+        """Сканер для ответа модели, приходящего по частям"""
+        return CrisisStreamScanner(self.output_index, self.OUTPUT_KEYWORDS)
+    
+    def check_output(self, text: str) -> Optional[Dict[str, Any]]:
+        """Проверяет готовый ответ модели (правила OUTPUT_KEYWORDS); None, если всё в порядке"""
+        scanner = self.stream_scanner()
+        scanner.feed(text)
+        scanner.finish()
+        return scanner.match
     
     def check_message(self, message: str) -> Tuple[bool, str]:
         """
@@ -58,15 +400,12 @@ class EthicalFilter:
         Returns:
             (is_crisis, response_message)
         """
-        message_lower = message.lower()
-        
-        for pattern in self.patterns:
-            if pattern.search(message_lower):
-                return True, self._generate_crisis_response()
+        if self.find_crisis(message):
+            return True, self.get_crisis_response()
         
         return False, ""
     
-    def _generate_crisis_response(self) -> str:
+    def get_crisis_response(self) -> str:
         """Генерирует ответ с информацией о помощи"""
         response = "Я вижу, что тебе сейчас очень тяжело. Это не игра, и я не могу помочь в такой ситуации.\n\n"
         response += "Пожалуйста, обратись за профессиональной помощью:\n\n"
@@ -80,6 +419,13 @@ class EthicalFilter:
         
         return response
     
+    def get_output_replacement(self) -> str:
+        """Ответ вместо реплики модели, остановленной фильтром (игра не блокируется)"""
+        return (
+            "Я не могу продолжить этот ответ. Давай вернёмся к тому, что ты чувствуешь прямо сейчас.\n\n"
+            f"Если становится совсем тяжело, позвони: 📞 {self.HELPLINES[0]['name']}: {self.HELPLINES[0]['phone']}"
+        )
+    
     def get_helplines_json(self) -> list:
         """Возвращает список горячих линий в формате JSON"""
         return self.HELPLINES
@@ -0,0 +1,109 @@
+"""
+События игрока для отправки клиенту (Server-Sent Events)
+
+Игровой код публикует событие после записи транзакции (game_engine),
+поток /api/events ждёт новых событий игрока и отправляет их клиенту.
+У каждого игрока — короткий журнал последних событий с возрастающими id:
+подписчик читает всё, что новее последнего полученного id.
+
+id события для клиента — «<эпоха процесса>-<номер>». После перезапуска
+процесса, вытеснения журнала или переполнения старый id уже не позволяет
+дочитать пропущенное: since() возвращает None, и поток отправляет клиенту
+полный снимок прогресса вместо событий.
+"""
+import itertools
+import threading
+import time
+from collections import OrderedDict, deque
+from typing import Dict, Any, List, Optional
+import config
+
+
+class PlayerLog:
+    """Последние события игрока"""
+
+    __slots__ = ('events', 'floor')
+
+    def __init__(self, capacity: int, floor: int):
+        self.events: deque = deque(maxlen=capacity)
+        # События с id <= floor могли быть потеряны (вытеснены из журнала)
+        self.floor = floor
+
+
+class EventHub:
+    """Журналы событий игроков процесса"""
+
+    def __init__(self, capacity: int = 100, max_players: int = 1000):
+        # Сколько последних событий хранится на игрока и сколько игроков помнится
+        self.capacity = capacity
+        self.max_players = max_players
+        self.epoch = format(time.time_ns() // 1000, 'x')
+        self._logs: 'OrderedDict[str, PlayerLog]' = OrderedDict()
+        self._ids = itertools.count(1)
+        self._last_id = 0
+        # Наибольший id среди вытесненных журналов: клиентам с более старым id нужен снимок
+        self._evicted_floor = 0
+        self._changed = threading.Condition()
+
+    def publish(self, player_id: str, event_type: str, data: Dict[str, Any]) -> int:
+        """Добавляет событие в журнал игрока и будит его подписчиков; возвращает id"""
+        with self._changed:
+            event_id = self._last_id = next(self._ids)
+            log = self._logs.get(player_id)
+            if log is None:
+                log = self._logs[player_id] = PlayerLog(self.capacity, self._evicted_floor)
+            self._logs.move_to_end(player_id)
+            if len(log.events) == log.events.maxlen:
+                log.floor = log.events[0]['id']
+            log.events.append({'id': event_id, 'type': event_type, 'data': data})
+            while len(self._logs) > self.max_players:
+                _, evicted = self._logs.popitem(last=False)
+                if evicted.events:
+                    self._evicted_floor = max(self._evicted_floor, evicted.events[-1]['id'])
+            self._changed.notify_all()
+        return event_id
+
+    def _since(self, player_id: str, last_id: int) -> Optional[List[Dict[str, Any]]]:
+        log = self._logs.get(player_id)
+        floor = log.floor if log is not None else self._evicted_floor
+        if last_id < floor:
+            return None
+        if log is None:
+            return []
+        return [event for event in log.events if event['id'] > last_id]
+
+    def since(self, player_id: str, last_id: int = 0) -> Optional[List[Dict[str, Any]]]:
+        """События игрока новее last_id (None — часть событий уже потеряна)"""
+        with self._changed:
+            return self._since(player_id, last_id)
+
+    def last_id(self) -> int:
+        """id последнего события процесса (точка отсчёта для нового подписчика)"""
+        with self._changed:
+            return self._last_id
+
+    def wait(self, player_id: str, last_id: int, timeout: float) -> Optional[List[Dict[str, Any]]]:
+        """Ждёт событий новее last_id не дольше timeout секунд (как since)"""
+        with self._changed:
+            self._changed.wait_for(lambda: self._since(player_id, last_id) != [], timeout)
+            return self._since(player_id, last_id)
+
+    def format_id(self, event_id: int) -> str:
+        """id события для поля id: в SSE"""
+        return f"{self.epoch}-{event_id}"
+
+    def parse_id(self, value: Optional[str]) -> Optional[int]:
+        """id из Last-Event-ID (None — id чужой эпохи или некорректный)"""
+        epoch, _, number = (value or '').partition('-')
+        if epoch != self.epoch or not number.isdigit():
+            return None
+        return int(number)
+
+
+# Общий журнал процесса
+hub = EventHub(capacity=getattr(config, 'EVENTS_LOG_SIZE', 100))
+
+
+def publish(player_id: str, event_type: str, data: Dict[str, Any]) -> int:
+    """Публикует событие игрока в общий журнал"""
+    return hub.publish(player_id, event_type, data)
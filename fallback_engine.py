@@ -0,0 +1,141 @@
+"""
+Ответы Айры без LLM (когда API недоступен)
+
+Намерения и ответы описаны в scenarios/fallback_intents.json. Ключевые фразы
+всех намерений компилируются в один индекс основ (тот же, что у этического
+фильтра), поэтому сообщение разбирается за один проход: каждое найденное
+слово добавляет очки своему намерению, совпадение с эмоцией сессии — ещё очко.
+Ответ берётся из вариантов для текущего квартала, если они есть.
+
+Файл перечитывается на лету: изменение замечается по времени изменения
+и размеру (не чаще FALLBACK_RELOAD_SECONDS). Файл с ошибкой не применяется —
+продолжают работать прежние намерения.
+"""
+import json
+import os
+import random
+import threading
+import time
+from typing import Dict, Any, List, Optional, Tuple
+import config
+import ethical_filter
+
+
+# Вес совпадений: слова из сообщения важнее эмоции, выбранной в начале сессии
+KEYWORD_SCORE = 2
+EMOTION_SCORE = 1
+
+DEFAULT_RESPONSE = "Я здесь, чтобы поддержать тебя. Расскажи, что происходит?"
+
+
+class CompiledIntents:
+    """Намерения из файла, готовые к сопоставлению"""
+
+    def __init__(self, data: Dict[str, Any]):
+        self.intents: List[Dict[str, Any]] = data.get('intents', [])
+        self.default: Dict[str, Any] = data.get('default', {})
+        keywords, self.keyword_owners = self._phrases('keywords')
+        emotions, self.emotion_owners = self._phrases('emotions')
+        # Время и лицо глагола для намерений не важны («бесит» и «бесило»)
+        self.keyword_index = ethical_filter.compile_rules(keywords, forms=False)
+        self.emotion_index = ethical_filter.compile_rules(emotions, forms=False)
+
+    def _phrases(self, field: str) -> Tuple[Tuple[str, ...], List[int]]:
+        """Фразы всех намерений и номер намерения для каждой фразы"""
+        phrases, owners = [], []
+        for position, intent in enumerate(self.intents):
+            if not intent.get('id') or not intent.get('responses'):
+                raise ValueError(f"Намерение №{position + 1}: нужны id и responses")
+            for phrase in intent.get(field, []):
+                if not isinstance(phrase, str) or not phrase.strip():
+                    raise ValueError(f"Намерение {intent['id']}: пустая фраза в {field}")
+                phrases.append(phrase)
+                owners.append(position)
+        return tuple(phrases), owners
+
+    def classify(self, message: str, emotion: str = None) -> Optional[Dict[str, Any]]:
+        """Намерение с наибольшим счётом (при равенстве — то, что выше в файле)"""
+        scores = [0] * len(self.intents)
+        for rule, _, _ in ethical_filter.iter_matches(self.keyword_index, ethical_filter.normalize(message)):
+            scores[self.keyword_owners[rule]] += KEYWORD_SCORE
+        if emotion:
+            for rule, _, _ in ethical_filter.iter_matches(self.emotion_index, ethical_filter.normalize(emotion)):
+                scores[self.emotion_owners[rule]] += EMOTION_SCORE
+        best = max(range(len(scores)), key=lambda position: (scores[position], -position), default=None)
+        if best is None or not scores[best]:
+            return None
+        return self.intents[best]
+
+
+def _pick(section: Dict[str, Any], district: str = None) -> Optional[str]:
+    """Вариант ответа для квартала или общий"""
+    responses = section.get('district_responses', {}).get(district) or section.get('responses')
+    return random.choice(responses) if responses else None
+
+
+class FallbackEngine:
+    """Выбор ответа по намерению с перечитыванием файла намерений"""
+
+    def __init__(self, intents_path: str = "scenarios/fallback_intents.json"):
+        self.intents_path = intents_path
+        self._lock = threading.Lock()
+        self._compiled: Optional[CompiledIntents] = None
+        self._identity: Optional[Tuple[int, int]] = None
+        self._checked_at = 0.0
+        self.load()
+
+    def _file_identity(self) -> Optional[Tuple[int, int]]:
+        try:
+            stat = os.stat(self.intents_path)
+        except OSError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
+
+    def load(self) -> bool:
+        """Загружает и компилирует намерения; при ошибке остаются прежние"""
+        identity = self._file_identity()
+        try:
+            with open(self.intents_path, 'r', encoding='utf-8') as f:
+                compiled = CompiledIntents(json.load(f))
+        except (OSError, ValueError) as e:
+            print(f"Ошибка загрузки намерений {self.intents_path}: {e}")
+            with self._lock:
+                # Не пытаемся перечитать тот же файл на каждом запросе
+                self._identity = identity
+            return False
+        with self._lock:
+            self._compiled = compiled
+            self._identity = identity
+        return True
+
+    def reload_if_changed(self):
+        """Перечитывает файл, если он изменился (проверка не чаще FALLBACK_RELOAD_SECONDS)"""
+        interval = getattr(config, 'FALLBACK_RELOAD_SECONDS', 2.0)
+        now = time.monotonic()
+        with self._lock:
+            if now - self._checked_at < interval:
+                return
+            self._checked_at = now
+            known = self._identity
+        if self._file_identity() != known:
+            self.load()
+
+    def classify(self, message: str, emotion: str = None) -> Optional[str]:
+        """id намерения сообщения (None, если ни одно не подошло)"""
+        self.reload_if_changed()
+        compiled = self._compiled
+        intent = compiled.classify(message, emotion) if compiled else None
+        return intent['id'] if intent else None
+
+    def respond(self, message: str, district: str = None, emotion: str = None) -> str:
+        """Ответ на сообщение с учётом квартала и эмоции сессии"""
+        self.reload_if_changed()
+        compiled = self._compiled
+        if compiled is None:
+            return DEFAULT_RESPONSE
+        intent = compiled.classify(message, emotion)
+        return (
+            (_pick(intent, district) if intent else None) or
+            _pick(compiled.default, district) or
+            DEFAULT_RESPONSE
+        )
@@ -1,18 +1,100 @@
 """
 Игровая логика и механики InnerQuest
 """
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
 from datetime import datetime, timedelta
-from typing import Dict, Any, Optional, Tuple
+from typing import Dict, Any, Callable, Iterator, List, Optional, Tuple
 import storage
 import config
+import events
+
+
+# Наблюдатели изменений игрока: fn(player_data, before) -> [(тип события, данные), ...],
+# где before — progress_fields() на начало транзакции. Вызываются в конце внешней
+# транзакции (их изменения попадают в ту же запись), события публикуются клиенту
+# после успешной записи.
+observers: List[Callable[[Dict[str, Any], Dict[str, Any]], List[Tuple[str, Dict[str, Any]]]]] = []
+
+
+def progress_fields(data: Dict[str, Any]) -> Dict[str, Any]:
+    """Копия полей прогресса, которые видит клиент (для сравнения до/после транзакции)"""
+    return {
+        'stability_points': data.get('stability_points', 0),
+        'effort': data.get('effort', 0),
+        'acts_completed': data.get('acts_completed', 0),
+        'last_session_time': data.get('last_session_time'),
+        'equipped_card': data.get('equipped_card'),
+        'owned_cards': list(data.get('owned_cards') or ()),
+        'completed_levels': list(data.get('completed_levels') or ()),
+        'district_sessions': dict(data.get('district_sessions') or {}),
+        'actions_history': dict(data.get('actions_history') or {}),
+        'districts': {key: dict(district) for key, district in (data.get('districts') or {}).items()},
+    }
 
 
 class Player:
     """Класс игрока"""
     
     def __init__(self, player_id: str = "default"):
-        self.storage = storage.Storage(player_id)
+        self.player_id = player_id
+        self.storage = storage.create_storage(player_id)
         self.data = self.storage.load_player()
+        # Защищает self.data от одновременных запросов одного игрока
+        self.lock = threading.RLock()
+        self.storage.merge_listener = self._adopt_merged
+    
+    def _adopt_merged(self, before: Dict[str, Any], merged: Dict[str, Any]):
+        """
+        Отложенная запись слила сохранение с версией другого процесса (вызывается из её потока)
+
+        Изменения, сделанные после снимка before, переносятся на результат слияния —
+        в памяти и в очереди записи одновременно, под self.lock.
+        """
+        with self.lock:
+            adopted = storage.merge_player_data(before, self.data, merged)
+            # На месте: открытая в этом потоке транзакция держит тот же словарь
+            self.data.clear()
+            self.data.update(adopted)
+            self.storage.rebase_pending(before, merged)
+    
+    @contextmanager
+    def transaction(self) -> Iterator[storage.Transaction]:
+        """
+        Единица работы над данными игрока
+
+        Транзакция начинается с данных в памяти (self.data) без повторной загрузки,
+        игровые методы (в том числе вложенные unlock_district/level_up_district) меняют
+        их на месте, а запись выполняется один раз при выходе. Блок держит self.lock.
+        При исключении изменения отбрасываются перезагрузкой из хранилища.
+        Если сохранение успел записать другой процесс, транзакция начинается с его версии.
+        Перед записью внешней транзакции вызываются наблюдатели (observers),
+        их события публикуются после записи.
+        """
+        with self.lock:
+            outer = not self.storage.in_transaction()
+            if outer:
+                fresh = self.storage.reload_if_changed()
+                if fresh is not None:
+                    self.data = fresh
+            before = progress_fields(self.data) if outer and observers else None
+            pending = []
+            try:
+                with self.storage.transaction(self.data) as tx:
+                    yield tx
+                    # save_player внутри блока мог подменить словарь данных
+                    self.data = tx.data
+                    if before is not None and not tx.cancelled:
+                        for observer in observers:
+                            pending.extend(observer(self.data, before))
+            except Exception:
+                if not self.storage.in_transaction():
+                    self.data = self.storage.load_player()
+                raise
+            if tx.committed:
+                for event_type, data in pending:
+                    events.publish(self.player_id, event_type, data)
     
     def get_stability_points(self) -> int:
         """Возвращает текущие очки устойчивости"""
@@ -20,8 +102,9 @@ class Player:
     
     def add_points(self, points: int) -> bool:
         """Добавляет очки устойчивости"""
-        self.data['stability_points'] += points
-        return self.storage.save_player(self.data)
+        with self.transaction() as tx:
+            tx.data['stability_points'] += points
+        return tx.committed
     
     def get_district(self, district_key: str) -> Optional[Dict[str, Any]]:
         """Получает информацию о квартале"""
@@ -36,17 +119,13 @@ class Player:
     
     def level_up_district(self, district_key: str) -> bool:
         """Повышает уровень квартала"""
-        if self.storage.level_up_district(district_key):
-            self.data = self.storage.load_player()
-            return True
-        return False
+        with self.transaction():
+            return self.storage.level_up_district(district_key)
     
     def unlock_district(self, district_key: str) -> bool:
         """Разблокирует квартал"""
-        if self.storage.unlock_district(district_key):
-            self.data = self.storage.load_player()
-            return True
-        return False
+        with self.transaction():
+            return self.storage.unlock_district(district_key)
     
     def check_unlocks(self):
         """Проверяет и разблокирует новые кварталы"""
@@ -88,25 +167,26 @@ class Player:
     
     def start_session(self, district_key: str, emotion: str, intensity: int) -> Dict[str, Any]:
         """Начинает новую игровую сессию"""
-        can_start, error = self.can_start_session()
-        if not can_start:
-            return {'success': False, 'error': error}
-
-        # Подготавливаем счётчики прогресса
-        self.data.setdefault('district_sessions', {})
-        self.data.setdefault('actions_history', {})
-        self.data['last_session_district'] = district_key
-        
-        session_data = {
-            'district': district_key,
-            'emotion': emotion,
-            'intensity': intensity,
-            'started_at': datetime.now().isoformat(),
-            'completed': False
-        }
-        
-        self.data['last_session_time'] = datetime.now().isoformat()
-        self.storage.save_player(self.data)
+        with self.transaction() as tx:
+            can_start, error = self.can_start_session()
+            if not can_start:
+                tx.cancel()
+                return {'success': False, 'error': error}
+
+            # Подготавливаем счётчики прогресса
+            self.data.setdefault('district_sessions', {})
+            self.data.setdefault('actions_history', {})
+            self.data['last_session_district'] = district_key
+            
+            session_data = {
+                'district': district_key,
+                'emotion': emotion,
+                'intensity': intensity,
+                'started_at': datetime.now().isoformat(),
+                'completed': False
+            }
+            
+            self.data['last_session_time'] = datetime.now().isoformat()
         
         return {'success': True, 'session': session_data}
     
@@ -115,60 +195,48 @@ class Player:
         if points is None:
             points = config.POINTS_PER_SESSION
 
-        # Загружаем актуальные данные, чтобы не потерять историю при нескольких сохранениях
-        player_data = self.storage.load_player()
-        player_data.setdefault('district_sessions', {})
-        player_data.setdefault('actions_history', {})
-        player_data.setdefault('completed_levels', [])
-
-        session_data['completed'] = True
-        session_data['completed_at'] = datetime.now().isoformat()
-        session_data['points_earned'] = points
-
-        # Добавляем сессию в историю
-        session_record = dict(session_data)
-        session_record['timestamp'] = datetime.now().isoformat()
-        history = player_data.get('session_history', [])
-        history.append(session_record)
-        if len(history) > 50:
-            history = history[-50:]
-        player_data['session_history'] = history
-
-        # Начисляем очки устойчивости
-        player_data['stability_points'] = player_data.get('stability_points', 0) + points
-
-        # Фиксируем прогресс по кварталу
-        district_key = session_data.get('district')
-        if district_key:
-            district_sessions = player_data['district_sessions']
-            district_sessions[district_key] = district_sessions.get(district_key, 0) + 1
-            player_data['last_session_district'] = district_key
-
-            district_info = player_data.get('districts', {}).get(district_key)
-            if district_info is not None:
-                district_info['sessions_count'] = district_info.get('sessions_count', 0) + 1
-                district_info['level'] = district_info.get('level', 0) + 1
-
-        # Отмечаем завершённые уровни и акты
-        level_id = session_data.get('level_id')
-        if level_id and level_id not in player_data['completed_levels']:
-            player_data['completed_levels'].append(level_id)
-
-        if session_data.get('act'):
-            player_data['acts_completed'] = max(
-                player_data.get('acts_completed', 0),
-                session_data['act']
-            )
-
-        # Сохраняем обновленные данные
-        self.data = player_data
-        self.storage.save_player(self.data)
-
-        # Проверяем разблокировки после обновлений
-        self.check_unlocks()
-
-        # Обновляем данные после возможной разблокировки
-        self.data = self.storage.load_player()
+        # Одна загрузка и одна запись на всю сессию, включая разблокировки
+        with self.transaction() as tx:
+            player_data = tx.data
+            player_data.setdefault('district_sessions', {})
+            player_data.setdefault('actions_history', {})
+            player_data.setdefault('completed_levels', [])
+
+            session_data['completed'] = True
+            session_data['completed_at'] = datetime.now().isoformat()
+            session_data['points_earned'] = points
+
+            # Добавляем сессию в историю
+            self.storage.add_session(dict(session_data))
+
+            # Начисляем очки устойчивости
+            player_data['stability_points'] = player_data.get('stability_points', 0) + points
+
+            # Фиксируем прогресс по кварталу
+            district_key = session_data.get('district')
+            if district_key:
+                district_sessions = player_data['district_sessions']
+                district_sessions[district_key] = district_sessions.get(district_key, 0) + 1
+                player_data['last_session_district'] = district_key
+
+                district_info = player_data.get('districts', {}).get(district_key)
+                if district_info is not None:
+                    district_info['sessions_count'] = district_info.get('sessions_count', 0) + 1
+                    district_info['level'] = district_info.get('level', 0) + 1
+
+            # Отмечаем завершённые уровни и акты
+            level_id = session_data.get('level_id')
+            if level_id and level_id not in player_data['completed_levels']:
+                player_data['completed_levels'].append(level_id)
+
+            if session_data.get('act'):
+                player_data['acts_completed'] = max(
+                    player_data.get('acts_completed', 0),
+                    session_data['act']
+                )
+
+            # Проверяем разблокировки на тех же данных в памяти
+            self.check_unlocks()
 
         return {
             'success': True,
@@ -179,32 +247,116 @@ class Player:
     
     def get_session_history(self, limit: int = 10) -> list:
         """Возвращает историю сессий"""
-        history = self.data.get('session_history', [])
-        return history[-limit:] if limit else history
+        return self.storage.get_entries('session_history', limit)
     
     def get_agent_memory(self, limit: int = 20) -> list:
         """Возвращает память агента"""
-        memory = self.data.get('agent_memory', [])
-        return memory[-limit:] if limit else memory
+        return self.storage.get_entries('agent_memory', limit)
     
     def add_ritual(self, ritual: Dict[str, Any]) -> bool:
         """Добавляет ритуал в список"""
-        if 'rituals' not in self.data:
-            self.data['rituals'] = []
-        
-        ritual['created_at'] = datetime.now().isoformat()
-        self.data['rituals'].append(ritual)
-        return self.storage.save_player(self.data)
+        with self.transaction() as tx:
+            ritual['created_at'] = datetime.now().isoformat()
+            tx.data.setdefault('rituals', []).append(ritual)
+        return tx.committed
     
     def add_goal(self, goal: Dict[str, Any]) -> bool:
         """Добавляет цель в список"""
-        if 'goals' not in self.data:
-            self.data['goals'] = []
-        
-        goal['created_at'] = datetime.now().isoformat()
-        goal['completed'] = False
-        self.data['goals'].append(goal)
-        return self.storage.save_player(self.data)
+        with self.transaction() as tx:
+            goal['created_at'] = datetime.now().isoformat()
+            goal['completed'] = False
+            tx.data.setdefault('goals', []).append(goal)
+        return tx.committed
+
+
+class PlayerRegistry:
+    """
+    Реестр игроков процесса с LRU-кешем
+
+    Горячие игроки остаются в памяти между запросами, поэтому сохранение читается
+    один раз. Сверх capacity вытесняются давно не использованные игроки, которые
+    сейчас не заняты запросами; перед вытеснением их сохранение сбрасывается на диск.
+    Пока вытесненный игрок закрывается, acquire того же игрока ждёт: новый Player
+    читает сохранение только после записи старого и не делит с ним журнал.
+    """
+
+    def __init__(self, capacity: int = 1000):
+        self.capacity = capacity
+        self._players: 'OrderedDict[str, Player]' = OrderedDict()
+        self._refs: Dict[str, int] = {}
+        # Вытесненные игроки, которые ещё закрываются: player_id -> событие окончания
+        self._closing: Dict[str, threading.Event] = {}
+        self._lock = threading.Lock()
+
+    def acquire(self, player_id: str) -> Player:
+        """Возвращает игрока и помечает его занятым до release()"""
+        while True:
+            with self._lock:
+                closing = self._closing.get(player_id)
+                if closing is None:
+                    player = self._players.get(player_id)
+                    if player is not None:
+                        self._players.move_to_end(player_id)
+                    else:
+                        player = Player(player_id)
+                        self._players[player_id] = player
+                    self._refs[player_id] = self._refs.get(player_id, 0) + 1
+                    evicted = self._collect_evictions()
+                    break
+            closing.wait()
+
+        for old_player in evicted:
+            self._close(old_player)
+        return player
+
+    def release(self, player: Player):
+        """Снимает пометку занятости, взятую acquire()"""
+        with self._lock:
+            refs = self._refs.get(player.player_id, 0) - 1
+            if refs > 0:
+                self._refs[player.player_id] = refs
+            else:
+                self._refs.pop(player.player_id, None)
+            evicted = self._collect_evictions()
+
+        for old_player in evicted:
+            self._close(old_player)
+
+    def _collect_evictions(self) -> list:
+        """Выбирает игроков на вытеснение (под self._lock)"""
+        evicted = []
+        if len(self._players) <= self.capacity:
+            return evicted
+        for player_id in list(self._players):
+            if len(self._players) <= self.capacity:
+                break
+            if self._refs.get(player_id):
+                continue
+            evicted.append(self._players.pop(player_id))
+            self._closing[player_id] = threading.Event()
+        return evicted
+
+    def _close(self, player: Player):
+        try:
+            with player.lock:
+                player.storage.close()
+        finally:
+            with self._lock:
+                closing = self._closing.pop(player.player_id)
+            closing.set()
+
+    def flush_all(self) -> bool:
+        """Сбрасывает сохранения всех игроков в памяти"""
+        with self._lock:
+            players = list(self._players.values())
+        ok = True
+        for player in players:
+            with player.lock:
+                ok = player.storage.flush() and ok
+        return ok
+
+    def __len__(self) -> int:
+        return len(self._players)
 
 
 class City:
@@ -0,0 +1,382 @@
+"""
+Асинхронный слой вызовов LLM API
+
+Все запросы к модели выполняются в одном фоновом event loop процесса через
+AsyncOpenAI поверх общего httpx.AsyncClient (keep-alive, при наличии пакета h2 — HTTP/2).
+Поток Flask только ждёт результат, причём не дольше дедлайна запроса.
+
+Защита сервера от медленного API:
+- семафор ограничивает число одновременных запросов; если слот не освободился
+  за LLM_QUEUE_TIMEOUT, запрос сразу отклоняется (LLMOverloadedError);
+- у каждого запроса есть дедлайн (LLMTimeoutError);
+- автомат-предохранитель (CircuitBreaker) после серии ошибок/таймаутов размыкается
+  и отклоняет запросы без обращения к API (CircuitOpenError), пока пробный запрос
+  не покажет, что API восстановился.
+Вызывающий код на любую из этих ошибок отвечает fallback-ответом.
+"""
+import asyncio
+import atexit
+import queue
+import threading
+import time
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from typing import Dict, Any, Iterator, List, Optional
+import httpx
+from openai import AsyncOpenAI
+import config
+
+try:
+    import h2  # noqa: F401 — нужен httpx для HTTP/2
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+
+class LLMUnavailableError(Exception):
+    """Запрос к LLM не выполнен (базовый класс)"""
+
+
+class CircuitOpenError(LLMUnavailableError):
+    """Предохранитель разомкнут — API недавно не отвечал"""
+
+
+class LLMOverloadedError(LLMUnavailableError):
+    """Все слоты заняты дольше допустимого ожидания"""
+
+
+class LLMTimeoutError(LLMUnavailableError):
+    """Запрос не уложился в дедлайн"""
+
+
+class CircuitBreaker:
+    """
+    Предохранитель: closed → open после failure_threshold ошибок подряд,
+    open → half_open через reset_timeout (пропускается один пробный запрос),
+    half_open → closed при успехе пробы или снова open при ошибке.
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, failure_threshold: int, reset_timeout: float):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._lock = threading.Lock()
+        self._state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probe_started: Optional[float] = None
+        self._last_error: Optional[str] = None
+        self._trips = 0
+
+    def allow(self) -> bool:
+        """Можно ли выполнить запрос сейчас"""
+        with self._lock:
+            now = time.monotonic()
+            if self._state == self.OPEN and now - self._opened_at >= self.reset_timeout:
+                self._state = self.HALF_OPEN
+                self._probe_started = None
+            if self._state == self.CLOSED:
+                return True
+            if self._state == self.HALF_OPEN:
+                # Одна проба за раз; зависшая проба не блокирует восстановление навсегда
+                if self._probe_started is None or now - self._probe_started >= self.reset_timeout:
+                    self._probe_started = now
+                    return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self._state = self.CLOSED
+            self._failures = 0
+            self._probe_started = None
+
+    def release_probe(self):
+        """Пробный запрос не дошёл до API — следующий запрос снова может стать пробой"""
+        with self._lock:
+            self._probe_started = None
+
+    def record_failure(self, error: BaseException):
+        with self._lock:
+            self._failures += 1
+            self._last_error = f"{type(error).__name__}: {error}"
+            if self._state == self.HALF_OPEN or self._failures >= self.failure_threshold:
+                if self._state != self.OPEN:
+                    self._trips += 1
+                self._state = self.OPEN
+                self._opened_at = time.monotonic()
+                self._probe_started = None
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            if self._state == self.OPEN and time.monotonic() - self._opened_at >= self.reset_timeout:
+                return self.HALF_OPEN
+            return self._state
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Состояние для мониторинга"""
+        state = self.state
+        with self._lock:
+            retry_in = 0.0
+            if state == self.OPEN:
+                retry_in = max(0.0, self.reset_timeout - (time.monotonic() - self._opened_at))
+            return {
+                'state': state,
+                'consecutive_failures': self._failures,
+                'failure_threshold': self.failure_threshold,
+                'trips': self._trips,
+                'retry_in_seconds': round(retry_in, 1),
+                'last_error': self._last_error
+            }
+
+
+_DONE = object()
+
+
+class LLMExecutor:
+    """Фоновый event loop с общим клиентом, семафором, дедлайнами и предохранителем"""
+
+    def __init__(self):
+        self.max_concurrency = getattr(config, 'LLM_MAX_CONCURRENCY', 8)
+        self.deadline = getattr(config, 'LLM_DEADLINE_SECONDS', 20.0)
+        self.queue_timeout = getattr(config, 'LLM_QUEUE_TIMEOUT', 2.0)
+        self.breaker = CircuitBreaker(
+            getattr(config, 'LLM_BREAKER_FAILURES', 5),
+            getattr(config, 'LLM_BREAKER_RESET_SECONDS', 30.0)
+        )
+        self._lock = threading.Lock()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._thread: Optional[threading.Thread] = None
+        self._client: Optional[AsyncOpenAI] = None
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._in_flight = 0
+        self._counters = {'completed': 0, 'failed': 0, 'timeouts': 0, 'rejected': 0, 'short_circuited': 0}
+
+    # --- Event loop ---
+
+    def _ensure_loop(self) -> asyncio.AbstractEventLoop:
+        with self._lock:
+            if self._loop is None:
+                loop = asyncio.new_event_loop()
+                ready = threading.Event()
+                failure: List[BaseException] = []
+
+                def run():
+                    try:
+                        asyncio.set_event_loop(loop)
+                        self._semaphore = asyncio.Semaphore(self.max_concurrency)
+                        self._client = self._build_client()
+                    except BaseException as e:
+                        failure.append(e)
+                        loop.close()
+                        return
+                    finally:
+                        ready.set()
+                    loop.run_forever()
+
+                self._thread = threading.Thread(target=run, name='llm-event-loop', daemon=True)
+                self._thread.start()
+                ready.wait()
+                if failure:
+                    # Цикл не поднят: вызывающий переходит на fallback, следующий вызов попробует снова
+                    raise failure[0]
+                self._loop = loop
+            return self._loop
+
+    def _build_client(self) -> AsyncOpenAI:
+        """OpenAI-клиент поверх пула соединений"""
+        http_client = httpx.AsyncClient(
+            timeout=httpx.Timeout(
+                getattr(config, 'LLM_TIMEOUT', 30.0),
+                connect=getattr(config, 'LLM_CONNECT_TIMEOUT', 5.0)
+            ),
+            limits=httpx.Limits(
+                max_connections=getattr(config, 'LLM_MAX_CONNECTIONS', 20),
+                max_keepalive_connections=getattr(config, 'LLM_MAX_KEEPALIVE_CONNECTIONS', 10),
+                keepalive_expiry=getattr(config, 'LLM_KEEPALIVE_EXPIRY', 60.0)
+            ),
+            http2=getattr(config, 'LLM_HTTP2', True) and HTTP2_AVAILABLE
+        )
+        # Поддержка альтернативных API провайдеров (OpenRouter и др.)
+        return AsyncOpenAI(
+            api_key=config.OPENAI_API_KEY,
+            base_url=getattr(config, 'OPENAI_BASE_URL', None) or None,
+            http_client=http_client,
+            max_retries=getattr(config, 'LLM_MAX_RETRIES', 1),
+            default_headers={
+                "HTTP-Referer": "https://github.com/innerquest-game",
+                "X-Title": "InnerQuest Game"
+            }
+        )
+
+    # --- Выполнение запросов ---
+
+    def _admit(self):
+        """Проверка предохранителя перед запросом"""
+        if not self.breaker.allow():
+            with self._lock:
+                self._counters['short_circuited'] += 1
+            raise CircuitOpenError("LLM API временно недоступен (предохранитель разомкнут)")
+
+    def _start(self) -> asyncio.AbstractEventLoop:
+        """Допуск предохранителя и event loop (ошибка запуска цикла — отказ для предохранителя)"""
+        self._admit()
+        try:
+            return self._ensure_loop()
+        except Exception as e:
+            self.breaker.record_failure(e)
+            raise
+
+    async def _guarded(self, work):
+        """Слот семафора, дедлайн и учёт результата в предохранителе"""
+        try:
+            await asyncio.wait_for(self._semaphore.acquire(), self.queue_timeout)
+        except asyncio.TimeoutError:
+            work.close()
+            with self._lock:
+                self._counters['rejected'] += 1
+            # Перегрузка — не признак отказа API, предохранитель не трогаем,
+            # но пробный запрос half_open освобождаем
+            self.breaker.release_probe()
+            raise LLMOverloadedError("Слишком много одновременных запросов к LLM")
+
+        with self._lock:
+            self._in_flight += 1
+        try:
+            result = await asyncio.wait_for(work, self.deadline)
+        except asyncio.TimeoutError:
+            with self._lock:
+                self._counters['timeouts'] += 1
+            error = LLMTimeoutError(f"Ответ LLM не получен за {self.deadline} с")
+            self.breaker.record_failure(error)
+            raise error
+        except asyncio.CancelledError:
+            # Клиент ушёл — результат неизвестен, предохранитель не трогаем
+            self.breaker.release_probe()
+            raise
+        except Exception as e:
+            with self._lock:
+                self._counters['failed'] += 1
+            self.breaker.record_failure(e)
+            raise
+        finally:
+            with self._lock:
+                self._in_flight -= 1
+            self._semaphore.release()
+
+        with self._lock:
+            self._counters['completed'] += 1
+        self.breaker.record_success()
+        return result
+
+    def chat(self, messages: List[Dict[str, str]], **params) -> str:
+        """Полный ответ модели (блокирует вызывающий поток не дольше дедлайна)"""
+        loop = self._start()
+
+        async def complete():
+            response = await self._client.chat.completions.create(messages=messages, **params)
+            return response.choices[0].message.content or ''
+
+        future = asyncio.run_coroutine_threadsafe(self._guarded(complete()), loop)
+        try:
+            return future.result(timeout=self.queue_timeout + self.deadline + 1.0)
+        except FutureTimeoutError:
+            future.cancel()
+            raise LLMTimeoutError(f"Ответ LLM не получен за {self.deadline} с")
+
+    def stream_chat(self, messages: List[Dict[str, str]], **params) -> Iterator[str]:
+        """
+        Ответ модели по фрагментам текста
+
+        Фрагменты передаются из event loop через очередь; весь поток укладывается
+        в тот же дедлайн. Если потребитель прекратил чтение, запрос отменяется.
+        """
+        loop = self._start()
+        chunks: queue.Queue = queue.Queue()
+
+        async def pump():
+            stream = await self._client.chat.completions.create(messages=messages, stream=True, **params)
+            try:
+                async for chunk in stream:
+                    if chunk.choices and chunk.choices[0].delta.content:
+                        chunks.put(chunk.choices[0].delta.content)
+            finally:
+                await stream.close()
+
+        async def run():
+            try:
+                await self._guarded(pump())
+                chunks.put(_DONE)
+            except Exception as e:
+                chunks.put(e)
+
+        future = asyncio.run_coroutine_threadsafe(run(), loop)
+        wait = self.queue_timeout + self.deadline + 1.0
+        started = time.monotonic()
+        try:
+            while True:
+                remaining = wait - (time.monotonic() - started)
+                try:
+                    item = chunks.get(timeout=max(0.0, remaining))
+                except queue.Empty:
+                    raise LLMTimeoutError(f"Ответ LLM не получен за {self.deadline} с")
+                if item is _DONE:
+                    return
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+        finally:
+            if not future.done():
+                future.cancel()
+
+    def stats(self) -> Dict[str, Any]:
+        """Состояние слоя для мониторинга"""
+        with self._lock:
+            data = {
+                'in_flight': self._in_flight,
+                'max_concurrency': self.max_concurrency,
+                'deadline_seconds': self.deadline,
+                'queue_timeout_seconds': self.queue_timeout,
+                **self._counters
+            }
+        data['circuit'] = self.breaker.snapshot()
+        return data
+
+    def close(self):
+        """Закрывает пул соединений и останавливает event loop"""
+        with self._lock:
+            loop, client = self._loop, self._client
+            self._loop = self._client = None
+        if loop is None:
+            return
+        if client is not None:
+            try:
+                asyncio.run_coroutine_threadsafe(client.close(), loop).result(timeout=5.0)
+            except Exception as e:
+                print(f"Ошибка закрытия клиента LLM: {e}")
+        loop.call_soon_threadsafe(loop.stop)
+
+
+_executor: Optional[LLMExecutor] = None
+_executor_lock = threading.Lock()
+
+
+def get_executor() -> LLMExecutor:
+    """Общий исполнитель запросов к LLM (один на процесс)"""
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = LLMExecutor()
+    return _executor
+
+
+def close():
+    """Закрывает пул соединений"""
+    if _executor is not None:
+        _executor.close()
+
+
+atexit.register(close)
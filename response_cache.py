@@ -0,0 +1,96 @@
+"""
+Кеш ответов LLM
+
+Ключ — хеш нормализованных промпта и контекста. Записи живут не дольше TTL,
+вытесняются по LRU, суммарный объём ограничен в байтах. Счётчики попаданий
+и сэкономленного времени ответа провайдера доступны через stats().
+"""
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Any, Iterable, Optional
+
+
+def normalize(text: str) -> str:
+    """Нормализует текст для ключа: регистр и пробельные символы"""
+    return ' '.join(str(text).split()).casefold()
+
+
+def make_key(*parts: Iterable[Any]) -> str:
+    """Ключ кеша из частей (каждая нормализуется)"""
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(normalize(part).encode('utf-8'))
+        digest.update(b'\x00')
+    return digest.hexdigest()
+
+
+class ResponseCache:
+    """LRU-кеш ответов с TTL и лимитом объёма"""
+
+    def __init__(self, ttl: float, max_bytes: int):
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        # ключ -> (ответ, время записи, размер, время генерации ответа)
+        self._entries: 'OrderedDict[str, tuple]' = OrderedDict()
+        self._bytes = 0
+        self._counters = {'hits': 0, 'misses': 0, 'expired': 0, 'evictions': 0}
+        self._saved_seconds = 0.0
+
+    def get(self, key: str) -> Optional[str]:
+        """Ответ из кеша (None при промахе или истёкшем TTL)"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self._counters['misses'] += 1
+                return None
+            response, stored_at, size, latency = entry
+            if time.monotonic() - stored_at > self.ttl:
+                self._remove(key)
+                self._counters['expired'] += 1
+                self._counters['misses'] += 1
+                return None
+            self._entries.move_to_end(key)
+            self._counters['hits'] += 1
+            self._saved_seconds += latency
+            return response
+
+    def put(self, key: str, response: str, latency: float = 0.0):
+        """Сохраняет ответ; latency — сколько заняла генерация (для статистики экономии)"""
+        size = len(response.encode('utf-8')) + len(key)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (response, time.monotonic(), size, latency)
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                self._counters['evictions'] += 1
+
+    def _remove(self, key: str):
+        _, _, size, _ = self._entries.pop(key)
+        self._bytes -= size
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self) -> Dict[str, Any]:
+        """Счётчики для мониторинга"""
+        with self._lock:
+            lookups = self._counters['hits'] + self._counters['misses']
+            return {
+                **self._counters,
+                'hit_rate': round(self._counters['hits'] / lookups, 3) if lookups else 0.0,
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'max_bytes': self.max_bytes,
+                'ttl_seconds': self.ttl,
+                'saved_provider_seconds': round(self._saved_seconds, 3)
+            }
@@ -0,0 +1,95 @@
+"""
+Сериализация сохранений игрока
+
+Форматы (config.SAVE_FORMAT):
+- "pretty"  — JSON с отступами (читается глазами, самый большой);
+- "compact" — JSON без отступов и пробелов;
+- "zlib", "lz4" — сжатый компактный JSON с заголовком-сигнатурой.
+
+При чтении формат определяется по первым байтам, поэтому смена настройки
+не требует миграции: старые файлы читаются, новые пишутся в новом формате.
+Если установлен orjson, он используется для кодирования и разбора JSON.
+"""
+import json
+import zlib
+from typing import Dict, Any
+import config
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import lz4.frame as lz4_frame
+except ImportError:
+    lz4_frame = None
+
+
+# Сигнатуры сжатых форматов (JSON не может начинаться с этих байт)
+ZLIB_MAGIC = b'IQZ1'
+LZ4_MAGIC = b'IQL1'
+
+FORMATS = ('pretty', 'compact', 'zlib', 'lz4')
+
+
+class SerializationError(ValueError):
+    """Повреждённые или нечитаемые данные сохранения"""
+
+
+def _use_fast_json() -> bool:
+    return orjson is not None and getattr(config, 'SAVE_FAST_JSON', True)
+
+
+def encode_json(data: Dict[str, Any], indent: bool = False) -> bytes:
+    """Кодирует данные в JSON (UTF-8)"""
+    if _use_fast_json():
+        try:
+            return orjson.dumps(data, option=orjson.OPT_INDENT_2 if indent else 0)
+        except TypeError:
+            # Типы, которые orjson не поддерживает (например, нестроковые ключи)
+            pass
+    if indent:
+        return json.dumps(data, ensure_ascii=False, indent=2).encode('utf-8')
+    return json.dumps(data, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+
+def decode_json(payload: bytes) -> Any:
+    """Разбирает JSON"""
+    if _use_fast_json():
+        return orjson.loads(payload)
+    return json.loads(payload)
+
+
+def dumps(data: Dict[str, Any], fmt: str = None) -> bytes:
+    """Сериализует сохранение в выбранном формате"""
+    fmt = fmt or getattr(config, 'SAVE_FORMAT', 'pretty')
+    if fmt == 'pretty':
+        return encode_json(data, indent=True)
+    if fmt == 'compact':
+        return encode_json(data)
+    if fmt == 'lz4':
+        if lz4_frame is not None:
+            return LZ4_MAGIC + lz4_frame.compress(encode_json(data))
+        # lz4 не установлен — сжимаем zlib, файл всё равно прочитается
+        fmt = 'zlib'
+    if fmt == 'zlib':
+        level = getattr(config, 'SAVE_ZLIB_LEVEL', 6)
+        return ZLIB_MAGIC + zlib.compress(encode_json(data), level)
+    raise ValueError(f"Неизвестный формат сохранения: {fmt}")
+
+
+def loads(payload: bytes) -> Dict[str, Any]:
+    """Разбирает сохранение любого формата (определяется по сигнатуре)"""
+    try:
+        if payload.startswith(ZLIB_MAGIC):
+            payload = zlib.decompress(payload[len(ZLIB_MAGIC):])
+        elif payload.startswith(LZ4_MAGIC):
+            if lz4_frame is None:
+                raise SerializationError("Сохранение сжато lz4, но пакет lz4 не установлен")
+            payload = lz4_frame.decompress(payload[len(LZ4_MAGIC):])
+        return decode_json(payload)
+    except SerializationError:
+        raise
+    except (zlib.error, RuntimeError, ValueError) as e:
+        raise SerializationError(str(e)) from e
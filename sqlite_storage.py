@@ -0,0 +1,499 @@
+"""
+Хранилище сохранений игрока в SQLite (режим WAL)
+
+Документ игрока разложен по строкам: каждое скалярное поле, каждый квартал,
+каждая запись истории и памяти агента — отдельная строка. Поэтому изменение
+одного счётчика пишет одну строку, а не всё сохранение целиком.
+"""
+import glob
+import json
+import os
+import sqlite3
+import threading
+from datetime import datetime
+from typing import Dict, Any, List, Optional, Tuple
+import config
+import serializers
+import storage
+
+
+# Поля-списки, которые хранятся построчно, и их лимиты
+LIST_TABLES = storage.JOURNALED_FIELDS
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS player_fields (
+    player_id TEXT NOT NULL,
+    key TEXT NOT NULL,
+    value TEXT NOT NULL,
+    PRIMARY KEY (player_id, key)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS districts (
+    player_id TEXT NOT NULL,
+    district_key TEXT NOT NULL,
+    position INTEGER NOT NULL DEFAULT 0,
+    data TEXT NOT NULL,
+    PRIMARY KEY (player_id, district_key)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS session_history (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    player_id TEXT NOT NULL,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_session_history_player ON session_history (player_id, id);
+
+CREATE TABLE IF NOT EXISTS agent_memory (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    player_id TEXT NOT NULL,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_agent_memory_player ON agent_memory (player_id, id);
+"""
+
+# Соединения живут по одному на поток и файл базы
+_local = threading.local()
+
+
+def _dumps(value: Any) -> str:
+    """Сериализует значение одной строки таблицы"""
+    return json.dumps(value, ensure_ascii=False, separators=(',', ':'))
+
+
+def get_connection(db_path: str = None) -> sqlite3.Connection:
+    """Возвращает соединение текущего потока (создаёт схему при первом открытии)"""
+    db_path = db_path or config.SQLITE_DB_PATH
+    connections = getattr(_local, 'connections', None)
+    if connections is None:
+        connections = _local.connections = {}
+
+    conn = connections.get(db_path)
+    if conn is None:
+        directory = os.path.dirname(db_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        conn = sqlite3.connect(db_path, isolation_level=None, timeout=10.0)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.executescript(SCHEMA)
+        connections[db_path] = conn
+    return conn
+
+
+class SQLiteStorage(storage.Storage):
+    """Сохранения игрока в SQLite с построчными обновлениями"""
+
+    def __init__(self, player_id: str = "default", db_path: str = None):
+        self.player_id = player_id
+        self.db_path = db_path or config.SQLITE_DB_PATH
+        # Последнее известное состояние строк в базе: ключ -> сериализованное значение
+        self._stored_fields: Dict[str, str] = {}
+        self._stored_districts: Dict[str, str] = {}
+        self._stored_lists: Dict[str, List[Tuple[int, str]]] = {}
+        self._snapshot_loaded = False
+        self._tx_state = threading.local()
+
+    @property
+    def conn(self) -> sqlite3.Connection:
+        return get_connection(self.db_path)
+
+    def _exists(self) -> bool:
+        """Проверяет, есть ли игрок в базе"""
+        row = self.conn.execute(
+            'SELECT 1 FROM player_fields WHERE player_id = ? LIMIT 1',
+            (self.player_id,)
+        ).fetchone()
+        return row is not None
+
+    def _read_rows(self) -> Dict[str, Any]:
+        """Читает все строки игрока и запоминает их как базовое состояние"""
+        conn = self.conn
+        data: Dict[str, Any] = {}
+        self._stored_fields = {}
+        for key, value in conn.execute(
+            'SELECT key, value FROM player_fields WHERE player_id = ?', (self.player_id,)
+        ):
+            self._stored_fields[key] = value
+            data[key] = json.loads(value)
+
+        self._stored_districts = {}
+        districts = {}
+        for district_key, value in conn.execute(
+            'SELECT district_key, data FROM districts WHERE player_id = ? ORDER BY position',
+            (self.player_id,)
+        ):
+            self._stored_districts[district_key] = value
+            districts[district_key] = json.loads(value)
+        data['districts'] = districts
+
+        for table in LIST_TABLES:
+            rows = conn.execute(
+                f'SELECT id, data FROM {table} WHERE player_id = ? ORDER BY id',
+                (self.player_id,)
+            ).fetchall()
+            self._stored_lists[table] = rows
+            data[table] = [json.loads(value) for _, value in rows]
+
+        self._snapshot_loaded = True
+        return data
+
+    def load_player(self) -> Dict[str, Any]:
+        """Загружает данные игрока из базы"""
+        tx = self._current_transaction()
+        if tx is not None:
+            return tx.data
+
+        try:
+            if not self._exists():
+                self._reset_snapshot()
+                return self._create_default_player()
+            data = self._read_rows()
+            # Устаревшую схему мигрируем один раз и сразу записываем
+            if storage.migrate_player_data(data):
+                self.save_player(data)
+            return data
+        except sqlite3.Error as e:
+            print(f"Ошибка загрузки сохранения: {e}")
+            return self._create_default_player()
+
+    def reload_if_changed(self) -> Optional[Dict[str, Any]]:
+        """Свежие данные игрока, если версию в базе поднял другой процесс или поток"""
+        if self.in_transaction() or not self._snapshot_loaded:
+            return None
+        try:
+            if self._db_version(self.conn) == self._stored_version():
+                return None
+        except sqlite3.Error:
+            return None
+        return self.load_player()
+
+    def _db_version(self, conn: sqlite3.Connection) -> int:
+        row = conn.execute(
+            "SELECT value FROM player_fields WHERE player_id = ? AND key = 'version'",
+            (self.player_id,)
+        ).fetchone()
+        return int(json.loads(row[0])) if row else 0
+
+    def _stored_version(self) -> int:
+        return int(json.loads(self._stored_fields.get('version', '0')))
+
+    def _bump_version(self, conn: sqlite3.Connection):
+        """Поднимает версию игрока (внутри транзакции точечного обновления)"""
+        cursor = conn.execute(
+            "UPDATE player_fields SET value = CAST(value AS INTEGER) + 1 "
+            "WHERE player_id = ? AND key = 'version'",
+            (self.player_id,)
+        )
+        if cursor.rowcount == 0:
+            conn.execute(
+                "INSERT INTO player_fields (player_id, key, value) VALUES (?, 'version', '1')",
+                (self.player_id,)
+            )
+
+    def _stored_data(self) -> Dict[str, Any]:
+        """Документ игрока в том виде, в каком мы последний раз видели его в базе"""
+        data = {key: json.loads(value) for key, value in self._stored_fields.items()}
+        data['districts'] = {key: json.loads(value) for key, value in self._stored_districts.items()}
+        for table in LIST_TABLES:
+            data[table] = [json.loads(value) for _, value in self._stored_lists.get(table, [])]
+        return data
+
+    def _reset_snapshot(self):
+        """Сбрасывает кеш строк (игрока нет в базе)"""
+        self._stored_fields = {}
+        self._stored_districts = {}
+        self._stored_lists = {table: [] for table in LIST_TABLES}
+        self._snapshot_loaded = True
+
+    def save_player(self, player_data: Dict[str, Any]) -> bool:
+        """Сохраняет данные игрока, записывая только изменившиеся строки"""
+        player_data['last_save'] = datetime.now().isoformat()
+        player_data['player_id'] = self.player_id
+
+        tx = self._current_transaction()
+        if tx is not None:
+            # Запись выполнит транзакция при фиксации
+            tx.data = player_data
+            return True
+
+        conn = self.conn
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                if not self._snapshot_loaded:
+                    self._read_rows()
+                # Compare-and-swap: версия в базе должна совпадать с прочитанной нами
+                db_version = self._db_version(conn)
+                if db_version != self._stored_version():
+                    base = self._stored_data()
+                    theirs = self._migrate_player_data(self._read_rows())
+                    merged = storage.merge_player_data(base, player_data, theirs)
+                    player_data.clear()
+                    player_data.update(merged)
+                player_data['version'] = db_version + 1
+                self._write_fields(conn, player_data)
+                self._write_districts(conn, player_data.get('districts', {}))
+                for table in LIST_TABLES:
+                    self._write_list(conn, table, player_data.get(table, []))
+                conn.execute('COMMIT')
+            except Exception:
+                conn.execute('ROLLBACK')
+                # Кеш строк мог разойтись с базой — перечитаем при следующей записи
+                self._snapshot_loaded = False
+                raise
+            return True
+        except (sqlite3.Error, TypeError, ValueError) as e:
+            print(f"Ошибка сохранения: {e}")
+            return False
+
+    def flush(self) -> bool:
+        """Записи в SQLite не откладываются — сбрасывать нечего"""
+        return True
+
+    def close(self) -> bool:
+        """Дописывает очередь памяти агента игрока (игрок выгружен из памяти)"""
+        return storage._memory_writer.flush(self._writer_key())
+
+    def _write_fields(self, conn: sqlite3.Connection, player_data: Dict[str, Any]):
+        """Обновляет изменившиеся скалярные поля"""
+        current = {
+            key: _dumps(value) for key, value in player_data.items()
+            if key != 'districts' and key not in LIST_TABLES
+        }
+        for key, value in current.items():
+            if self._stored_fields.get(key) != value:
+                conn.execute(
+                    'INSERT OR REPLACE INTO player_fields (player_id, key, value) VALUES (?, ?, ?)',
+                    (self.player_id, key, value)
+                )
+        for key in set(self._stored_fields) - set(current):
+            conn.execute(
+                'DELETE FROM player_fields WHERE player_id = ? AND key = ?',
+                (self.player_id, key)
+            )
+        self._stored_fields = current
+
+    def _write_districts(self, conn: sqlite3.Connection, districts: Dict[str, Any]):
+        """Обновляет изменившиеся кварталы"""
+        current = {}
+        for position, (district_key, district) in enumerate(districts.items()):
+            value = _dumps(district)
+            current[district_key] = value
+            if self._stored_districts.get(district_key) != value:
+                conn.execute(
+                    'INSERT OR REPLACE INTO districts (player_id, district_key, position, data) '
+                    'VALUES (?, ?, ?, ?)',
+                    (self.player_id, district_key, position, value)
+                )
+        for district_key in set(self._stored_districts) - set(current):
+            conn.execute(
+                'DELETE FROM districts WHERE player_id = ? AND district_key = ?',
+                (self.player_id, district_key)
+            )
+        self._stored_districts = current
+
+    def _write_list(self, conn: sqlite3.Connection, table: str, entries: List[Any]):
+        """
+        Синхронизирует список с таблицей
+
+        Обычный случай — добавление в конец с обрезкой начала: удаляем вытесненные
+        строки и вставляем только новые. Иначе переписываем список игрока целиком.
+        """
+        stored = self._stored_lists.get(table, [])
+        new_values = [_dumps(entry) for entry in entries]
+        stored_values = [value for _, value in stored]
+
+        # Ищем, сколько старых записей вытеснено из начала списка
+        if not stored or not new_values or new_values[0] not in stored_values:
+            dropped = len(stored)
+        else:
+            start = stored_values.index(new_values[0])
+            kept = stored_values[start:]
+            dropped = start if new_values[:len(kept)] == kept else None
+
+        if dropped is None:
+            conn.execute(f'DELETE FROM {table} WHERE player_id = ?', (self.player_id,))
+            stored, dropped = [], 0
+        elif dropped:
+            conn.execute(
+                f'DELETE FROM {table} WHERE player_id = ? AND id <= ?',
+                (self.player_id, stored[dropped - 1][0])
+            )
+
+        kept_rows = stored[dropped:]
+        rows = list(kept_rows)
+        for value in new_values[len(kept_rows):]:
+            cursor = conn.execute(
+                f'INSERT INTO {table} (player_id, data) VALUES (?, ?)',
+                (self.player_id, value)
+            )
+            rows.append((cursor.lastrowid, value))
+        self._stored_lists[table] = rows
+
+    def _append_entries(self, entries: List[Tuple[str, Any]]) -> bool:
+        """Вставляет пачку записей в списки одной транзакцией и обрезает их до лимита"""
+        if self.in_transaction():
+            return super()._append_entries(entries)
+        if not self._exists():
+            # Новый игрок: сначала сохраняем полную структуру
+            player = self.load_player()
+            for table, entry in entries:
+                player[table].append(entry)
+            return self.save_player(player)
+
+        conn = self.conn
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                for table, entry in entries:
+                    conn.execute(
+                        f'INSERT INTO {table} (player_id, data) VALUES (?, ?)',
+                        (self.player_id, _dumps(entry))
+                    )
+                for table in {table for table, _ in entries}:
+                    conn.execute(
+                        f'DELETE FROM {table} WHERE player_id = ? AND id NOT IN '
+                        f'(SELECT id FROM {table} WHERE player_id = ? ORDER BY id DESC LIMIT ?)',
+                        (self.player_id, self.player_id, LIST_TABLES[table])
+                    )
+                self._bump_version(conn)
+                conn.execute('COMMIT')
+            except Exception:
+                conn.execute('ROLLBACK')
+                raise
+        except sqlite3.Error as e:
+            print(f"Ошибка сохранения: {e}")
+            return False
+        return True
+
+    def _writer_key(self) -> str:
+        return f"{self.db_path}:{self.player_id}"
+
+    def _commit_appends(self, appends: List[Tuple[str, Any]]) -> bool:
+        """Записи транзакции уже в её данных — их вставит save_player"""
+        return True
+
+    def get_entries(self, field: str, limit: int = None) -> List[Any]:
+        """Последние записи списка (запрос только нужных строк)"""
+        if self.in_transaction():
+            return super().get_entries(field, limit)
+        sql = f'SELECT data FROM {field} WHERE player_id = ? ORDER BY id DESC'
+        params: tuple = (self.player_id,)
+        if limit:
+            sql += ' LIMIT ?'
+            params += (limit,)
+        rows = self.conn.execute(sql, params).fetchall()
+        entries = self._with_queued(field, [json.loads(value) for value, in reversed(rows)])
+        return entries[-limit:] if limit else entries
+
+    def _update_row(self, sql: str, params: tuple) -> bool:
+        """
+        Выполняет точечное обновление одной строки и поднимает версию игрока
+
+        Кеш строк не сбрасывается: расхождение версий заметит следующий
+        save_player и сольёт изменение с данными в памяти.
+        """
+        conn = self.conn
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                updated = conn.execute(sql, params).rowcount > 0
+                if updated:
+                    self._bump_version(conn)
+                conn.execute('COMMIT')
+            except Exception:
+                conn.execute('ROLLBACK')
+                raise
+        except sqlite3.Error as e:
+            print(f"Ошибка сохранения: {e}")
+            return False
+        return updated
+
+    def update_points(self, points: int) -> bool:
+        """Обновляет очки устойчивости (одна строка)"""
+        if self.in_transaction():
+            return super().update_points(points)
+        if self._update_row(
+            "UPDATE player_fields SET value = CAST(value AS INTEGER) + ? "
+            "WHERE player_id = ? AND key = 'stability_points'",
+            (points, self.player_id)
+        ):
+            return True
+        # Строки ещё нет — сохраняем игрока целиком
+        player = self.load_player()
+        player['stability_points'] = player.get('stability_points', 0) + points
+        return self.save_player(player)
+
+    def unlock_district(self, district_key: str) -> bool:
+        """Разблокирует квартал (одна строка)"""
+        if self.in_transaction():
+            return super().unlock_district(district_key)
+        return self._update_row(
+            "UPDATE districts SET data = json_set(data, '$.unlocked', json('true')) "
+            "WHERE player_id = ? AND district_key = ?",
+            (self.player_id, district_key)
+        )
+
+    def level_up_district(self, district_key: str) -> bool:
+        """Повышает уровень квартала (одна строка)"""
+        if self.in_transaction():
+            return super().level_up_district(district_key)
+        return self._update_row(
+            "UPDATE districts SET data = json_set(data, '$.level', "
+            "COALESCE(json_extract(data, '$.level'), 0) + 1) "
+            "WHERE player_id = ? AND district_key = ?",
+            (self.player_id, district_key)
+        )
+
+    def import_player(self, player_data: Dict[str, Any]) -> bool:
+        """Импортирует документ игрока целиком (используется мигратором)"""
+        self._read_rows()
+        return self.save_player(self._migrate_player_data(player_data))
+
+
+def migrate_json_saves(saves_dir: str = None, db_path: str = None, overwrite: bool = False) -> Dict[str, str]:
+    """
+    Переносит JSON-сохранения в SQLite
+
+    Returns:
+        {player_id: 'migrated' | 'skipped' | 'error: ...'}
+    """
+    saves_dir = saves_dir or config.SAVES_DIR
+    results = {}
+
+    for path in sorted(glob.glob(os.path.join(saves_dir, '*.json'))):
+        player_id = os.path.splitext(os.path.basename(path))[0]
+        target = SQLiteStorage(player_id, db_path=db_path)
+
+        if target._exists() and not overwrite:
+            results[player_id] = 'skipped'
+            continue
+
+        try:
+            with open(path, 'rb') as f:
+                data = serializers.loads(f.read())
+        except (ValueError, IOError) as e:
+            results[player_id] = f'error: {e}'
+            continue
+
+        # Дописываем записи журнала, ещё не свёрнутые в снимок
+        journal = storage._get_journal(path)
+        journal.ensure_loaded(data)
+        journal.overlay(data)
+
+        results[player_id] = 'migrated' if target.import_player(data) else 'error: save failed'
+
+    return results
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Миграция JSON-сохранений в SQLite')
+    parser.add_argument('--saves-dir', default=config.SAVES_DIR)
+    parser.add_argument('--db', default=config.SQLITE_DB_PATH)
+    parser.add_argument('--overwrite', action='store_true', help='Перезаписать игроков, уже перенесённых в базу')
+    args = parser.parse_args()
+
+    for player_id, status in migrate_json_saves(args.saves_dir, args.db, args.overwrite).items():
+        print(f"{player_id}: {status}")
@@ -1,10 +1,14 @@
 (function () {
   const state = {
     progress: null,
+    cards: null,
     session: null,
     chat: []
   };
 
+  // Прогресс приходит потоком /api/events; без EventSource — перезапрос после действий
+  const live = Boolean(window.EventSource);
+
   const ui = {
     stabilityValue: document.getElementById('stabilityValue'),
     effortValue: document.getElementById('effortValue'),
@@ -115,6 +119,39 @@
     return data;
   }
 
+  async function streamRequest(url, body, onEvent) {
+    const response = await fetch(url, {
+      method: 'POST',
+      headers: { 'Content-Type': 'application/json', Accept: 'text/event-stream' },
+      body: JSON.stringify(body)
+    });
+    if (!response.ok) {
+      const data = await response.json().catch(() => ({}));
+      throw new Error(data.error || response.statusText);
+    }
+
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = '';
+    while (true) {
+      const { value, done } = await reader.read();
+      if (done) break;
+      buffer += decoder.decode(value, { stream: true });
+      let boundary;
+      while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+        const block = buffer.slice(0, boundary);
+        buffer = buffer.slice(boundary + 2);
+        let event = 'message';
+        const dataLines = [];
+        block.split('\n').forEach((line) => {
+          if (line.startsWith('event:')) event = line.slice(6).trim();
+          else if (line.startsWith('data:')) dataLines.push(line.slice(5).trim());
+        });
+        if (dataLines.length) onEvent(event, JSON.parse(dataLines.join('\n')));
+      }
+    }
+  }
+
   function showToast(message, tone = 'default') {
     if (!ui.toast) return;
     ui.toast.textContent = message;
@@ -164,6 +201,7 @@
   }
 
   function populateDistrictSelect(districts) {
+    const selected = ui.districtSelect.value;
     ui.districtSelect.innerHTML = '';
     Object.entries(districts).forEach(([key, data]) => {
       const option = document.createElement('option');
@@ -172,6 +210,7 @@
       option.disabled = !data.unlocked;
       ui.districtSelect.appendChild(option);
     });
+    if (selected && districts[selected]?.unlocked) ui.districtSelect.value = selected;
   }
 
   function renderHistory(progress) {
@@ -241,6 +280,7 @@
         request('/api/cards/available')
       ]);
       ui.equippedCard.textContent = owned.equipped ? `Экипирована: ${owned.cards.find(c => c.card_id === owned.equipped)?.name || owned.equipped}` : 'Без карты';
+      state.cards = { owned, available };
       renderCardList(owned, available);
       renderEffort(owned.effort ?? state.progress?.effort ?? 0);
     } catch (err) {
@@ -302,7 +342,7 @@
       ui.statusBadge.textContent = 'Сессия активна';
       ui.statusBadge.style.background = 'rgba(102,217,232,0.14)';
       updateSessionSummary(data);
-      await loadProgress();
+      if (!live) await loadProgress();
       if (data.agent_greeting) {
         state.chat.push({ role: 'agent', text: data.agent_greeting });
         renderChat();
@@ -328,14 +368,22 @@
         emotion: state.session?.emotion,
         session_context: state.session || {}
       };
-      const data = await request('/api/agent/chat', {
-        method: 'POST',
-        body: JSON.stringify(payload)
-      });
-      state.chat.push({ role: 'agent', text: data.response });
+      // Ответ Айры приходит по токенам и дописывается в сообщение по мере генерации
+      const reply = { role: 'agent', text: '' };
+      state.chat.push(reply);
       renderChat();
-      setCrisis(data.is_crisis);
+      await streamRequest('/api/agent/chat/stream', payload, (event, data) => {
+        if (event === 'token') {
+          reply.text += data.text;
+        } else if (event === 'done') {
+          reply.text = data.response;
+          setCrisis(data.is_crisis);
+        }
+        renderChat();
+      });
     } catch (err) {
+      state.chat = state.chat.filter((item) => item.text);
+      renderChat();
       showToast(err.message, 'error');
     }
   }
@@ -354,7 +402,7 @@
         })
       });
       showToast(`+${data.effort_earned} Effort`);
-      await loadProgress();
+      if (!live) await loadProgress();
     } catch (err) {
       showToast(err.message, 'error');
     }
@@ -371,7 +419,7 @@
       ui.statusBadge.textContent = 'Готов к запуску';
       ui.statusBadge.style.background = 'rgba(52,211,153,0.14)';
       updateSessionSummary(null);
-      await loadProgress();
+      if (!live) await loadProgress();
       showToast(`Сессия завершена: +${data.points_earned} очков`);
     } catch (err) {
       showToast(err.message, 'error');
@@ -387,6 +435,43 @@
     }
   }
 
+  function subscribeEvents() {
+    // Браузер сам переподключается и присылает Last-Event-ID
+    const source = new EventSource('/api/events');
+    const on = (type, handler) => source.addEventListener(type, (event) => handler(JSON.parse(event.data)));
+
+    // Полный снимок: при подключении и когда сервер не может дочитать пропущенное
+    on('progress', (progress) => {
+      renderProgress(progress);
+      loadCards();
+    });
+
+    on('progress_delta', (delta) => {
+      renderProgress({ ...state.progress, ...delta });
+      if ('effort' in delta && state.cards) {
+        state.cards.owned.effort = delta.effort;
+        renderCardList(state.cards.owned, state.cards.available);
+      }
+    });
+
+    on('cards_available', ({ added, removed }) => {
+      if (!state.cards) return;
+      const gone = new Set(removed);
+      state.cards.available.cards = [
+        ...(state.cards.available.cards || []).filter((card) => !gone.has(card.card_id)),
+        ...added
+      ];
+      renderCardList(state.cards.owned, state.cards.available);
+      if (added.length) showToast(`Новая карта: ${added.map((card) => card.name).join(', ')}`);
+    });
+
+    on('district_unlocked', (data) => showToast(`Открыт квартал: ${data.name || data.district}`));
+
+    on('boss_spawned', (data) => {
+      showToast(data.message || `Появился босс: ${data.boss?.name || ''}`, 'error');
+    });
+  }
+
   function bindEvents() {
     document.getElementById('sessionForm').addEventListener('submit', handleSessionStart);
     document.getElementById('chatForm').addEventListener('submit', handleChatSubmit);
@@ -399,7 +484,8 @@
   function init() {
     bindEvents();
     updateIntensityLabel();
-    loadProgress();
+    if (live) subscribeEvents();
+    else loadProgress();
   }
 
   document.addEventListener('DOMContentLoaded', init);
@@ -1,11 +1,799 @@
 """
 Система хранения данных игрока в JSON
 """
+import atexit
+import copy
+import glob
 import json
 import os
+import tempfile
+import threading
+import time
+from collections import deque
 from datetime import datetime
-from typing import Dict, Any, Optional
+from typing import Dict, Any, Callable, List, Optional, Tuple
 import config
+import serializers
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+
+# Списки, которые пополняются только добавлением через журнал, и их лимиты
+JOURNALED_FIELDS = {
+    'session_history': 50,
+    'agent_memory': 100,
+}
+
+_MISSING = object()
+
+
+def _stat_identity(path: str) -> Optional[Tuple[int, int, int]]:
+    """Отпечаток файла для дешёвой проверки, не менялся ли он"""
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return st.st_ino, st.st_size, st.st_mtime_ns
+
+
+class SaveLock:
+    """
+    Блокировка файла сохранения: RLock внутри процесса и flock между процессами
+
+    Повторный вход из того же потока не блокируется; flock берётся только на
+    внешнем уровне. На платформах без fcntl остаётся только блокировка процесса.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._rlock = threading.RLock()
+        self._depth = 0
+        self._fd = None
+
+    def __enter__(self) -> 'SaveLock':
+        self._rlock.acquire()
+        self._depth += 1
+        if self._depth == 1 and fcntl is not None:
+            try:
+                if self._fd is None:
+                    self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+                fcntl.flock(self._fd, fcntl.LOCK_EX)
+            except OSError as e:
+                print(f"Не удалось заблокировать {self.path}: {e}")
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> bool:
+        self._depth -= 1
+        if self._depth == 0 and self._fd is not None:
+            try:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+            except OSError:
+                pass
+        self._rlock.release()
+        return False
+
+    def close(self):
+        with self._rlock:
+            if self._depth == 0 and self._fd is not None:
+                os.close(self._fd)
+                self._fd = None
+
+
+def _merge_value(base: Any, ours: Any, theirs: Any) -> Any:
+    if ours == base:
+        return theirs
+    if theirs == base:
+        return ours
+
+    # Изменили оба
+    numbers = (int, float)
+    if (isinstance(ours, numbers) and isinstance(theirs, numbers) and isinstance(base, numbers) and
+            not isinstance(ours, bool) and not isinstance(theirs, bool) and not isinstance(base, bool)):
+        # Счётчики: прибавляем нашу дельту к чужому значению
+        return theirs + (ours - base)
+
+    if isinstance(ours, dict) and isinstance(theirs, dict):
+        base_dict = base if isinstance(base, dict) else {}
+        merged = {}
+        for key in list(theirs) + [key for key in ours if key not in theirs]:
+            value = _merge_value(base_dict.get(key, _MISSING), ours.get(key, _MISSING), theirs.get(key, _MISSING))
+            if value is not _MISSING:
+                merged[key] = value
+        return merged
+
+    if isinstance(ours, list) and isinstance(theirs, list):
+        base_list = base if isinstance(base, list) else []
+        removed = [item for item in base_list if item not in ours]
+        added = [item for item in ours if item not in base_list]
+        merged = [item for item in theirs if item not in removed]
+        merged.extend(item for item in added if item not in merged)
+        return merged
+
+    return ours
+
+
+def merge_player_data(base: Dict[str, Any], ours: Dict[str, Any], theirs: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Трёхстороннее слияние сохранений при конфликте версий
+
+    Накладывает наши изменения относительно base на чужую версию theirs:
+    счётчики складываются по дельтам, словари сливаются по ключам, списки —
+    объединением с учётом удалённых нами элементов, остальное берётся наше.
+    Журналируемые списки только пополняются: к чужому списку дописываются наши новые записи.
+    """
+    journaled = {}
+    for field, limit in JOURNALED_FIELDS.items():
+        theirs_list = list(theirs.get(field) or [])
+        base_list = base.get(field) or []
+        theirs_list.extend(
+            entry for entry in ours.get(field) or []
+            if entry not in base_list and entry not in theirs_list
+        )
+        journaled[field] = theirs_list[-limit:]
+
+    merged = dict(_merge_value(base, ours, theirs))
+    merged.update(journaled)
+    return merged
+
+
+def _atomic_write(path: str, payload: bytes):
+    """
+    Атомарно заменяет файл: запись во временный файл, fsync и rename
+
+    При сбое посреди записи на диске остаётся либо старое, либо новое сохранение.
+    """
+    directory = os.path.dirname(path) or '.'
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=f".{os.path.basename(path)}.", suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(payload)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+        raise
+
+    # Фиксируем сам rename (на платформах, где каталог можно открыть)
+    try:
+        dir_fd = os.open(directory, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(dir_fd)
+    except OSError:
+        pass
+    finally:
+        os.close(dir_fd)
+
+
+# Текущая версия схемы сохранения и упорядоченный реестр шагов миграции:
+# шаг N переводит сохранение из версии N-1 в N
+SCHEMA_VERSION = 2
+MIGRATIONS: Dict[int, Callable[[Dict[str, Any]], None]] = {}
+
+
+def migration(version: int):
+    """Регистрирует шаг миграции схемы до версии version"""
+    def register(step: Callable[[Dict[str, Any]], None]):
+        MIGRATIONS[version] = step
+        return step
+    return register
+
+
+def _default_player_data(player_id: str) -> Dict[str, Any]:
+    """Структура нового игрока"""
+    return {
+        'player_id': player_id,
+        'created_at': datetime.now().isoformat(),
+        'schema_version': SCHEMA_VERSION,
+        'stability_points': 0,
+        'effort': 0,
+        'session_streak': 0,
+        'districts': {
+            'oasis': {'level': 0, 'unlocked': True, 'name': 'Оазис', 'theme': 'health', 'sessions_count': 0},
+            'forum': {'level': 0, 'unlocked': False, 'name': 'Форум', 'theme': 'relationships', 'sessions_count': 0},
+            'citadel': {'level': 0, 'unlocked': True, 'name': 'Цитадель', 'theme': 'work', 'sessions_count': 0},
+            'arsenal': {'level': 0, 'unlocked': True, 'name': 'Арсенал', 'theme': 'finance', 'sessions_count': 0},
+            'garden': {'level': 0, 'unlocked': True, 'name': 'Сад', 'theme': 'personal', 'sessions_count': 0}
+        },
+        'session_history': [],
+        'agent_memory': [],
+        'rituals': [],
+        'goals': [],
+        'last_session_time': None,
+        'achievements': [],
+        'owned_cards': [],
+        'equipped_card': None,
+        'completed_levels': [],
+        'active_bosses': [],
+        'actions_history': {},
+        'district_sessions': {},
+        'acts_completed': 0,
+        'guru_mode_unlocked': False
+    }
+
+
+@migration(1)
+def _add_missing_fields(data: Dict[str, Any]):
+    """Поля, появившиеся после первых версий (карты, боссы, гуру и т.д.)"""
+    for key, value in _default_player_data(data.get('player_id', 'default')).items():
+        data.setdefault(key, value)
+
+
+@migration(2)
+def _add_district_sessions_count(data: Dict[str, Any]):
+    """Счётчик сессий в каждом квартале"""
+    for district in (data.get('districts') or {}).values():
+        if isinstance(district, dict):
+            district.setdefault('sessions_count', 0)
+
+
+def migrate_player_data(data: Dict[str, Any]) -> bool:
+    """
+    Прогоняет шаги миграции, которых сохранение ещё не видело
+
+    Returns:
+        True, если данные изменились и их нужно записать
+    """
+    current = data.get('schema_version', 0)
+    if current >= SCHEMA_VERSION:
+        return False
+    for version in sorted(MIGRATIONS):
+        if current < version <= SCHEMA_VERSION:
+            MIGRATIONS[version](data)
+    data['schema_version'] = SCHEMA_VERSION
+    return True
+
+
+class WriteBehindSaver:
+    """
+    Отложенная запись сохранений
+
+    Последовательные save_player одного игрока схлопываются в памяти, на диск
+    уходит только последняя версия: после паузы SAVE_DEBOUNCE_SECONDS, но не позже
+    SAVE_MAX_STALENESS_SECONDS с первого несохранённого изменения, либо по flush().
+    """
+
+    def __init__(self, debounce: float, max_staleness: float):
+        self.debounce = debounce
+        self.max_staleness = max_staleness
+        self._pending: Dict[str, Dict[str, Any]] = {}
+        self._cond = threading.Condition()
+        self._generation = 0
+        self._thread = None
+
+    def schedule(self, storage: 'Storage', player_data: Dict[str, Any]):
+        """
+        Помечает сохранение игрока грязным
+
+        В очередь попадает копия данных: вызывающий продолжает менять свой словарь,
+        а отложенная запись и load_player видят состояние на момент сохранения.
+        """
+        now = time.monotonic()
+        snapshot = copy.deepcopy(player_data)
+        with self._cond:
+            self._generation += 1
+            entry = self._pending.get(storage.save_file)
+            if entry is None:
+                entry = self._pending[storage.save_file] = {'first': now}
+            entry.update(storage=storage, data=snapshot, last=now, generation=self._generation)
+            self._ensure_thread()
+            self._cond.notify()
+
+    def pending(self, path: str) -> Optional[Dict[str, Any]]:
+        """Возвращает ещё не записанные данные игрока"""
+        with self._cond:
+            entry = self._pending.get(path)
+            return entry['data'] if entry else None
+
+    def flush(self, path: str = None) -> bool:
+        """Синхронно записывает отложенные сохранения (одного файла или все)"""
+        with self._cond:
+            paths = [path] if path is not None else list(self._pending)
+        ok = True
+        for item in paths:
+            ok = self._flush_path(item) and ok
+        return ok
+
+    def _deadline(self, entry: Dict[str, Any]) -> float:
+        return min(entry['last'] + self.debounce, entry['first'] + self.max_staleness)
+
+    def rebase(self, path: str, before: Dict[str, Any], merged: Dict[str, Any]):
+        """Накладывает отложенную запись, сделанную поверх before, на результат слияния merged"""
+        with self._cond:
+            entry = self._pending.get(path)
+            if entry is None:
+                return
+            entry['data'] = merge_player_data(before, entry['data'], merged)
+            # Запись, уже начатая со старыми данными, не должна снять запись из очереди
+            self._generation += 1
+            entry['generation'] = self._generation
+
+    def _flush_path(self, path: str) -> bool:
+        # Записи одного файла не пересекаются, поэтому последней всегда ложится свежая версия
+        with _file_lock(path):
+            with self._cond:
+                entry = self._pending.get(path)
+                if entry is None:
+                    return True
+                generation, storage, snapshot = entry['generation'], entry['storage'], entry['data']
+
+            # Слияние, хвосты журнала и версия меняют верхний уровень словаря —
+            # пишем его копию, снимок в очереди остаётся неизменным
+            written = dict(snapshot)
+            merged = storage._file_state().changed_on_disk()
+            ok = storage._write_snapshot(written)
+
+            with self._cond:
+                entry = self._pending.get(path)
+                if entry is not None and entry['generation'] == generation:
+                    if ok:
+                        del self._pending[path]
+                    else:
+                        entry['first'] = entry['last'] = time.monotonic()
+
+        if ok and merged:
+            # Результат слияния отдаём владельцу данных уже без блокировки файла
+            try:
+                storage._hand_back_merge(snapshot, written)
+            except Exception as e:
+                print(f"Ошибка передачи слитого сохранения: {e}")
+        return ok
+
+    def _ensure_thread(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name='storage-write-behind', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while True:
+                    now = time.monotonic()
+                    due = [path for path, entry in self._pending.items() if self._deadline(entry) <= now]
+                    if due:
+                        break
+                    timeout = None
+                    if self._pending:
+                        timeout = min(self._deadline(entry) for entry in self._pending.values()) - now
+                    self._cond.wait(timeout)
+            for path in due:
+                self._flush_path(path)
+
+
+_write_behind = WriteBehindSaver(
+    debounce=getattr(config, 'SAVE_DEBOUNCE_SECONDS', 0.5),
+    max_staleness=getattr(config, 'SAVE_MAX_STALENESS_SECONDS', 5.0)
+)
+
+
+class MemoryWriter:
+    """
+    Фоновая запись памяти агента
+
+    add_agent_memory только ставит запись в ограниченную очередь и сразу возвращается;
+    фоновый поток забирает всё накопившееся и пишет записи каждого игрока одной
+    пачкой. Пока запись не легла на диск, она видна через pending() (get_entries
+    подмешивает её к журналу). Переполнение очереди обрабатывается по политике
+    MEMORY_QUEUE_POLICY: "sync" — записать в вызывающем потоке, "block" — подождать
+    освобождения места (потом записать синхронно), "drop" — отбросить запись.
+    """
+
+    def __init__(self, max_pending: int, policy: str, block_timeout: float):
+        self.max_pending = max_pending
+        self.policy = policy
+        self.block_timeout = block_timeout
+        # ключ игрока -> {'storage': Storage, 'entries': [...]}
+        self._pending: Dict[str, Dict[str, Any]] = {}
+        # Пачки, которые фоновый поток пишет прямо сейчас
+        self._writing: Dict[str, List[Any]] = {}
+        self._count = 0
+        self._cond = threading.Condition()
+        self._thread = None
+        self.dropped = 0
+
+    def submit(self, storage: 'Storage', field: str, entry: Any) -> bool:
+        """Ставит запись в очередь (или применяет политику переполнения)"""
+        with self._cond:
+            if self._count >= self.max_pending and self.policy == 'block':
+                self._cond.wait_for(lambda: self._count < self.max_pending, self.block_timeout)
+            if self._count >= self.max_pending:
+                if self.policy == 'drop':
+                    self.dropped += 1
+                    print(f"Очередь памяти агента переполнена, запись игрока {storage.player_id} отброшена")
+                    return False
+            else:
+                key = storage._writer_key()
+                batch = self._pending.get(key)
+                if batch is None:
+                    batch = self._pending[key] = {'storage': storage, 'entries': []}
+                batch['entries'].append((field, entry))
+                self._count += 1
+                self._ensure_thread()
+                self._cond.notify_all()
+                return True
+        # Очередь полна — пишем сами
+        return storage._append_entries([(field, entry)])
+
+    def pending(self, key: str, field: str) -> List[Any]:
+        """Записи поля, ещё не записанные на диск"""
+        with self._cond:
+            items = list(self._writing.get(key, ()))
+            batch = self._pending.get(key)
+            if batch is not None:
+                items.extend(batch['entries'])
+        return [entry for item_field, entry in items if item_field == field]
+
+    def flush(self, key: str = None) -> bool:
+        """Синхронно дописывает очередь (одного игрока или всю) и ждёт фоновую запись"""
+        with self._cond:
+            keys = [key] if key is not None else list(self._pending)
+            batches = {item: self._pending.pop(item) for item in keys if item in self._pending}
+            self._count -= sum(len(batch['entries']) for batch in batches.values())
+            self._cond.notify_all()
+        ok = True
+        for item, batch in batches.items():
+            ok = batch['storage']._append_entries(batch['entries']) and ok
+        with self._cond:
+            self._cond.wait_for(lambda: not (self._writing if key is None else key in self._writing))
+        return ok
+
+    def _ensure_thread(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name='storage-memory-writer', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: self._pending)
+                batches, self._pending = self._pending, {}
+                self._count -= sum(len(batch['entries']) for batch in batches.values())
+                self._writing = {key: batch['entries'] for key, batch in batches.items()}
+                self._cond.notify_all()
+            for key, batch in batches.items():
+                try:
+                    batch['storage']._append_entries(batch['entries'])
+                except Exception as e:
+                    print(f"Ошибка записи памяти агента: {e}")
+                with self._cond:
+                    self._writing.pop(key, None)
+                    self._cond.notify_all()
+
+
+_memory_writer = MemoryWriter(
+    max_pending=getattr(config, 'MEMORY_QUEUE_SIZE', 10000),
+    policy=getattr(config, 'MEMORY_QUEUE_POLICY', 'sync'),
+    block_timeout=getattr(config, 'MEMORY_QUEUE_BLOCK_SECONDS', 1.0)
+)
+
+
+def flush() -> bool:
+    """Записывает очередь памяти агента и отложенные сохранения (вызывается и при завершении процесса)"""
+    memory_ok = _memory_writer.flush()
+    return _write_behind.flush() and memory_ok
+
+
+atexit.register(flush)
+
+
+class PlayerJournal:
+    """
+    Журнал добавлений в session_history и agent_memory
+
+    Каждое добавление — одна JSON-строка в <player_id>.journal, то есть O(1) байт
+    независимо от размера сохранения. Хвосты списков держатся в памяти, снимок
+    сохранения хранит journal_seq — номер последней записи, уже вошедшей в него,
+    поэтому после сбоя между записью снимка и очисткой журнала ничего не задвоится.
+
+    Запись и очистка журнала выполняются под блокировкой файла сохранения (SaveLock);
+    перед ними catch_up() подхватывает записи, сделанные другими процессами.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.lock = threading.RLock()
+        self.tails: Dict[str, deque] = {}
+        self.seq = 0
+        self.loaded = False
+        self.compacting = False
+        # Записи журнала, ещё не свёрнутые в снимок: (seq, строка)
+        self._unfolded: List[Tuple[int, str]] = []
+        self._file = None
+        # (st_ino, st_size) файла журнала после нашей последней операции
+        self._identity = None
+
+    def _stat_identity(self) -> Optional[Tuple[int, int]]:
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return st.st_ino, st.st_size
+
+    def _read_lines(self, offset: int = 0) -> Tuple[List[Tuple[int, str, Dict[str, Any]]], bool]:
+        """Читает записи журнала начиная со смещения; возвращает (записи, были ли битые строки)"""
+        records = []
+        damaged = False
+        try:
+            with open(self.path, 'rb') as f:
+                f.seek(offset)
+                raw = f.read()
+        except FileNotFoundError:
+            return records, damaged
+
+        for raw_line in raw.decode('utf-8', errors='replace').splitlines():
+            line = raw_line.strip()
+            if not line:
+                continue
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                # Оборванная запись после сбоя
+                damaged = True
+                continue
+            records.append((record.get('seq', 0), line, record))
+        return records, damaged
+
+    def ensure_loaded(self, snapshot: Dict[str, Any]):
+        """Поднимает хвосты из снимка и дочитывает журнал поверх него (один раз)"""
+        with self.lock:
+            if self.loaded:
+                return
+
+            base_seq = snapshot.get('journal_seq', 0)
+            self.seq = base_seq
+            self.tails = {
+                field: deque(snapshot.get(field) or [], maxlen=limit)
+                for field, limit in JOURNALED_FIELDS.items()
+            }
+            self._unfolded = []
+
+            records, damaged = self._read_lines()
+            for seq, line, record in records:
+                tail = self.tails.get(record.get('field'))
+                if seq <= base_seq or tail is None:
+                    continue
+                tail.append(record.get('entry'))
+                self.seq = max(self.seq, seq)
+                self._unfolded.append((seq, line))
+
+            if damaged:
+                print(f"Журнал {self.path} повреждён, битые записи отброшены")
+                self._rewrite()
+            self._identity = self._stat_identity()
+            self.loaded = True
+
+    def reload(self, snapshot: Dict[str, Any]):
+        """Перечитывает журнал поверх нового снимка"""
+        with self.lock:
+            self.close()
+            self.loaded = False
+            self.ensure_loaded(snapshot)
+
+    def changed_externally(self) -> bool:
+        """Менял ли журнал кто-то кроме нас (дешёвая проверка по stat)"""
+        return self.loaded and self._stat_identity() != self._identity
+
+    def catch_up(self):
+        """Подхватывает записи других процессов (вызывается под блокировкой сохранения)"""
+        with self.lock:
+            identity = self._stat_identity()
+            if not self.loaded or identity == self._identity:
+                return
+
+            if identity is None:
+                # Журнал свёрнут другим процессом — наши записи уже в его снимке
+                self._unfolded = []
+            else:
+                appended_only = (
+                    self._identity is not None and
+                    identity[0] == self._identity[0] and
+                    identity[1] >= self._identity[1]
+                )
+                known = {line for _, line in self._unfolded}
+                records, _ = self._read_lines(self._identity[1] if appended_only else 0)
+                if not appended_only:
+                    # Файл переписан: свёрнутые кем-то наши записи из него исчезли
+                    self._unfolded = []
+                    self.close()
+                for seq, line, record in records:
+                    tail = self.tails.get(record.get('field'))
+                    if tail is None:
+                        continue
+                    if line not in known:
+                        tail.append(record.get('entry'))
+                    self.seq = max(self.seq, seq)
+                    self._unfolded.append((seq, line))
+            self._identity = identity
+
+    def append(self, field: str, entry: Any) -> int:
+        """Дописывает запись в журнал; возвращает число несвёрнутых записей"""
+        with self.lock:
+            self.catch_up()
+            seq = self.seq + 1
+            line = json.dumps({'seq': seq, 'field': field, 'entry': entry}, ensure_ascii=False)
+            if self._file is None:
+                self._file = open(self.path, 'a', encoding='utf-8')
+            self._file.write(line + '\n')
+            self._file.flush()
+            if getattr(config, 'JOURNAL_FSYNC', False):
+                os.fsync(self._file.fileno())
+            st = os.fstat(self._file.fileno())
+            self._identity = (st.st_ino, st.st_size)
+
+            self.seq = seq
+            self.tails[field].append(entry)
+            self._unfolded.append((seq, line))
+            return len(self._unfolded)
+
+    def overlay(self, player_data: Dict[str, Any]) -> int:
+        """Подставляет хвосты журнала в данные игрока; возвращает номер последней записи"""
+        with self.lock:
+            for field, tail in self.tails.items():
+                player_data[field] = list(tail)
+            player_data['journal_seq'] = self.seq
+            return self.seq
+
+    def entries(self, field: str) -> List[Any]:
+        """Копия хвоста списка"""
+        with self.lock:
+            return list(self.tails.get(field, ()))
+
+    def truncate(self, folded_seq: int):
+        """Убирает из журнала записи, уже вошедшие в снимок"""
+        with self.lock:
+            remaining = [item for item in self._unfolded if item[0] > folded_seq]
+            if len(remaining) == len(self._unfolded):
+                return
+            self._unfolded = remaining
+            self._rewrite()
+
+    def _rewrite(self):
+        """Перезаписывает файл журнала несвёрнутыми записями"""
+        self.close()
+        if self._unfolded:
+            payload = ''.join(line + '\n' for _, line in self._unfolded).encode('utf-8')
+            _atomic_write(self.path, payload)
+        elif os.path.exists(self.path):
+            os.remove(self.path)
+        self._identity = self._stat_identity()
+
+    def close(self):
+        with self.lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+
+class SaveFile:
+    """
+    Состояние файла сохранения в процессе
+
+    Общая для всех Storage одного игрока блокировка, журнал и версия снимка,
+    последний раз прочитанного или записанного этим процессом (база для слияния).
+    """
+
+    def __init__(self, save_file: str):
+        base = os.path.splitext(save_file)[0]
+        self.path = save_file
+        self.lock = SaveLock(base + '.lock')
+        self.journal = PlayerJournal(base + '.journal')
+        self.version = 0
+        self.identity: Optional[Tuple[int, int, int]] = None
+        self.payload: Optional[bytes] = None
+
+    def remember(self, version: int, payload: bytes, identity: Optional[Tuple[int, int, int]]):
+        """Запоминает снимок, который процесс видел последним"""
+        self.version = version
+        self.payload = payload
+        self.identity = identity
+
+    def changed_on_disk(self) -> bool:
+        """Записал ли снимок кто-то другой после нашего чтения/записи"""
+        return _stat_identity(self.path) != self.identity
+
+    def close(self):
+        self.journal.close()
+        self.lock.close()
+
+
+_save_files: Dict[str, SaveFile] = {}
+_save_files_guard = threading.Lock()
+
+
+def _get_save_file(save_file: str) -> SaveFile:
+    """Состояние файла сохранения (одно на файл в пределах процесса)"""
+    with _save_files_guard:
+        state = _save_files.get(save_file)
+        if state is None:
+            state = _save_files[save_file] = SaveFile(save_file)
+        return state
+
+
+def _get_journal(save_file: str) -> PlayerJournal:
+    """Журнал игрока"""
+    return _get_save_file(save_file).journal
+
+
+def _file_lock(save_file: str) -> 'SaveLock':
+    """Блокировка файла сохранения"""
+    return _get_save_file(save_file).lock
+
+
+class Transaction:
+    """
+    Единица работы над сохранением игрока
+
+    Данные загружаются один раз при входе в блок, изменяются в памяти и
+    записываются одним save_player при выходе. При исключении запись не выполняется.
+    Вложенный вызов storage.transaction() в том же потоке работает с теми же данными,
+    а запись остаётся за внешней транзакцией.
+    """
+
+    def __init__(self, storage: 'Storage', data: Dict[str, Any] = None):
+        self.storage = storage
+        self._base = data
+        self.data: Optional[Dict[str, Any]] = None
+        self.outer: Optional['Transaction'] = None
+        self.committed = False
+        self._cancelled = False
+        # Добавления в журналируемые списки, которые уйдут в журнал при фиксации
+        self.appends: List[Tuple[str, Any]] = []
+
+    @property
+    def nested(self) -> bool:
+        return self.outer is not None
+
+    def cancel(self):
+        """Отменяет запись (изменений нет); во вложенной транзакции решает внешняя"""
+        self._cancelled = True
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancelled
+
+    def stage_append(self, field: str, entry: Any):
+        """Добавляет запись в журналируемый список в памяти транзакции"""
+        root = self
+        while root.outer is not None:
+            root = root.outer
+        root.appends.append((field, entry))
+
+        entries = self.data.setdefault(field, [])
+        entries.append(entry)
+        limit = JOURNALED_FIELDS[field]
+        if len(entries) > limit:
+            del entries[:-limit]
+
+    def __enter__(self) -> 'Transaction':
+        self.outer = self.storage._current_transaction()
+        if self.outer is not None:
+            self.data = self.outer.data
+            return self
+
+        # Владелец актуальных данных в памяти может передать их вместо загрузки
+        self.data = self._base if self._base is not None else self.storage.load_player()
+        self.storage._tx_state.current = self
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> bool:
+        if self.outer is not None:
+            # Изменения уже в данных внешней транзакции
+            self.committed = exc_type is None
+            return False
+
+        self.storage._tx_state.current = None
+        if exc_type is None and not self._cancelled:
+            self.storage._commit_appends(self.appends)
+            self.committed = self.storage.save_player(self.data)
+        return False
 
 
 class Storage:
@@ -17,127 +805,419 @@ class Storage:
             config.SAVES_DIR, 
             f"{player_id}.json"
         )
+        self._tx_state = threading.local()
+        # Владелец данных в памяти (Player): fn(before, merged) получает результат слияния
+        # отложенной записи с версией другого процесса; без него сливается только очередь
+        self.merge_listener: Optional[Callable[[Dict[str, Any], Dict[str, Any]], None]] = None
         self._ensure_directories()
     
+    def transaction(self, data: Dict[str, Any] = None) -> Transaction:
+        """
+        Открывает транзакцию: одна загрузка, изменения в памяти, одна запись
+
+        Если передан data (актуальные данные игрока в памяти), загрузка не выполняется.
+        """
+        return Transaction(self, data)
+    
+    def _current_transaction(self) -> Optional[Transaction]:
+        """Активная транзакция текущего потока"""
+        return getattr(self._tx_state, 'current', None)
+    
+    def in_transaction(self) -> bool:
+        """Выполняется ли код внутри транзакции"""
+        return self._current_transaction() is not None
+    
     def _ensure_directories(self):
         """Создает необходимые директории если их нет"""
         os.makedirs(config.SAVES_DIR, exist_ok=True)
     
     def load_player(self) -> Dict[str, Any]:
         """Загружает данные игрока из JSON"""
+        tx = self._current_transaction()
+        if tx is not None:
+            return tx.data
+
+        state = self._file_state()
+        with state.lock:
+            # Несохранённые изменения новее файла на диске
+            pending = _write_behind.pending(self.save_file)
+            if pending is not None:
+                data = copy.deepcopy(pending)
+            else:
+                data = self._read_snapshot()
+
+            # Журналируемые списки берём из хвостов журнала
+            if state.journal.loaded and pending is None:
+                if data.get('journal_seq', 0) > state.journal.seq:
+                    # Другой процесс свернул в снимок записи, которых мы не видели
+                    state.journal.reload(data)
+                else:
+                    state.journal.catch_up()
+            state.journal.ensure_loaded(data)
+            state.journal.overlay(data)
+        return data
+    
+    def reload_if_changed(self) -> Optional[Dict[str, Any]]:
+        """
+        Свежие данные игрока, если сохранение изменил другой процесс
+
+        Проверка — один stat файла. Возвращает None, если изменений нет
+        или у процесса есть своя отложенная запись (её сольёт _write_snapshot).
+        """
+        state = self._file_state()
+        if state.identity is None or not state.changed_on_disk():
+            return None
+        if _write_behind.pending(self.save_file) is not None:
+            return None
+        with state.lock:
+            data = self._read_snapshot()
+            state.journal.reload(data)
+            state.journal.overlay(data)
+        return data
+    
+    def _file_state(self) -> SaveFile:
+        return _get_save_file(self.save_file)
+    
+    def _journal(self) -> PlayerJournal:
+        return self._file_state().journal
+    
+    def _read_snapshot(self) -> Dict[str, Any]:
+        """Читает снимок сохранения с диска и запоминает его как базу для слияния"""
+        state = self._file_state()
         if not os.path.exists(self.save_file):
+            state.remember(0, None, None)
             return self._create_default_player()
         
         try:
-            with open(self.save_file, 'r', encoding='utf-8') as f:
-                data = json.load(f)
-                # Обновляем структуру если нужно
-                return self._migrate_player_data(data)
-        except (json.JSONDecodeError, IOError) as e:
+            with open(self.save_file, 'rb') as f:
+                payload = f.read()
+                st = os.fstat(f.fileno())
+            data = serializers.loads(payload)
+            state.remember(data.get('version', 0), payload, (st.st_ino, st.st_size, st.st_mtime_ns))
+            # Устаревшую схему мигрируем один раз и сразу записываем
+            if migrate_player_data(data):
+                self._persist_migrated(data)
+            return data
+        except ValueError as e:
+            print(f"Ошибка загрузки сохранения: {e}")
+            self._quarantine_corrupt_save()
+            return self._create_default_player()
+        except IOError as e:
             print(f"Ошибка загрузки сохранения: {e}")
             return self._create_default_player()
     
+    def _persist_migrated(self, data: Dict[str, Any]):
+        """Записывает мигрированный снимок, чтобы следующие загрузки миграцию не выполняли"""
+        state = self._file_state()
+        data['version'] = state.version + 1
+        try:
+            with state.lock:
+                payload = serializers.dumps(data)
+                _atomic_write(self.save_file, payload)
+                state.remember(data['version'], payload, _stat_identity(self.save_file))
+        except (IOError, TypeError, ValueError) as e:
+            print(f"Ошибка записи мигрированного сохранения: {e}")
+    
+    def _peek_snapshot(self) -> Dict[str, Any]:
+        """Читает снимок с диска, не меняя базу для слияния"""
+        try:
+            with open(self.save_file, 'rb') as f:
+                return serializers.loads(f.read())
+        except (OSError, ValueError):
+            return {}
+    
+    def _quarantine_corrupt_save(self):
+        """Откладывает повреждённый файл в сторону, чтобы новое сохранение его не затёрло"""
+        corrupt_file = f"{self.save_file}.corrupt-{datetime.now().strftime('%Y%m%d%H%M%S')}"
+        try:
+            os.replace(self.save_file, corrupt_file)
+            self._file_state().remember(0, None, None)
+            print(f"Повреждённое сохранение перемещено в {corrupt_file}")
+        except OSError as e:
+            print(f"Не удалось переместить повреждённое сохранение: {e}")
+    
     def save_player(self, player_data: Dict[str, Any]) -> bool:
-        """Сохраняет данные игрока в JSON"""
+        """Сохраняет данные игрока в JSON (в режиме write-behind — отложенно)"""
+        # Добавляем метаданные
+        player_data['last_save'] = datetime.now().isoformat()
+        player_data['player_id'] = self.player_id
+        
+        tx = self._current_transaction()
+        if tx is not None:
+            # Запись выполнит транзакция при фиксации
+            tx.data = player_data
+            return True
+        
+        if getattr(config, 'SAVE_WRITE_BEHIND', False):
+            _write_behind.schedule(self, player_data)
+            return True
+        return self._write_snapshot(player_data)
+    
+    def _write_snapshot(self, player_data: Dict[str, Any]) -> bool:
+        """
+        Атомарно записывает сохранение на диск, сворачивая в него журнал
+
+        Запись — compare-and-swap по версии снимка под блокировкой файла: если после
+        нашего чтения сохранение записал другой процесс, наши изменения сливаются
+        с его версией (merge_player_data), а не затирают её.
+        """
+        state = self._file_state()
+        journal = state.journal
         try:
-            # Добавляем метаданные
-            player_data['last_save'] = datetime.now().isoformat()
-            player_data['player_id'] = self.player_id
-            
-            with open(self.save_file, 'w', encoding='utf-8') as f:
-                json.dump(player_data, f, ensure_ascii=False, indent=2)
+            with state.lock:
+                journal.ensure_loaded(player_data)
+                journal.catch_up()
+                if state.changed_on_disk():
+                    self._merge_concurrent_changes(player_data)
+                with journal.lock:
+                    folded_seq = journal.overlay(player_data)
+                    player_data['version'] = state.version + 1
+                    payload = serializers.dumps(player_data)
+                _atomic_write(self.save_file, payload)
+                state.remember(player_data['version'], payload, _stat_identity(self.save_file))
+                journal.truncate(folded_seq)
             return True
-        except IOError as e:
+        except (IOError, TypeError, ValueError) as e:
             print(f"Ошибка сохранения: {e}")
             return False
     
+    def _merge_concurrent_changes(self, player_data: Dict[str, Any]):
+        """
+        Сливает наши данные с версией, записанной другим процессом (под блокировкой)
+
+        player_data меняется на месте: при синхронной записи это данные вызывающего,
+        при отложенной — копия из очереди (результат передаётся через _hand_back_merge).
+        """
+        state = self._file_state()
+        base = serializers.loads(state.payload) if state.payload else {}
+        theirs = self._read_snapshot()
+        print(f"Сохранение {self.player_id} изменено другим процессом (версия {state.version}), сливаем изменения")
+        merged = merge_player_data(base, player_data, theirs)
+        player_data.clear()
+        player_data.update(merged)
+        # Хвосты журнала собираем заново: чужой снимок + записи журнала после него
+        state.journal.reload(theirs)
+    
+    def _hand_back_merge(self, before: Dict[str, Any], merged: Dict[str, Any]):
+        """Отдаёт результат слияния фоновой записи владельцу данных (или только очереди)"""
+        if self.merge_listener is not None:
+            self.merge_listener(before, merged)
+        else:
+            self.rebase_pending(before, merged)
+    
+    def rebase_pending(self, before: Dict[str, Any], merged: Dict[str, Any]):
+        """Переносит ещё не записанные изменения после before на результат слияния"""
+        _write_behind.rebase(self.save_file, before, merged)
+    
+    def _append_entry(self, field: str, entry: Dict[str, Any]) -> bool:
+        """Добавляет запись в журналируемый список без перезаписи сохранения"""
+        return self._append_entries([(field, entry)])
+    
+    def _append_entries(self, entries: List[Tuple[str, Any]]) -> bool:
+        """Добавляет пачку записей (поле, запись) в журналируемые списки"""
+        tx = self._current_transaction()
+        if tx is not None:
+            for field, entry in entries:
+                tx.stage_append(field, entry)
+            return True
+        return self._commit_appends(entries)
+    
+    def _writer_key(self) -> str:
+        """Ключ игрока в очереди фоновой записи"""
+        return self.save_file
+    
+    def _commit_appends(self, appends: List[Tuple[str, Any]]) -> bool:
+        """Дописывает добавления в журнал"""
+        if not appends:
+            return True
+        state = self._file_state()
+        if not state.journal.loaded:
+            self.load_player()
+        try:
+            with state.lock:
+                if state.changed_on_disk():
+                    # Другой процесс мог свернуть журнал в снимок: номера записей
+                    # должны идти после его journal_seq, хвосты — включать свёрнутое
+                    snapshot = self._peek_snapshot()
+                    if snapshot.get('journal_seq', 0) > state.journal.seq:
+                        state.journal.reload(snapshot)
+                for field, entry in appends:
+                    unfolded = state.journal.append(field, entry)
+        except IOError as e:
+            print(f"Ошибка записи журнала: {e}")
+            return False
+        
+        if unfolded >= getattr(config, 'JOURNAL_COMPACT_THRESHOLD', 200):
+            self._schedule_compaction()
+        return True
+    
+    def _schedule_compaction(self):
+        """Запускает фоновое сворачивание журнала в снимок"""
+        journal = self._journal()
+        with journal.lock:
+            if journal.compacting:
+                return
+            journal.compacting = True
+        threading.Thread(target=self._compact, name='storage-journal-compaction', daemon=True).start()
+    
+    def _compact(self):
+        """Сворачивает журнал в снимок сохранения"""
+        journal = self._journal()
+        try:
+            with self._file_state().lock:
+                if _write_behind.pending(self.save_file) is not None:
+                    # Отложенная запись и так свернёт журнал
+                    _write_behind.flush(self.save_file)
+                else:
+                    self._write_snapshot(self._read_snapshot())
+        finally:
+            journal.compacting = False
+    
+    def get_entries(self, field: str, limit: int = None) -> List[Any]:
+        """Последние записи журналируемого списка (из памяти, без чтения сохранения)"""
+        tx = self._current_transaction()
+        if tx is not None:
+            entries = tx.data.get(field, [])
+        else:
+            state = self._file_state()
+            if not state.journal.loaded:
+                self.load_player()
+            elif state.journal.changed_externally():
+                with state.lock:
+                    state.journal.catch_up()
+            entries = state.journal.entries(field)
+        entries = self._with_queued(field, entries)
+        return entries[-limit:] if limit else entries
+    
+    def _with_queued(self, field: str, entries: List[Any]) -> List[Any]:
+        """Дополняет записи теми, что ещё ждут фоновой записи"""
+        queued = _memory_writer.pending(self._writer_key(), field)
+        if not queued:
+            return entries
+        merged = entries + [entry for entry in queued if entry not in entries]
+        return merged[-JOURNALED_FIELDS.get(field, len(merged)):]
+    
+    def flush(self) -> bool:
+        """Записывает отложенное сохранение игрока на диск"""
+        return _write_behind.flush(self.save_file)
+    
+    def close(self) -> bool:
+        """Сбрасывает сохранение на диск и освобождает журнал (игрок выгружен из памяти)"""
+        ok = _memory_writer.flush(self._writer_key())
+        ok = self.flush() and ok
+        with _save_files_guard:
+            state = _save_files.pop(self.save_file, None)
+        if state is not None:
+            state.close()
+        return ok
+    
     def _create_default_player(self) -> Dict[str, Any]:
         """Создает структуру нового игрока"""
-        return {
-            'player_id': self.player_id,
-            'created_at': datetime.now().isoformat(),
-            'stability_points': 0,
-            'effort': 0,
-            'session_streak': 0,
-            'districts': {
-                'oasis': {'level': 0, 'unlocked': True, 'name': 'Оазис', 'theme': 'health', 'sessions_count': 0},
-                'forum': {'level': 0, 'unlocked': False, 'name': 'Форум', 'theme': 'relationships', 'sessions_count': 0},
-                'citadel': {'level': 0, 'unlocked': True, 'name': 'Цитадель', 'theme': 'work', 'sessions_count': 0},
-                'arsenal': {'level': 0, 'unlocked': True, 'name': 'Арсенал', 'theme': 'finance', 'sessions_count': 0},
-                'garden': {'level': 0, 'unlocked': True, 'name': 'Сад', 'theme': 'personal', 'sessions_count': 0}
-            },
-            'session_history': [],
-            'agent_memory': [],
-            'rituals': [],
-            'goals': [],
-            'last_session_time': None,
-            'achievements': [],
-            'owned_cards': [],
-            'equipped_card': None,
-            'completed_levels': [],
-            'active_bosses': [],
-            'actions_history': {},
-            'district_sessions': {},
-            'acts_completed': 0,
-            'guru_mode_unlocked': False
-        }
+        return _default_player_data(self.player_id)
     
     def _migrate_player_data(self, data: Dict[str, Any]) -> Dict[str, Any]:
-        """Миграция данных при обновлении структуры"""
-        default = self._create_default_player()
-        
-        # Объединяем существующие данные с дефолтными
-        for key in default:
-            if key not in data:
-                data[key] = default[key]
-        
+        """Приводит данные к текущей версии схемы (для актуальных — без изменений)"""
+        migrate_player_data(data)
         return data
     
     def add_session(self, session_data: Dict[str, Any]) -> bool:
-        """Добавляет сессию в историю"""
-        player = self.load_player()
+        """Добавляет сессию в историю (одна запись журнала)"""
         session_data['timestamp'] = datetime.now().isoformat()
-        player['session_history'].append(session_data)
-        
-        # Ограничиваем историю последними 50 сессиями
-        if len(player['session_history']) > 50:
-            player['session_history'] = player['session_history'][-50:]
-        
-        return self.save_player(player)
+        return self._append_entry('session_history', session_data)
     
     def add_agent_memory(self, memory: str) -> bool:
-        """Добавляет запись в память агента"""
-        player = self.load_player()
-        player['agent_memory'].append({
+        """Добавляет запись в память агента (в фоне, если включён MEMORY_WRITE_BEHIND)"""
+        entry = {
             'text': memory,
             'timestamp': datetime.now().isoformat()
-        })
-        
-        # Ограничиваем память последними 100 записями
-        if len(player['agent_memory']) > 100:
-            player['agent_memory'] = player['agent_memory'][-100:]
-        
-        return self.save_player(player)
+        }
+        if getattr(config, 'MEMORY_WRITE_BEHIND', False) and not self.in_transaction():
+            return _memory_writer.submit(self, 'agent_memory', entry)
+        return self._append_entry('agent_memory', entry)
     
     def update_points(self, points: int) -> bool:
         """Обновляет очки устойчивости"""
-        player = self.load_player()
-        player['stability_points'] += points
-        return self.save_player(player)
+        with self.transaction() as tx:
+            tx.data['stability_points'] += points
+        return tx.committed
     
     def unlock_district(self, district_key: str) -> bool:
         """Разблокирует квартал"""
-        player = self.load_player()
-        if district_key in player['districts']:
-            player['districts'][district_key]['unlocked'] = True
-            return self.save_player(player)
-        return False
+        with self.transaction() as tx:
+            district = tx.data['districts'].get(district_key)
+            if district is None:
+                tx.cancel()
+                return False
+            district['unlocked'] = True
+        return tx.committed
     
     def level_up_district(self, district_key: str) -> bool:
         """Повышает уровень квартала"""
-        player = self.load_player()
-        if district_key in player['districts']:
-            player['districts'][district_key]['level'] += 1
-            return self.save_player(player)
-        return False
+        with self.transaction() as tx:
+            district = tx.data['districts'].get(district_key)
+            if district is None:
+                tx.cancel()
+                return False
+            district['level'] += 1
+        return tx.committed
+
+
+def create_storage(player_id: str = "default") -> Storage:
+    """Создаёт хранилище игрока согласно config.STORAGE_BACKEND"""
+    backend = getattr(config, 'STORAGE_BACKEND', 'json')
+    if backend == 'sqlite':
+        import sqlite_storage
+        return sqlite_storage.SQLiteStorage(player_id)
+    if backend != 'json':
+        raise ValueError(f"Неизвестный бэкенд хранения: {backend}")
+    return Storage(player_id)
+
+
+def _migrate_save_file(path: str) -> Tuple[str, str]:
+    """Мигрирует один файл сохранения (выполняется в процессе-воркере)"""
+    player_id = os.path.splitext(os.path.basename(path))[0]
+    lock = SaveLock(os.path.splitext(path)[0] + '.lock')
+    try:
+        with lock:
+            with open(path, 'rb') as f:
+                data = serializers.loads(f.read())
+            if not migrate_player_data(data):
+                return player_id, 'current'
+            data['version'] = data.get('version', 0) + 1
+            _atomic_write(path, serializers.dumps(data))
+        return player_id, 'migrated'
+    except (IOError, ValueError) as e:
+        return player_id, f'error: {e}'
+    finally:
+        lock.close()
+
+
+def migrate_all_saves(saves_dir: str = None, workers: int = None) -> Dict[str, str]:
+    """
+    Переводит все сохранения каталога на текущую версию схемы (параллельно)
+
+    Returns:
+        {player_id: 'migrated' | 'current' | 'error: ...'}
+    """
+    from concurrent.futures import ProcessPoolExecutor
+
+    paths = sorted(glob.glob(os.path.join(saves_dir or config.SAVES_DIR, '*.json')))
+    if not paths:
+        return {}
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        return dict(executor.map(_migrate_save_file, paths, chunksize=16))
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Обслуживание сохранений')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    migrate_parser = subparsers.add_parser('migrate', help='Мигрировать все сохранения на текущую схему')
+    migrate_parser.add_argument('--saves-dir', default=config.SAVES_DIR)
+    migrate_parser.add_argument('--workers', type=int, default=None, help='Число процессов (по умолчанию — число ядер)')
+    args = parser.parse_args()
 
+    if args.command == 'migrate':
+        for player_id, status in migrate_all_saves(args.saves_dir, args.workers).items():
+            print(f"{player_id}: {status}")
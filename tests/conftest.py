@@ -0,0 +1,19 @@
+"""
+Общие настройки тестов: модули игры лежат в корне репозитория
+"""
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import config
+
+
+@pytest.fixture
+def saves_dir(tmp_path, monkeypatch):
+    """Сохранения во временном каталоге"""
+    monkeypatch.setattr(config, 'SAVES_DIR', str(tmp_path))
+    monkeypatch.setattr(config, 'STORAGE_BACKEND', 'json')
+    return tmp_path
@@ -0,0 +1,63 @@
+"""
+Тесты HTTP API игры (Flask test client)
+"""
+import pytest
+
+import app
+import config
+import game_engine
+
+
+@pytest.fixture
+def client(saves_dir, monkeypatch):
+    monkeypatch.setattr(config, 'SAVE_WRITE_BEHIND', False)
+    monkeypatch.setattr(app, 'players', game_engine.PlayerRegistry(capacity=10))
+    test_client = app.app.test_client()
+    test_client.environ_base['HTTP_X_PLAYER_ID'] = 'api_test'
+    return test_client
+
+
+def complete(client, task):
+    response = client.post('/api/task/complete', json={'task': task, 'result': 'done'})
+    assert response.status_code == 200
+    return response.get_json()
+
+
+def test_microstep_category_counter_unlocks_card(client):
+    task = {'type': 'microstep', 'category': 'self_care'}
+    progress = complete(client, task)['progress']
+    assert progress['actions_history']['microstep:self_care'] == 1
+    assert 'skill_water_slowly' not in [card['card_id'] for card in progress['available_cards']]
+
+    progress = complete(client, task)['progress']
+    assert progress['actions_history']['microstep:self_care'] == 2
+    assert 'skill_water_slowly' in [card['card_id'] for card in progress['available_cards']]
+
+
+def test_microstep_without_category_and_other_tasks(client):
+    # Общий счётчик микрошагов растёт как раньше (ключ задания и сам microstep)
+    history = complete(client, {'task_type': 'microstep'})['progress']['actions_history']
+    assert history == {'microstep': 2}
+
+    # Категория у обычного задания не считается микрошагом
+    history = complete(client, {'type': 'timer', 'category': 'self_care'})['progress']['actions_history']
+    assert 'microstep:self_care' not in history
+    assert history['timer'] == 1
+
+
+def test_boss_check_is_read_only_until_acknowledged(client):
+    player = app.players.acquire('api_test')
+    try:
+        with player.transaction() as tx:
+            tx.data['perfectionism_blocks'] = 3
+    finally:
+        app.players.release(player)
+
+    for _ in range(2):
+        body = client.get('/api/boss/check').get_json()
+        assert body['boss_spawned'] is True
+        assert [boss['boss_id'] for boss in body['bosses']] == ['accountant_deadlines']
+
+    assert client.post('/api/boss/check', json={'boss_ids': 'accountant_deadlines'}).status_code == 400
+    assert client.post('/api/boss/check', json={'boss_ids': ['accountant_deadlines']}).get_json() == {'success': True}
+    assert client.get('/api/boss/check').get_json() == {'success': True, 'boss_spawned': False}
@@ -0,0 +1,233 @@
+"""
+Тесты деревьев вопросов: скомпилированная таблица против прежнего обхода
+"""
+import json
+import random
+
+import pytest
+
+import binary_trees
+
+
+def legacy_traverse(trees, tree_id, node_id, answer):
+    """Прежний обход: перебор вариантов и разбор "min-max" на каждом ответе"""
+    tree = trees.get(tree_id)
+    if not tree:
+        return None
+
+    def get_node(next_id):
+        return tree.get('root') if next_id == 'root' else tree.get('nodes', {}).get(next_id)
+
+    current_node = get_node(node_id)
+    if not current_node:
+        return None
+    node_type = current_node.get('type')
+
+    if node_type == 'choice':
+        for option in current_node.get('options', []):
+            if option['text'] == answer or option.get('id') == answer:
+                next_node_id = option.get('next')
+                return get_node(next_node_id) if next_node_id else {'type': 'end', 'final': True}
+
+    elif node_type == 'scale':
+        answer_value = int(answer)
+        for range_key, next_node_id in current_node.get('branches', {}).items():
+            if '-' in range_key:
+                min_val, max_val = map(int, range_key.split('-'))
+                if min_val <= answer_value <= max_val:
+                    return get_node(next_node_id)
+        if current_node.get('next'):
+            return get_node(current_node['next'])
+
+    elif node_type == 'task_trigger':
+        return {
+            'type': 'task_trigger',
+            'task_type': current_node.get('task_type'),
+            'task_text': current_node.get('task_text'),
+            'duration': current_node.get('duration'),
+            'guidance': current_node.get('guidance')
+        }
+
+    elif node_type == 'reflection':
+        next_node_id = current_node.get('leads_to')
+        if next_node_id == 'task':
+            return {'type': 'task_trigger', 'final': True}
+        elif next_node_id:
+            return get_node(next_node_id)
+
+    elif node_type == 'open_or_choice':
+        if isinstance(answer, str) and answer.strip():
+            for option in current_node.get('fallback_options', []):
+                if option.get('text') == answer or option.get('id') == answer:
+                    if option.get('next'):
+                        return get_node(option['next'])
+                    return None
+            if current_node.get('next'):
+                return get_node(current_node['next'])
+            return {'type': 'end', 'final': True}
+
+    return None
+
+
+def node(node_id, node_type, **fields):
+    return {'node_id': node_id, 'text': node_id, 'type': node_type, **fields}
+
+
+SCALE_TREE = {
+    'tree_id': 'scales',
+    # Диапазоны записаны не по порядку, между 6 и 9 и после 12 — разрывы, 12-12 — одна точка
+    'root': node('root', 'scale', min=0, max=15, next='fallback',
+                 branches={'9-11': 'high', '1-3': 'low', '4-6': 'middle', '12-12': 'point'}),
+    'nodes': {
+        'low': node('low', 'scale', min=1, max=10, branches={'1-5': 'task', '6-10': 'missing'}),
+        'middle': node('middle', 'choice', options=[
+            {'id': 'a', 'text': 'Первый', 'next': 'reflect'},
+            {'id': 'b', 'text': 'Второй'},
+            {'id': 'c', 'text': 'Первый', 'next': 'task'},
+            {'id': 'd', 'text': 'Потерянный', 'next': 'missing'},
+        ]),
+        'high': node('high', 'open_or_choice', next='task', fallback_options=[
+            {'id': 'skip', 'text': 'Не знаю', 'next': 'reflect'},
+            {'id': 'dead', 'text': 'Тупик'},
+        ]),
+        'point': node('point', 'open_or_choice', fallback_options=[{'id': 'x', 'text': 'Икс', 'next': 'task'}]),
+        'fallback': node('fallback', 'reflection', leads_to='task'),
+        'reflect': node('reflect', 'reflection', leads_to='task_node'),
+        'task_node': node('task_node', 'task_trigger', task_type='timer', task_text='Дыши', duration=60),
+        'task': node('task', 'task_trigger', task_type='note', guidance='Запиши'),
+        'dangling': node('dangling', 'reflection'),
+    }
+}
+
+
+def answers_for(raw_node):
+    """Ответы, которые стоит проверить в узле: все варианты, границы диапазонов и мусор"""
+    answers = ['', '   ', 'ответ своими словами', None, 'zzz', 3, ['список']]
+    for field in ('options', 'fallback_options'):
+        for option in raw_node.get(field, []):
+            answers += [option.get('text'), option.get('id')]
+    if raw_node.get('type') == 'scale':
+        answers = []
+        for range_key in raw_node.get('branches', {}):
+            low, high = map(int, range_key.split('-'))
+            answers += [low - 1, low, low + 1, high - 1, high, high + 1]
+        answers += [raw_node.get('min', 0) - 5, raw_node.get('max', 10) + 5]
+        answers += [str(value) for value in answers] + [' 7 ', 5.9, True]
+    return answers
+
+
+def all_nodes(tree):
+    nodes = dict(tree.get('nodes', {}))
+    nodes['root'] = tree['root']
+    return nodes
+
+
+@pytest.fixture
+def manager(tmp_path):
+    path = tmp_path / 'trees.json'
+    path.write_text(json.dumps({'trees': {'scales': SCALE_TREE}}, ensure_ascii=False), encoding='utf-8')
+    return binary_trees.BinaryTreesManager(str(path))
+
+
+@pytest.fixture(scope='module')
+def real_manager():
+    return binary_trees.BinaryTreesManager()
+
+
+def assert_same_as_legacy(manager):
+    for tree_id, tree in manager.trees.items():
+        for node_id, raw_node in all_nodes(tree).items():
+            for answer in answers_for(raw_node):
+                if answer is None and raw_node.get('type') == 'choice':
+                    # Расхождение с прежним обходом, см. test_missing_answer_is_not_an_option
+                    continue
+                expected = legacy_traverse(manager.trees, tree_id, node_id, answer)
+                assert manager.traverse(tree_id, node_id, answer) == expected, (tree_id, node_id, answer)
+
+
+def test_traverse_matches_legacy(manager):
+    assert_same_as_legacy(manager)
+
+
+def test_real_trees_match_legacy(real_manager):
+    assert_same_as_legacy(real_manager)
+
+
+def test_scale_boundaries(manager):
+    nodes = SCALE_TREE['nodes']
+    expected = {0: nodes['fallback'], 1: nodes['low'], 3: nodes['low'], 4: nodes['middle'],
+                6: nodes['middle'], 7: nodes['fallback'], 8: nodes['fallback'], 9: nodes['high'],
+                11: nodes['high'], 12: nodes['point'], 13: nodes['fallback'], -1: nodes['fallback']}
+    for answer, node_after in expected.items():
+        assert manager.traverse('scales', 'root', answer) == node_after
+        assert manager.traverse('scales', 'root', str(answer)) == node_after
+    # Без next ответ вне диапазонов никуда не ведёт, ссылка на несуществующий узел — тоже
+    assert manager.traverse('scales', 'low', 11) is None
+    assert manager.traverse('scales', 'low', 6) is None
+
+
+def test_scale_rejects_non_numbers(manager):
+    # Прежний обход падал на int(answer); теперь это «неверный ответ»
+    for answer in ('abc', '', None, '3.5', ['1']):
+        assert manager.traverse('scales', 'root', answer) is None
+
+
+def test_first_option_wins(manager):
+    assert manager.traverse('scales', 'middle', 'Первый') == SCALE_TREE['nodes']['reflect']
+    assert manager.traverse('scales', 'middle', 'c') == SCALE_TREE['nodes']['task']
+    assert manager.traverse('scales', 'middle', 'Второй') == binary_trees.END_RESULT
+
+
+def test_missing_answer_is_not_an_option(real_manager):
+    # Прежний обход сравнивал option.get('id') == answer, и ответ None выбирал
+    # первый вариант без id; теперь отсутствующий ответ — «неверный ответ»
+    trees = real_manager.trees
+    assert legacy_traverse(trees, 'citadel_volume_quality', 'too_much', None) is not None
+    assert real_manager.traverse('citadel_volume_quality', 'too_much', None) is None
+    assert real_manager.traverse('citadel_volume_quality', 'too_much', ['Не знаю']) is None
+
+
+def legacy_walk(trees, tree_id, rng):
+    """Случайный путь по прежнему обходу до конца дерева или тупика"""
+    tree = trees[tree_id]
+    nodes = all_nodes(tree)
+    node_id, steps, results = 'root', [], []
+    while node_id in nodes and len(steps) < 20:
+        answer = rng.choice(answers_for(nodes[node_id]))
+        if nodes[node_id].get('type') == 'scale' and not str(answer).strip().lstrip('-').isdigit():
+            continue
+        if isinstance(answer, list) or answer is None:
+            continue
+        result = legacy_traverse(trees, tree_id, node_id, answer)
+        steps.append({'node_id': node_id, 'answer': answer})
+        results.append(result)
+        if result is None or binary_trees.BinaryTreesManager.is_terminal(result):
+            break
+        node_id = result.get('node_id')
+    return steps, results
+
+
+@pytest.mark.parametrize('which', ['synthetic', 'real'])
+def test_traverse_path_matches_stepwise(which, manager, real_manager):
+    trees_manager = manager if which == 'synthetic' else real_manager
+    rng = random.Random(24)
+    for _ in range(300):
+        tree_id = rng.choice(sorted(trees_manager.trees))
+        steps, results = legacy_walk(trees_manager.trees, tree_id, rng)
+        # Шаги без node_id: узел берётся из предыдущего ответа
+        bare_steps = [{'answer': step['answer']} for step in steps]
+        for path_steps in (steps, bare_steps):
+            outcome = trees_manager.traverse_path(tree_id, path_steps)
+            if results[-1] is None:
+                assert outcome['success'] is False
+                assert outcome['path'] == [step['node_id'] for step in steps[:-1]]
+            else:
+                assert outcome == {'success': True, 'result': results[-1],
+                                   'path': [step['node_id'] for step in steps]}
+
+
+def test_traverse_path_rejects_wrong_node_and_finished_tree(manager):
+    outcome = manager.traverse_path('scales', [{'answer': 5}, {'node_id': 'high', 'answer': 'a'}])
+    assert outcome['success'] is False and outcome['path'] == ['root']
+    outcome = manager.traverse_path('scales', [{'answer': 2}, {'answer': 1}, {'answer': 'лишний'}])
+    assert outcome['success'] is False and outcome['path'] == ['root', 'low']
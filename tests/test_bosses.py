@@ -0,0 +1,117 @@
+"""
+Тесты боссов: загрузка условий победы, появление по триггерам
+"""
+import json
+
+import pytest
+
+import bosses
+import config
+import game_engine
+
+
+def write_bosses(tmp_path, *entries):
+    path = tmp_path / 'bosses.json'
+    path.write_text(json.dumps({'bosses': list(entries)}, ensure_ascii=False), encoding='utf-8')
+    return str(path)
+
+
+def boss(boss_id, defeat_conditions):
+    return {
+        'boss_id': boss_id,
+        'trigger': {'type': 'pattern', 'condition': 'tasks_not_done_perfectionism', 'threshold': 3},
+        'defeat_conditions': defeat_conditions
+    }
+
+
+def test_unknown_defeat_condition_rejects_boss(tmp_path, capsys):
+    path = write_bosses(
+        tmp_path,
+        boss('typo', [{'type': 'card_legendary', 'card': 'relic'}, {'type': 'seires', 'action': 'x', 'count': 1}]),
+        boss('missing_param', [{'type': 'card_legendary'}]),
+        boss('valid', [{'type': 'card_legendary', 'card': 'relic'}]),
+    )
+    manager = bosses.BossesManager(path)
+
+    assert sorted(manager.bosses) == ['valid']
+    assert sorted(manager._triggers) == ['valid']
+    output = capsys.readouterr().out
+    assert 'typo' in output and "'seires'" in output
+    assert 'missing_param' in output
+    # Босса, которого нет, нельзя ни вызвать, ни победить условием, которое отбросили бы
+    player_data = {'owned_cards': ['relic'], 'active_bosses': ['typo', 'valid']}
+    assert manager.check_defeat_conditions('typo', player_data) is False
+    assert manager.get_defeatable_bosses(player_data) == ['valid']
+
+
+def test_untracked_defeat_condition_is_never_met(tmp_path):
+    path = write_bosses(
+        tmp_path,
+        boss('archivist', [{'type': 'endurance', 'sessions_with_system': 3}, {'type': 'card_legendary', 'card': 'relic'}]),
+    )
+    manager = bosses.BossesManager(path)
+
+    assert manager.check_defeat_conditions('archivist', {'owned_cards': []}) is False
+    assert manager.check_defeat_conditions('archivist', {'owned_cards': ['relic']}) is True
+
+
+def test_shipped_bosses_load():
+    manager = bosses.BossesManager()
+    with open(manager.bosses_path, encoding='utf-8') as f:
+        shipped = [entry['boss_id'] for entry in json.load(f)['bosses']]
+    assert sorted(manager.bosses) == sorted(shipped)
+
+
+@pytest.fixture
+def watched_player(saves_dir, monkeypatch):
+    """Игрок, после транзакций которого перепроверяются триггеры боссов"""
+    monkeypatch.setattr(config, 'SAVE_WRITE_BEHIND', False)
+    manager = bosses.BossesManager()
+    monkeypatch.setattr(game_engine, 'observers', [manager.on_player_change])
+    sent = []
+    monkeypatch.setattr(game_engine.events, 'publish', lambda *event: sent.append(event))
+    player = game_engine.Player('boss')
+    yield player, sent
+    player.storage.close()
+
+
+def spawned(sent):
+    return [data['boss']['boss_id'] for _, kind, data in sent if kind == 'boss_spawned']
+
+
+def test_counter_crossing_threshold_spawns_boss_once(watched_player):
+    player, sent = watched_player
+    for _ in range(2):
+        with player.transaction() as tx:
+            tx.data['perfectionism_blocks'] = tx.data.get('perfectionism_blocks', 0) + 1
+    assert spawned(sent) == []
+
+    with player.transaction() as tx:
+        tx.data['perfectionism_blocks'] += 1
+    assert spawned(sent) == ['accountant_deadlines']
+
+    # Ни транзакции без изменений, ни дальнейший рост счётчика не вызывают босса снова
+    for _ in range(3):
+        with player.transaction() as tx:
+            tx.data['stability_points'] += 1
+        with player.transaction() as tx:
+            tx.data['perfectionism_blocks'] += 1
+    assert spawned(sent) == ['accountant_deadlines']
+    assert player.data['active_bosses'] == ['accountant_deadlines']
+    assert player.data['unchecked_bosses'] == ['accountant_deadlines']
+    assert 'accountant_deadlines' in player.data['boss_penalties']
+
+
+def test_acknowledge_bosses():
+    manager = bosses.BossesManager()
+    player_data = {'active_bosses': ['accountant_deadlines', 'collector_anxiety'],
+                   'unchecked_bosses': ['accountant_deadlines', 'collector_anxiety', 'archivist_noise']}
+    # Побеждённый до подтверждения босс не показывается
+    assert [boss['boss_id'] for boss in manager.new_bosses(player_data)] == ['accountant_deadlines', 'collector_anxiety']
+
+    assert manager.acknowledge_bosses(player_data, ['accountant_deadlines']) is True
+    assert player_data['unchecked_bosses'] == ['collector_anxiety', 'archivist_noise']
+    assert manager.acknowledge_bosses(player_data, ['accountant_deadlines']) is False
+    assert manager.acknowledge_bosses(player_data) is True
+    assert 'unchecked_bosses' not in player_data
+    assert manager.new_bosses(player_data) == []
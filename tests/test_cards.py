@@ -0,0 +1,130 @@
+"""
+Тесты доступности карт: инкрементальный индекс против полного обхода базы
+"""
+import json
+import random
+
+import pytest
+
+import cards
+import storage
+
+
+ACTIONS = [f"action_{i}" for i in range(8)]
+DISTRICTS = ['oasis', 'forum', 'citadel']
+LEVELS = [f"level_{i}" for i in range(6)]
+
+
+def baseline_check(condition, player_data) -> bool:
+    """Прежняя проверка условия: разбор JSON на каждом вызове"""
+    if not condition:
+        return True
+    kind = condition.get('type')
+    if kind == 'action':
+        return player_data.get('actions_history', {}).get(condition.get('action'), 0) >= condition.get('count', 1)
+    if kind == 'sessions_in_district':
+        return player_data.get('district_sessions', {}).get(condition.get('district'), 0) >= condition.get('count')
+    if kind == 'complete_level':
+        return condition.get('level') in player_data.get('completed_levels', [])
+    if kind == 'stability_points':
+        return player_data.get('stability_points', 0) >= condition.get('amount')
+    if kind == 'combined':
+        return all(baseline_check(inner, player_data) for inner in condition.get('conditions', []))
+    if kind == 'contract_completion':
+        return condition.get('contract') in player_data.get('completed_contracts', [])
+    return False
+
+
+def full_scan(manager: cards.CardsManager, player_data) -> list:
+    """Прежний get_available_cards: обход всей базы"""
+    owned = player_data.get('owned_cards', [])
+    return [
+        card for card_id, card in manager.cards_db.items()
+        if card_id not in owned and baseline_check(card.get('unlock_condition'), player_data)
+    ]
+
+
+def random_condition(rng: random.Random, depth: int = 0):
+    kind = rng.choice(['action', 'sessions_in_district', 'complete_level', 'stability_points',
+                       'contract_completion', 'empty', 'combined' if depth < 2 else 'action'])
+    if kind == 'action':
+        return {'type': 'action', 'action': rng.choice(ACTIONS), 'count': rng.randint(1, 6)}
+    if kind == 'sessions_in_district':
+        return {'type': 'sessions_in_district', 'district': rng.choice(DISTRICTS), 'count': rng.randint(1, 5)}
+    if kind == 'complete_level':
+        return {'type': 'complete_level', 'level': rng.choice(LEVELS)}
+    if kind == 'stability_points':
+        return {'type': 'stability_points', 'amount': rng.randint(5, 120)}
+    if kind == 'contract_completion':
+        return {'type': 'contract_completion', 'contract': f"contract_{rng.randint(0, 4)}"}
+    if kind == 'empty':
+        return {}
+    return {'type': 'combined', 'conditions': [random_condition(rng, depth + 1) for _ in range(rng.randint(2, 3))]}
+
+
+@pytest.fixture
+def manager(tmp_path):
+    rng = random.Random(20)
+    path = tmp_path / 'cards.json'
+    path.write_text(json.dumps({'cards': [
+        {'card_id': f"card_{i}", 'type': 'skill', 'effort_cost': 1, 'unlock_condition': random_condition(rng)}
+        for i in range(150)
+    ]}), encoding='utf-8')
+    return cards.CardsManager(str(path))
+
+
+def step(player_data, rng: random.Random, available: list):
+    """Один игровой шаг: счётчики растут, уровни и контракты закрываются, карты открываются и расходуются"""
+    roll = rng.random()
+    if roll < 0.4:
+        action = rng.choice(ACTIONS)
+        player_data['actions_history'][action] = player_data['actions_history'].get(action, 0) + 1
+    elif roll < 0.55:
+        district = rng.choice(DISTRICTS)
+        player_data['district_sessions'][district] = player_data['district_sessions'].get(district, 0) + 1
+    elif roll < 0.7:
+        player_data['stability_points'] += rng.randint(-10, 15)
+    elif roll < 0.78:
+        player_data['completed_levels'].append(rng.choice(LEVELS))
+    elif roll < 0.84:
+        player_data.setdefault('completed_contracts', []).append(f"contract_{rng.randint(0, 4)}")
+    elif roll < 0.94 and available:
+        player_data['owned_cards'].append(rng.choice(available)['card_id'])
+    elif player_data['owned_cards']:
+        player_data['owned_cards'].remove(rng.choice(player_data['owned_cards']))
+
+
+def test_incremental_matches_full_scan(manager):
+    rng = random.Random(3)
+    players = [storage._default_player_data(f"p{i}") for i in range(3)]
+    for _ in range(600):
+        player_data = rng.choice(players)
+        available = manager.get_available_cards(player_data)
+        assert available == full_scan(manager, player_data)
+        step(player_data, rng, available)
+    for player_data in players:
+        assert manager.get_available_cards(player_data) == full_scan(manager, player_data)
+
+
+def test_available_changes_track_full_scan(manager):
+    rng = random.Random(5)
+    player_data = storage._default_player_data('changes')
+    added, removed = manager.available_changes(player_data)
+    assert (added, removed) == ([], [])
+    known = {card['card_id'] for card in full_scan(manager, player_data)}
+
+    for _ in range(300):
+        step(player_data, rng, full_scan(manager, player_data))
+        added, removed = manager.available_changes(player_data)
+        assert not {card['card_id'] for card in added} & known
+        assert set(removed) <= known
+        known = (known | {card['card_id'] for card in added}) - set(removed)
+        assert known == {card['card_id'] for card in full_scan(manager, player_data)}
+
+
+def test_player_without_id_is_not_cached(manager):
+    player_data = storage._default_player_data('')
+    player_data['player_id'] = None
+    assert manager.get_available_cards(player_data) == full_scan(manager, player_data)
+    player_data['stability_points'] = 500
+    assert manager.get_available_cards(player_data) == full_scan(manager, player_data)
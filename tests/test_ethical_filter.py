@@ -0,0 +1,125 @@
+"""
+Тесты этического фильтра и проверки ответов модели
+"""
+import pytest
+
+import agent
+import config
+import ethical_filter
+import game_engine
+
+
+# Сочувственные ответы, повторяющие слова игрока, — не повод прятать ответ
+EMPATHIC_REPLIES = [
+    'Ты говоришь, что не хочешь жить, и я слышу, как тебе тяжело.',
+    'Понимаю, что ты не можешь больше так продолжать.',
+    'Когда кажется, что не видишь смысла, важно не оставаться с этим одному.',
+    'Ты пишешь «больше не выдержу» — давай разберёмся, что стоит за этим.',
+]
+
+UNSAFE_REPLIES = [
+    'Смертельная доза этого препарата составляет...',
+    'Есть способ покончить с этим быстро...',
+    'Вот как убить себя без боли...',
+]
+
+
+@pytest.fixture
+def crisis_filter():
+    return ethical_filter.EthicalFilter()
+
+
+@pytest.mark.parametrize('reply', EMPATHIC_REPLIES)
+def test_output_filter_ignores_empathic_replies(crisis_filter, reply):
+    assert crisis_filter.check_output(reply) is None
+
+
+@pytest.mark.parametrize('reply', UNSAFE_REPLIES)
+def test_output_filter_catches_methods(crisis_filter, reply):
+    assert crisis_filter.check_output(reply) is not None
+
+
+CRISIS_MESSAGES = [
+    'Я не хочу жить',
+    'Мне не хочется жить',
+    'не могу больше',
+    'не вижу смысла ни в чём',
+    'Больше НЕ ВЫДЕРЖУ!!!',
+    'Не хочу... жить',
+    'ne hochu zhit',
+    'думаю о самоубийстве',
+    'иногда хочу покончить с собой',
+    'кажется, я покончу с собой',
+]
+
+# Другое время или лицо того же глагола — обычные фразы, а не кризис
+EVERYDAY_MESSAGES = [
+    'я не выдержал экзамен',
+    'она не выдержала и рассмеялась',
+    'мост не выдержит такой нагрузки',
+    'он не может больше ждать автобус',
+    'я не видел смысла в этом фильме',
+    'я не хотел жить в общежитии',
+]
+
+
+@pytest.mark.parametrize('message', CRISIS_MESSAGES)
+def test_player_crisis_phrases_detected(crisis_filter, message):
+    assert crisis_filter.check_message(message)[0]
+
+
+@pytest.mark.parametrize('message', EVERYDAY_MESSAGES)
+def test_other_tense_or_person_is_not_crisis(crisis_filter, message):
+    assert not crisis_filter.check_message(message)[0]
+
+
+def test_stem_keeps_verb_form():
+    assert ethical_filter.stem('выдержу') != ethical_filter.stem('выдержал')
+    assert ethical_filter.stem('выдержал') == ethical_filter.stem('выдержала')
+    assert ethical_filter.stem('смысла') == ethical_filter.stem('смысл')
+
+
+class ScriptedLLM:
+    """Исполнитель запросов с заранее заданным ответом"""
+
+    def __init__(self, reply: str):
+        self.reply = reply
+
+    def chat(self, messages, **params):
+        return self.reply
+
+    def stream_chat(self, messages, **params):
+        for index in range(0, len(self.reply), 7):
+            yield self.reply[index:index + 7]
+
+
+@pytest.fixture
+def aira(saves_dir, monkeypatch):
+    monkeypatch.setattr(config, 'LLM_CACHE_ENABLED', False)
+    monkeypatch.setattr(config, 'FILTER_LLM_OUTPUT', True)
+    player = game_engine.Player('filter')
+    yield agent.AgentAira(player)
+    player.storage.close()
+
+
+@pytest.mark.parametrize('stream', [False, True])
+def test_empathic_reply_is_shown_without_blocking(aira, stream):
+    reply = EMPATHIC_REPLIES[0]
+    aira.llm = ScriptedLLM(reply)
+    result = aira.generate_response('Мне грустно', stream=stream)
+    if stream:
+        result = list(result)[-1]
+    assert result['response'] == reply
+    assert not result['is_crisis']
+    assert not result['block_game']
+
+
+@pytest.mark.parametrize('stream', [False, True])
+def test_unsafe_reply_is_replaced_without_blocking(aira, stream):
+    aira.llm = ScriptedLLM(UNSAFE_REPLIES[0])
+    result = aira.generate_response('Мне грустно', stream=stream)
+    if stream:
+        result = list(result)[-1]
+    assert result['response'] == aira.filter.get_output_replacement()
+    assert not result['is_crisis']
+    assert not result['block_game']
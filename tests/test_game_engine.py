@@ -0,0 +1,192 @@
+"""
+Тесты транзакций игрока (Player.transaction)
+"""
+import json
+import threading
+
+import pytest
+
+import config
+import game_engine
+import storage
+
+
+@pytest.fixture
+def player(saves_dir, monkeypatch):
+    """Игрок с синхронной записью: после фиксации изменения уже на диске"""
+    monkeypatch.setattr(config, 'SAVE_WRITE_BEHIND', False)
+    monkeypatch.setattr(game_engine, 'observers', [])
+    player = game_engine.Player('tx')
+    yield player
+    player.storage.close()
+
+
+@pytest.fixture
+def published(monkeypatch):
+    """События, отправленные клиенту: (игрок, тип, данные)"""
+    sent = []
+    monkeypatch.setattr(game_engine.events, 'publish', lambda *event: sent.append(event))
+    return sent
+
+
+def saved(player):
+    with open(player.storage.save_file, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def counting_saves(player, monkeypatch):
+    calls = []
+    original = player.storage.save_player
+
+    def save_player(data):
+        calls.append(dict(data))
+        return original(data)
+    monkeypatch.setattr(player.storage, 'save_player', save_player)
+    return calls
+
+
+def test_commit_writes_once(player, monkeypatch):
+    saves = counting_saves(player, monkeypatch)
+    with player.transaction() as tx:
+        tx.data['stability_points'] += 4
+        tx.data['effort'] = 2
+    assert tx.committed
+    assert len(saves) == 1
+    assert saved(player)['stability_points'] == 4
+
+
+def test_exception_reloads_and_discards_changes(player):
+    assert player.add_points(2)
+    with pytest.raises(ValueError):
+        with player.transaction() as tx:
+            tx.data['stability_points'] += 100
+            tx.data['districts']['forum']['unlocked'] = True
+            raise ValueError('сбой')
+    assert not tx.committed
+    assert player.get_stability_points() == 2
+    assert not player.can_access_district('forum')
+    assert saved(player)['stability_points'] == 2
+
+
+def test_cancel_skips_write(player, monkeypatch):
+    assert player.add_points(1)
+    saves = counting_saves(player, monkeypatch)
+    with player.transaction() as tx:
+        tx.cancel()
+    assert not tx.committed
+    assert saves == []
+
+
+def test_nested_transactions_share_data_and_write_once(player, monkeypatch):
+    saves = counting_saves(player, monkeypatch)
+    with player.transaction() as outer:
+        outer.data['stability_points'] += 1
+        assert player.level_up_district('oasis')
+        with player.transaction() as inner:
+            assert inner.data is outer.data
+            inner.data['effort'] = 5
+        # Вложенная транзакция не пишет сама
+        assert saves == []
+    assert len(saves) == 1
+    on_disk = saved(player)
+    assert on_disk['stability_points'] == 1
+    assert on_disk['effort'] == 5
+    assert on_disk['districts']['oasis']['level'] == 1
+
+
+def test_exception_in_nested_transaction_rolls_back_outer(player):
+    with pytest.raises(RuntimeError):
+        with player.transaction() as tx:
+            tx.data['stability_points'] += 10
+            with player.transaction():
+                player.data['effort'] = 9
+                raise RuntimeError('сбой во вложенной')
+    assert player.get_stability_points() == 0
+    assert player.data.get('effort', 0) == 0
+
+
+def test_observer_events_published_after_commit(player, published, monkeypatch):
+    seen_on_disk = []
+
+    def observer(data, before):
+        return [('progress_delta', {'from': before['stability_points'], 'to': data['stability_points']})]
+    def publish(*event):
+        seen_on_disk.append(saved(player)['stability_points'])
+        published.append(event)
+    monkeypatch.setattr(game_engine, 'observers', [observer])
+    monkeypatch.setattr(game_engine.events, 'publish', publish)
+
+    assert player.add_points(3)
+    assert published == [('tx', 'progress_delta', {'from': 0, 'to': 3})]
+    # К моменту публикации запись уже на диске
+    assert seen_on_disk == [3]
+
+
+def test_observer_events_dropped_without_commit(player, published, monkeypatch):
+    monkeypatch.setattr(game_engine, 'observers', [lambda data, before: [('progress_delta', {})]])
+
+    with player.transaction() as tx:
+        tx.cancel()
+    with pytest.raises(ValueError):
+        with player.transaction() as tx:
+            tx.data['stability_points'] += 1
+            raise ValueError('сбой')
+    monkeypatch.setattr(player.storage, 'save_player', lambda data: False)
+    with player.transaction() as tx:
+        tx.data['stability_points'] += 1
+    assert not tx.committed
+
+    assert published == []
+
+
+def test_observer_changes_go_into_same_write(player, published, monkeypatch):
+    def observer(data, before):
+        data['observed'] = data['stability_points']
+        return []
+    monkeypatch.setattr(game_engine, 'observers', [observer])
+    saves = counting_saves(player, monkeypatch)
+
+    assert player.add_points(6)
+    assert len(saves) == 1
+    assert saved(player)['observed'] == 6
+
+
+def test_registry_waits_for_evicted_player_to_close(saves_dir, monkeypatch):
+    monkeypatch.setattr(config, 'SAVE_WRITE_BEHIND', True)
+    registry = game_engine.PlayerRegistry(capacity=1)
+    first = registry.acquire('a')
+    assert first.add_points(5)
+    registry.release(first)
+
+    closing, proceed = threading.Event(), threading.Event()
+    original_close = first.storage.close
+
+    def slow_close():
+        closing.set()
+        proceed.wait(5)
+        return original_close()
+    monkeypatch.setattr(first.storage, 'close', slow_close)
+
+    acquired = {}
+    evicting = threading.Thread(target=lambda: acquired.setdefault('b', registry.acquire('b')))
+    evicting.start()
+    assert closing.wait(5)
+
+    returning = threading.Thread(target=lambda: acquired.setdefault('a', registry.acquire('a')))
+    returning.start()
+    returning.join(0.2)
+    # Пока старый экземпляр закрывается, новый не создаётся
+    assert returning.is_alive()
+
+    proceed.set()
+    evicting.join(5)
+    returning.join(5)
+
+    second = acquired['a']
+    assert second is not first
+    assert second.get_stability_points() == 5
+    assert storage._save_files.get(second.storage.save_file) is not None
+    assert second.storage.add_session({'district': 'oasis'})
+    assert second.add_points(1)
+    assert second.storage.close()
+    acquired['b'].storage.close()
@@ -0,0 +1,115 @@
+"""
+Тесты журнала добавлений (session_history, agent_memory) и его сворачивания в снимок
+"""
+import json
+import os
+
+import pytest
+
+import config
+import storage
+
+
+@pytest.fixture
+def journaled(saves_dir, monkeypatch):
+    """Хранилище с синхронной записью и без фонового сворачивания"""
+    monkeypatch.setattr(config, 'SAVE_WRITE_BEHIND', False)
+    monkeypatch.setattr(config, 'MEMORY_WRITE_BEHIND', False)
+    monkeypatch.setattr(config, 'JOURNAL_COMPACT_THRESHOLD', 10 ** 6)
+    target = storage.Storage('journal')
+    assert target.save_player(target.load_player())
+    yield target
+    target.close()
+
+
+def restart(target: storage.Storage) -> storage.Storage:
+    """Забывает состояние файла в процессе, как после перезапуска"""
+    state = storage._save_files.pop(target.save_file)
+    state.close()
+    return storage.Storage(target.player_id)
+
+
+def journal_records(target: storage.Storage):
+    path = target._journal().path
+    if not os.path.exists(path):
+        return []
+    with open(path, encoding='utf-8') as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def snapshot(target: storage.Storage):
+    with open(target.save_file, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def test_append_writes_journal_not_snapshot(journaled):
+    assert journaled.add_session({'district': 'oasis'})
+    assert journaled.add_agent_memory('заметка')
+
+    records = journal_records(journaled)
+    assert [(record['seq'], record['field']) for record in records] == \
+        [(1, 'session_history'), (2, 'agent_memory')]
+    assert snapshot(journaled)['session_history'] == []
+    assert [entry['text'] for entry in journaled.get_entries('agent_memory')] == ['заметка']
+
+
+def test_journal_replayed_on_load(journaled):
+    for n in range(3):
+        assert journaled.add_session({'n': n})
+
+    reloaded = restart(journaled)
+    data = reloaded.load_player()
+    assert [entry['n'] for entry in data['session_history']] == [0, 1, 2]
+    assert data['journal_seq'] == 3
+    assert [entry['n'] for entry in reloaded.get_entries('session_history', 2)] == [1, 2]
+
+
+def test_entries_trimmed_to_limits(journaled):
+    limit = storage.JOURNALED_FIELDS['agent_memory']
+    for n in range(limit + 5):
+        assert journaled.add_agent_memory(str(n))
+
+    expected = [str(n) for n in range(5, limit + 5)]
+    assert [entry['text'] for entry in journaled.get_entries('agent_memory')] == expected
+    data = restart(journaled).load_player()
+    assert [entry['text'] for entry in data['agent_memory']] == expected
+
+
+def test_compaction_folds_journal_into_snapshot(journaled):
+    for n in range(4):
+        assert journaled.add_session({'n': n})
+
+    journaled._compact()
+
+    assert journal_records(journaled) == []
+    on_disk = snapshot(journaled)
+    assert [entry['n'] for entry in on_disk['session_history']] == [0, 1, 2, 3]
+    assert on_disk['journal_seq'] == 4
+    assert [entry['n'] for entry in restart(journaled).load_player()['session_history']] == [0, 1, 2, 3]
+
+
+def test_crash_between_snapshot_and_truncate_does_not_duplicate(journaled, monkeypatch):
+    for n in range(3):
+        assert journaled.add_session({'n': n})
+
+    # Снимок записан, а очистка журнала не успела выполниться
+    with monkeypatch.context() as patched:
+        patched.setattr(storage.PlayerJournal, 'truncate', lambda self, folded_seq: None)
+        journaled._compact()
+    assert len(journal_records(journaled)) == 3
+    assert snapshot(journaled)['journal_seq'] == 3
+
+    reloaded = restart(journaled)
+    assert [entry['n'] for entry in reloaded.load_player()['session_history']] == [0, 1, 2]
+    assert reloaded.add_session({'n': 3})
+    assert journal_records(reloaded)[-1]['seq'] == 4
+    assert [entry['n'] for entry in restart(reloaded).load_player()['session_history']] == [0, 1, 2, 3]
+
+
+def test_torn_journal_line_is_dropped(journaled):
+    assert journaled.add_session({'n': 0})
+    with open(journaled._journal().path, 'a', encoding='utf-8') as f:
+        f.write('{"seq": 2, "field": "session_hist')
+
+    data = restart(journaled).load_player()
+    assert [entry['n'] for entry in data['session_history']] == [0]
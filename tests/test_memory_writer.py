@@ -0,0 +1,105 @@
+"""
+Тесты фоновой записи памяти агента (MemoryWriter)
+"""
+import threading
+import time
+
+import storage
+
+
+class RecordingStorage:
+    """Хранилище, которое только запоминает пачки записей"""
+
+    def __init__(self, player_id: str = 'writer'):
+        self.player_id = player_id
+        self.batches = []
+
+    def _writer_key(self) -> str:
+        return self.player_id
+
+    def _append_entries(self, entries) -> bool:
+        self.batches.append(list(entries))
+        return True
+
+
+def stalled_writer(policy: str, max_pending: int = 2, block_timeout: float = 0.2) -> storage.MemoryWriter:
+    """Очередь без фонового потока: записи копятся, пока их не сбросит flush()"""
+    writer = storage.MemoryWriter(max_pending, policy, block_timeout)
+    writer._ensure_thread = lambda: None
+    return writer
+
+
+def test_queued_entries_visible_and_flushed_in_one_batch():
+    writer = stalled_writer('sync', max_pending=10)
+    target = RecordingStorage()
+    for n in range(3):
+        assert writer.submit(target, 'agent_memory', {'n': n})
+    writer.submit(target, 'session_history', {'s': 1})
+
+    assert writer.pending('writer', 'agent_memory') == [{'n': 0}, {'n': 1}, {'n': 2}]
+    assert target.batches == []
+
+    assert writer.flush('writer')
+    assert target.batches == [[('agent_memory', {'n': n}) for n in range(3)] + [('session_history', {'s': 1})]]
+    assert writer.pending('writer', 'agent_memory') == []
+
+
+def test_sync_policy_writes_in_caller_when_full():
+    writer = stalled_writer('sync')
+    target = RecordingStorage()
+    assert writer.submit(target, 'agent_memory', 1)
+    assert writer.submit(target, 'agent_memory', 2)
+
+    assert writer.submit(target, 'agent_memory', 3)
+    assert target.batches == [[('agent_memory', 3)]]
+    assert writer.pending('writer', 'agent_memory') == [1, 2]
+
+
+def test_drop_policy_discards_when_full():
+    writer = stalled_writer('drop')
+    target = RecordingStorage()
+    assert writer.submit(target, 'agent_memory', 1)
+    assert writer.submit(target, 'agent_memory', 2)
+
+    assert not writer.submit(target, 'agent_memory', 3)
+    assert writer.dropped == 1
+    assert target.batches == []
+    assert writer.pending('writer', 'agent_memory') == [1, 2]
+
+
+def test_block_policy_times_out_then_writes_synchronously():
+    writer = stalled_writer('block', block_timeout=0.1)
+    target = RecordingStorage()
+    writer.submit(target, 'agent_memory', 1)
+    writer.submit(target, 'agent_memory', 2)
+
+    started = time.monotonic()
+    assert writer.submit(target, 'agent_memory', 3)
+    assert time.monotonic() - started >= 0.1
+    assert target.batches == [[('agent_memory', 3)]]
+
+
+def test_block_policy_queues_once_space_frees():
+    writer = stalled_writer('block', block_timeout=5)
+    target = RecordingStorage()
+    writer.submit(target, 'agent_memory', 1)
+    writer.submit(target, 'agent_memory', 2)
+
+    threading.Timer(0.05, writer.flush).start()
+    assert writer.submit(target, 'agent_memory', 3)
+
+    assert target.batches == [[('agent_memory', 1), ('agent_memory', 2)]]
+    assert writer.pending('writer', 'agent_memory') == [3]
+
+
+def test_background_thread_drains_queue():
+    writer = storage.MemoryWriter(100, 'sync', 1.0)
+    first, second = RecordingStorage('a'), RecordingStorage('b')
+    for n in range(5):
+        writer.submit(first, 'agent_memory', n)
+        writer.submit(second, 'agent_memory', n)
+
+    assert writer.flush()
+    for target in (first, second):
+        assert [entry for batch in target.batches for _, entry in batch] == list(range(5))
+    assert writer.pending('a', 'agent_memory') == []
@@ -0,0 +1,101 @@
+"""
+Тесты миграций схемы сохранения
+"""
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+import config
+import storage
+
+
+# Сохранение времён первой версии: без schema_version, карт, боссов и счётчиков кварталов
+OLD_SAVE = {
+    'player_id': 'veteran',
+    'version': 3,
+    'stability_points': 42,
+    'districts': {
+        'oasis': {'level': 2, 'unlocked': True, 'name': 'Оазис'},
+        'forum': {'level': 0, 'unlocked': False, 'name': 'Форум'},
+    },
+    'session_history': [{'district': 'oasis'}],
+    'agent_memory': [],
+}
+
+
+@pytest.fixture
+def old_save(saves_dir):
+    path = os.path.join(str(saves_dir), 'veteran.json')
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(OLD_SAVE, f, ensure_ascii=False)
+    return path
+
+
+@pytest.fixture
+def step_calls(monkeypatch):
+    """Сколько раз вызван каждый шаг миграции"""
+    calls = {version: 0 for version in storage.MIGRATIONS}
+    for version, step in list(storage.MIGRATIONS.items()):
+        def counted(data, step=step, version=version):
+            calls[version] += 1
+            step(data)
+        monkeypatch.setitem(storage.MIGRATIONS, version, counted)
+    return calls
+
+
+def read(path):
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def restart(target: storage.Storage) -> storage.Storage:
+    storage._save_files.pop(target.save_file).close()
+    return storage.Storage(target.player_id)
+
+
+def test_old_save_migrated_once_and_written_back(old_save, step_calls, monkeypatch):
+    monkeypatch.setattr(config, 'SAVE_WRITE_BEHIND', False)
+    target = storage.Storage('veteran')
+    data = target.load_player()
+
+    assert step_calls == {version: 1 for version in storage.MIGRATIONS}
+    assert data['stability_points'] == 42
+    assert data['owned_cards'] == []
+    assert data['districts']['oasis']['sessions_count'] == 0
+
+    on_disk = read(old_save)
+    assert on_disk['schema_version'] == storage.SCHEMA_VERSION
+    assert on_disk['version'] == OLD_SAVE['version'] + 1
+    assert on_disk['districts']['oasis']['level'] == 2
+
+    # Повторные загрузки (и после перезапуска) миграцию не выполняют
+    target.load_player()
+    target = restart(target)
+    target.load_player()
+    assert step_calls == {version: 1 for version in storage.MIGRATIONS}
+    assert read(old_save)['version'] == OLD_SAVE['version'] + 1
+    target.close()
+
+
+def test_migrate_all_saves(old_save, saves_dir):
+    assert storage.migrate_all_saves(str(saves_dir), workers=1) == {'veteran': 'migrated'}
+    on_disk = read(old_save)
+    assert on_disk['schema_version'] == storage.SCHEMA_VERSION
+    assert on_disk['version'] == OLD_SAVE['version'] + 1
+
+    assert storage.migrate_all_saves(str(saves_dir), workers=1) == {'veteran': 'current'}
+    assert read(old_save)['version'] == OLD_SAVE['version'] + 1
+
+
+def test_migrate_command(old_save, saves_dir):
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    result = subprocess.run(
+        [sys.executable, 'storage.py', 'migrate', '--saves-dir', str(saves_dir), '--workers', '1'],
+        cwd=root, capture_output=True, text=True, timeout=60
+    )
+    assert result.returncode == 0, result.stderr
+    assert 'veteran: migrated' in result.stdout
+    assert read(old_save)['schema_version'] == storage.SCHEMA_VERSION
@@ -0,0 +1,88 @@
+"""
+Тесты кеша ответов LLM
+"""
+import pytest
+
+import response_cache
+
+
+class FakeClock:
+    """Подменяет модуль time в response_cache: время двигается вручную"""
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake = FakeClock()
+    monkeypatch.setattr(response_cache, 'time', fake)
+    return fake
+
+
+def entry_size(key: str, response: str) -> int:
+    return len(response.encode('utf-8')) + len(key)
+
+
+def test_key_normalizes_case_and_whitespace():
+    assert response_cache.make_key('Привет,  Айра\n', 'Оазис') == response_cache.make_key('привет, айра', 'оазис')
+    assert response_cache.make_key('a', 'bc') != response_cache.make_key('ab', 'c')
+
+
+def test_entry_expires_after_ttl(clock):
+    cache = response_cache.ResponseCache(ttl=10, max_bytes=1024)
+    cache.put('k', 'ответ', latency=2.0)
+
+    clock.now += 10
+    assert cache.get('k') == 'ответ'
+    clock.now += 0.5
+    assert cache.get('k') is None
+
+    stats = cache.stats()
+    assert stats['hits'] == 1
+    assert stats['expired'] == 1
+    assert stats['entries'] == 0
+    assert stats['bytes'] == 0
+    assert stats['saved_provider_seconds'] == 2.0
+
+
+def test_least_recently_used_evicted_by_byte_cap(clock):
+    cap = entry_size('a', 'x' * 10) * 3
+    cache = response_cache.ResponseCache(ttl=60, max_bytes=cap)
+    for key in 'abc':
+        cache.put(key, 'x' * 10)
+    # Обращение к a делает её свежей — вытесняется b
+    assert cache.get('a') is not None
+    cache.put('d', 'x' * 10)
+
+    assert cache.get('b') is None
+    assert all(cache.get(key) is not None for key in 'acd')
+    assert cache.stats()['evictions'] == 1
+    assert cache.stats()['bytes'] == cap
+
+
+def test_large_entry_evicts_several_and_oversized_is_skipped(clock):
+    cap = entry_size('a', 'x' * 10) * 3
+    cache = response_cache.ResponseCache(ttl=60, max_bytes=cap)
+    for key in 'abc':
+        cache.put(key, 'x' * 10)
+
+    cache.put('big', 'я' * 10)  # 20 байт в UTF-8 + ключ
+    assert cache.get('a') is None and cache.get('b') is None
+    assert cache.get('big') is not None
+    assert cache.stats()['bytes'] <= cap
+
+    cache.put('huge', 'x' * cap)
+    assert cache.get('huge') is None
+    assert cache.get('big') is not None
+
+
+def test_put_replaces_entry_without_leaking_bytes(clock):
+    cache = response_cache.ResponseCache(ttl=60, max_bytes=1024)
+    cache.put('k', 'один')
+    cache.put('k', 'два')
+    assert cache.get('k') == 'два'
+    assert cache.stats()['bytes'] == entry_size('k', 'два')
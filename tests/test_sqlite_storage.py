@@ -0,0 +1,115 @@
+"""
+Тесты SQLite-хранилища: построчная запись списков, слияние версий, точечные обновления
+"""
+import pytest
+
+import config
+import sqlite_storage
+import storage
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    return str(tmp_path / 'innerquest.db')
+
+
+def list_rows(target: sqlite_storage.SQLiteStorage, table: str):
+    return target.conn.execute(
+        f'SELECT id, data FROM {table} WHERE player_id = ? ORDER BY id', (target.player_id,)
+    ).fetchall()
+
+
+def test_append_with_trim_keeps_existing_rows(db_path):
+    limit = sqlite_storage.LIST_TABLES['session_history']
+    target = sqlite_storage.SQLiteStorage('trim', db_path=db_path)
+    data = target.load_player()
+    data['session_history'] = [{'n': n} for n in range(limit)]
+    assert target.save_player(data)
+    before = list_rows(target, 'session_history')
+
+    data['session_history'] = data['session_history'][1:] + [{'n': limit}]
+    assert target.save_player(data)
+    after = list_rows(target, 'session_history')
+
+    # Вытеснена одна строка из начала, добавлена одна в конец, остальные не тронуты
+    assert after[:-1] == before[1:]
+    assert after[-1][0] > before[-1][0]
+    assert sqlite_storage.SQLiteStorage('trim', db_path=db_path).load_player()['session_history'] == \
+        [{'n': n} for n in range(1, limit + 1)]
+
+
+def test_reordered_list_is_rewritten(db_path):
+    target = sqlite_storage.SQLiteStorage('reorder', db_path=db_path)
+    data = target.load_player()
+    data['agent_memory'] = [{'text': str(n)} for n in range(5)]
+    assert target.save_player(data)
+
+    data['agent_memory'] = list(reversed(data['agent_memory']))
+    assert target.save_player(data)
+
+    assert [value for _, value in list_rows(target, 'agent_memory')] == \
+        [sqlite_storage._dumps({'text': str(n)}) for n in reversed(range(5))]
+    reloaded = sqlite_storage.SQLiteStorage('reorder', db_path=db_path).load_player()
+    assert reloaded['agent_memory'] == [{'text': str(n)} for n in reversed(range(5))]
+
+
+def test_concurrent_version_bump_is_merged(db_path):
+    ours = sqlite_storage.SQLiteStorage('merge', db_path=db_path)
+    data = ours.load_player()
+    data['stability_points'] = 10
+    assert ours.save_player(data)
+
+    # Другой писатель поднимает версию точечными обновлениями
+    theirs = sqlite_storage.SQLiteStorage('merge', db_path=db_path)
+    theirs.load_player()
+    assert theirs.update_points(5)
+    assert theirs.unlock_district('forum')
+
+    data['stability_points'] += 3
+    data['goals'] = ['бег']
+    assert ours.save_player(data)
+
+    reloaded = sqlite_storage.SQLiteStorage('merge', db_path=db_path).load_player()
+    assert reloaded['stability_points'] == 18
+    assert reloaded['goals'] == ['бег']
+    assert reloaded['districts']['forum']['unlocked'] is True
+    assert reloaded['version'] == data['version']
+
+
+def test_point_updates_change_one_row_and_bump_version(db_path):
+    target = sqlite_storage.SQLiteStorage('points', db_path=db_path)
+    assert target.save_player(target.load_player())
+    version = target._db_version(target.conn)
+
+    assert target.level_up_district('oasis')
+    assert target.level_up_district('oasis')
+    assert target.unlock_district('forum')
+    assert not target.unlock_district('missing')
+
+    reloaded = sqlite_storage.SQLiteStorage('points', db_path=db_path).load_player()
+    assert reloaded['districts']['oasis']['level'] == 2
+    assert reloaded['districts']['forum']['unlocked'] is True
+    assert reloaded['districts']['oasis']['name'] == 'Оазис'
+    assert reloaded['version'] == version + 3
+
+
+def test_migrate_json_saves_overlays_journal(saves_dir, db_path, monkeypatch):
+    monkeypatch.setattr(config, 'SAVE_WRITE_BEHIND', False)
+    monkeypatch.setattr(config, 'MEMORY_WRITE_BEHIND', False)
+    source = storage.Storage('journaled')
+    data = source.load_player()
+    data['stability_points'] = 7
+    assert source.save_player(data)
+    # Записи только в журнале, снимок их ещё не содержит
+    assert source.add_session({'district': 'oasis'})
+    assert source.add_agent_memory('первая запись')
+
+    results = sqlite_storage.migrate_json_saves(str(saves_dir), db_path)
+    source.close()
+
+    assert results == {'journaled': 'migrated'}
+    migrated = sqlite_storage.SQLiteStorage('journaled', db_path=db_path).load_player()
+    assert migrated['stability_points'] == 7
+    assert [entry['district'] for entry in migrated['session_history']] == ['oasis']
+    assert [entry['text'] for entry in migrated['agent_memory']] == ['первая запись']
+    assert sqlite_storage.migrate_json_saves(str(saves_dir), db_path) == {'journaled': 'skipped'}
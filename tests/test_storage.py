@@ -0,0 +1,81 @@
+"""
+Тесты хранилища и транзакций игрока
+"""
+import os
+
+import pytest
+
+import config
+import game_engine
+import serializers
+
+
+@pytest.mark.parametrize('write_behind', [True, False])
+def test_transaction_rollback_after_exception(saves_dir, monkeypatch, write_behind):
+    monkeypatch.setattr(config, 'SAVE_WRITE_BEHIND', write_behind)
+    player = game_engine.Player('rollback')
+    try:
+        assert player.add_points(5)
+
+        with pytest.raises(RuntimeError):
+            with player.transaction() as tx:
+                tx.data['marker'] = True
+                tx.data['stability_points'] += 100
+                raise RuntimeError('сбой посреди транзакции')
+
+        assert 'marker' not in player.data
+        assert player.get_stability_points() == 5
+        assert 'marker' not in player.storage.load_player()
+    finally:
+        player.storage.close()
+
+
+def test_write_behind_keeps_snapshot_of_saved_data(saves_dir, monkeypatch):
+    monkeypatch.setattr(config, 'SAVE_WRITE_BEHIND', True)
+    player = game_engine.Player('snapshot')
+    try:
+        assert player.add_points(3)
+        # Изменения вне транзакции не должны попасть в отложенную запись
+        player.data['stability_points'] = 1000
+        assert player.storage.load_player()['stability_points'] == 3
+        assert player.storage.flush()
+    finally:
+        player.storage.close()
+
+    reloaded = game_engine.Player('snapshot')
+    try:
+        assert reloaded.get_stability_points() == 3
+    finally:
+        reloaded.storage.close()
+
+
+def test_write_behind_merge_is_handed_back_to_player(saves_dir, monkeypatch):
+    monkeypatch.setattr(config, 'SAVE_WRITE_BEHIND', True)
+    player = game_engine.Player('merge')
+    try:
+        assert player.add_points(5)
+        assert player.storage.flush()
+
+        assert player.add_points(1)
+        # Другой процесс записал свою версию, пока наша ждала в очереди
+        path = player.storage.save_file
+        with open(path, 'rb') as f:
+            theirs = serializers.loads(f.read())
+        theirs['stability_points'] += 10
+        theirs['achievements'] = ['first_step']
+        theirs['version'] += 1
+        replacement = os.path.join(str(saves_dir), 'other.tmp')
+        with open(replacement, 'wb') as f:
+            f.write(serializers.dumps(theirs))
+        os.replace(replacement, path)
+
+        live = player.data
+        assert player.storage.flush()
+
+        assert player.data is live
+        assert player.get_stability_points() == 16
+        assert player.data['achievements'] == ['first_step']
+        with open(path, 'rb') as f:
+            assert serializers.loads(f.read())['stability_points'] == 16
+    finally:
+        player.storage.close()